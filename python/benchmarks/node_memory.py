@@ -0,0 +1,121 @@
+# script_name: node_memory.py
+"""
+Memory benchmark for the node model: bytes per node of a synthetic tree.
+
+Builds the same tree twice without touching the disk, once with LegacyNode, a replica of the
+__dict__ based nodes (full path and revert_path strings, datetime cache timestamps, a children
+list per file), and once with the __slots__ based File/Image/Directory classes. Memory is measured
+with tracemalloc and includes the node objects, their strings, timestamps and stat integers.
+
+Run from the repository root:
+    python -m python.benchmarks.node_memory [directories] [files_per_directory]
+"""
+from __future__ import annotations
+import os
+import sys
+import gc
+import time
+import tracemalloc
+from datetime import datetime
+
+from python.model.FileSystemCache import FileSystemCache
+from python.model.FileSystemNodeModel import Directory, File, Image
+
+ROOT = '/benchmark/root'
+BASE_MTIME_NS = 1_700_000_000_000_000_000
+
+
+class LegacyNode:
+    """Replica of the attributes FileSystemNode kept in its __dict__ before nodes used __slots__."""
+
+    def __init__(self, path: str, cache, name, parent, size=None):
+        self.path = os.path.normpath(path)
+        self.name = os.path.basename(os.path.normpath(path))
+        self.revert_path = path
+        self.cache_timestamp = None
+        self.cache = cache
+        self.parent = parent
+        self.children = []
+        self.size = size
+        self.st_mtime_ns = None
+        self.st_ctime_ns = None
+        self.st_ino = None
+        self.st_dev = None
+        self.st_blocks = None
+        self.name = name
+
+
+class LegacyImage(LegacyNode):
+    """Replica of an Image node before __slots__."""
+
+    def __init__(self, path: str, cache, name, parent, size=None):
+        super().__init__(path, cache, name, parent, size)
+        self._width = None
+        self._height = None
+        self._coords = None
+        self._location = None
+        self._metadata_loaded = False
+
+
+def build_tree(directory_class, file_class, image_class, directories: int, files_per_directory: int,
+               legacy: bool) -> list:
+    """Build a two level tree the way the scanner does and return every node."""
+    cache = FileSystemCache()
+    root = directory_class(ROOT, cache, 'root', None) if legacy else \
+        directory_class(ROOT, cache, 'root', None, populate=False)
+    nodes = [root]
+    for i in range(directories):
+        # names and paths are new string objects per entry, as os.scandir returns them
+        directory_name = f'directory_{i:05d}'
+        directory_path = f'{ROOT}/{directory_name}'
+        directory = directory_class(directory_path, cache, directory_name, root) if legacy else \
+            directory_class(directory_path, cache, directory_name, root, populate=False)
+        root.children.append(directory)
+        nodes.append(directory)
+        for j in range(files_per_directory):
+            is_image = j % 4 == 0
+            name = f'IMG_{j:04d}.jpg' if is_image else f'document_{j:04d}.txt'
+            path = f'{directory_path}/{name}'
+            node_class = image_class if is_image else file_class
+            node = node_class(path, cache, name, directory, size=1024 + j)
+            ino = i * files_per_directory + j
+            node.st_mtime_ns = BASE_MTIME_NS + ino
+            node.st_ctime_ns = BASE_MTIME_NS + ino
+            node.st_ino = 10_000_000 + ino
+            node.st_dev = 2049
+            node.st_blocks = 8
+            node.cache_timestamp = datetime.now() if legacy else time.time_ns()
+            directory.children.append(node)
+            nodes.append(node)
+    return nodes
+
+
+def measure(legacy: bool, directories: int, files_per_directory: int) -> tuple:
+    """Return (node count, bytes per node) for one representation."""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    if legacy:
+        nodes = build_tree(LegacyNode, LegacyNode, LegacyImage, directories, files_per_directory, True)
+    else:
+        nodes = build_tree(Directory, File, Image, directories, files_per_directory, False)
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    # the list holding the nodes is not part of the tree
+    used -= sys.getsizeof(nodes)
+    return len(nodes), used / len(nodes)
+
+
+def main(directories: int = 500, files_per_directory: int = 200):
+    count, legacy_bytes = measure(True, directories, files_per_directory)
+    _, slotted_bytes = measure(False, directories, files_per_directory)
+    print(f"{count} nodes ({directories} directories of {files_per_directory} files, 1 in 4 an image)")
+    print(f"  __dict__ nodes: {legacy_bytes:8.1f} bytes per node")
+    print(f"  __slots__ nodes: {slotted_bytes:7.1f} bytes per node")
+    print(f"  saved: {1 - slotted_bytes / legacy_bytes:.0%}, "
+          f"{(legacy_bytes - slotted_bytes) * 2_000_000 / 2 ** 30:.2f} GiB for a 2M node tree")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
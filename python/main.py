@@ -9,7 +9,16 @@ def main():
     It's responsible for setting up the QApplication and starting the event loop."""
     app = QApplication(sys.argv)
     splash = SplashWindow()
-    splash.fileSystemModelReady.connect(init_main_window)
+    main_windows = []  # keep a reference so the main window is not garbage collected
+    splash.fileSystemModelReady.connect(lambda model: main_windows.append(init_main_window(model)))
+    splash.fileSystemModelUpdated.connect(
+        lambda model: [main_window.refresh_model() for main_window in main_windows])
+    splash.scanFinished.connect(
+        lambda model: [main_window.scan_finished() for main_window in main_windows])
+    splash.scanProgress.connect(
+        lambda *progress: [main_window.show_scan_progress(*progress) for main_window in main_windows])
+    # queued metadata batches would otherwise keep the interpreter from exiting until they are done
+    app.aboutToQuit.connect(splash.stop_scan)
     splash.show()
     sys.exit(app.exec_())
 
@@ -17,7 +26,10 @@ def main():
 def init_main_window(model):
     print("FileSystemModel Path:\t", model.path)
     main_window: MainWindow = MainWindow(model)
+    # write outstanding cache changes before the application exits
+    QApplication.instance().aboutToQuit.connect(model.cache.close)
     main_window.show()
+    return main_window
 
 
 if __name__ == '__main__':
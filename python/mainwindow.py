@@ -1,4 +1,4 @@
-from PyQt5.QtCore import QUrl, QSize
+from PyQt5.QtCore import QUrl, QSize, QTimer
 from PyQt5.QtGui import QIcon
 from PyQt5.QtWebEngineWidgets import QWebEngineView, QWebEngineProfile, QWebEnginePage
 from PyQt5.QtWidgets import QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QStackedWidget, \
@@ -12,6 +12,9 @@ import styles.system_theme
 import styles.sidebar   # Import the sidebar style module
 from requests import Session    # Import the requests module
 
+# tree updates arriving within this interval are redrawn once
+REFRESH_INTERVAL_MS = 2000
+
 # Import the FileSystemNodeModel class from the model modules
 class MainWindow(QMainWindow):
     """
@@ -126,11 +129,51 @@ class MainWindow(QMainWindow):
 
         self.sidebar.setStyleSheet(styles.sidebar.main_style())
 
+        # coalesces background tree updates, the visualisation is only redrawn while it is shown
+        self.visualisationStale = False
+        self.refreshTimer = QTimer(self)
+        self.refreshTimer.setSingleShot(True)
+        self.refreshTimer.setInterval(REFRESH_INTERVAL_MS)
+        self.refreshTimer.timeout.connect(self.redraw_visualisation)
+
+    def refresh_model(self):
+        """
+        Schedule a redraw of the views that summarise the whole tree after it was updated in the background.
+        """
+        if not self.refreshTimer.isActive():
+            self.refreshTimer.start()
+
+    def scan_finished(self):
+        """
+        Show that the background scan finished and redraw the views for the complete tree.
+        """
+        self.refresh_model()
+        self.statusBar().showMessage("Scan complete", 5000)
+
+    def redraw_visualisation(self):
+        """
+        Redraw the visualisation if it is shown, otherwise redraw it when it is next shown.
+        """
+        if self.stacked_widget.currentWidget() is self.visualise_window:
+            self.visualisationStale = False
+            self.visualise_window.updateVisualization()
+        else:
+            self.visualisationStale = True
+
+    def show_scan_progress(self, directories: int, files: int, total_bytes: int):
+        """
+        Show the progress of a scan that is still filling in the tree.
+        """
+        self.statusBar().showMessage(
+            f"Scanning... {directories} folders, {files} files, {total_bytes / (1024 * 1024):.1f} MB")
+
     def show_window(self, window_index: int):
         """
         Show the window at the given index in the stacked widget.
         """
         self.stacked_widget.setCurrentIndex(window_index)
+        if window_index == self.visualise_window.window_index and self.visualisationStale:
+            self.redraw_visualisation()
 
     def showWebView(self, url):
         """
@@ -0,0 +1,333 @@
+from __future__ import annotations
+import os
+import json
+import struct
+import time
+import numpy as np
+
+from python.model.FileSystemCache import FileSystemCache, write_atomic
+from python.model.FileSystemNodeModel import Directory, file_node_class
+from python.model.CachePersister import CachePersister, CHECKPOINT_EVERY_DIRECTORIES, CHECKPOINT_EVERY_SECONDS
+from python.model.ColumnarStore import TYPE_CODES, DIRECTORY, FILE
+from python.model.ScanRules import ScanRules
+
+SNAPSHOT_FILE = 'cache/system_model_snapshot.bin'
+SNAPSHOT_MAGIC = b'KLAASNAP'
+SNAPSHOT_FORMAT_VERSION = 1  # bump when the header, RECORD_DTYPE or the heap layout changes
+
+# magic, format version, length of the JSON info block, record count, records offset, heap offset
+HEADER = struct.Struct('<8sIIQQQ')
+RECORD_ALIGNMENT = 8
+
+# one fixed-width record per node, in breadth-first order: the children of a directory are the
+# contiguous rows [child_start, child_start + child_count)
+RECORD_DTYPE = np.dtype([
+    ('parent', '<i8'),
+    ('child_start', '<i8'),
+    ('child_count', '<i4'),
+    ('type_code', 'u1'),
+    ('flags', 'u1'),
+    ('name_offset', '<i8'),
+    ('name_length', '<i4'),
+    ('size', '<i8'),
+    ('mtime_ns', '<i8'),
+    ('ctime_ns', '<i8'),
+    ('inode', '<u8'),
+    ('device', '<u8'),
+    ('blocks', '<i8'),
+])
+# flags telling which of the optional fields of a record are set
+HAS_SIZE = 1
+HAS_STAT = 2
+HAS_BLOCKS = 4
+
+_CHILDREN_SLOT = Directory.children  # slot descriptor, bypasses SnapshotDirectory.children
+
+
+def _encode_name(name: str) -> bytes:
+    # undecodable file names come from os.scandir as surrogate escapes
+    return name.encode('utf-8', 'surrogateescape')
+
+
+def write_snapshot(root: Directory, path: str = SNAPSHOT_FILE, rules: ScanRules = None):
+    """
+    Write the tree below root as a binary snapshot, replacing the previous file atomically.
+
+    The file holds a header, a JSON info block (root path, scan rules), an array of RECORD_DTYPE
+    records and a heap of UTF-8 names that records point into. Names repeated across directories
+    are stored once.
+
+    @params
+    root: Directory: root of the tree to write
+    path: str: snapshot file (default: cache/system_model_snapshot.bin)
+    rules: ScanRules: rules the tree was scanned with, restored on load
+    """
+    nodes = [root]
+    parent = [-1]
+    child_start, child_count, type_code, flags = [], [], [], []
+    name_offset, name_length = [], []
+    size, mtime_ns, ctime_ns, inode, device, blocks = [], [], [], [], [], []
+    heap, heap_offsets, heap_size = [], {}, 0
+
+    row = 0
+    while row < len(nodes):
+        node = nodes[row]
+        children = node.children
+        child_start.append(len(nodes))
+        child_count.append(len(children))
+        nodes.extend(children)
+        parent.extend([row] * len(children))
+
+        name = node.name
+        offset = heap_offsets.get(name)
+        encoded = _encode_name(name)
+        if offset is None:
+            offset = heap_offsets[name] = heap_size
+            heap.append(encoded)
+            heap_size += len(encoded)
+        name_offset.append(offset)
+        name_length.append(len(encoded))
+
+        type_code.append(DIRECTORY if isinstance(node, Directory) else TYPE_CODES.get(type(node).__name__, FILE))
+        node_flags = 0
+        if node.size is not None:
+            node_flags |= HAS_SIZE
+        if node.st_mtime_ns is not None:
+            node_flags |= HAS_STAT
+        if node.st_blocks is not None:
+            node_flags |= HAS_BLOCKS
+        flags.append(node_flags)
+        size.append(node.size or 0)
+        mtime_ns.append(node.st_mtime_ns or 0)
+        ctime_ns.append(node.st_ctime_ns or 0)
+        inode.append(node.st_ino or 0)
+        device.append(node.st_dev or 0)
+        blocks.append(node.st_blocks or 0)
+        row += 1
+
+    records = np.zeros(len(nodes), dtype=RECORD_DTYPE)
+    for field, column in (('parent', parent), ('child_start', child_start), ('child_count', child_count),
+                          ('type_code', type_code), ('flags', flags), ('name_offset', name_offset),
+                          ('name_length', name_length), ('size', size), ('mtime_ns', mtime_ns),
+                          ('ctime_ns', ctime_ns), ('inode', inode), ('device', device), ('blocks', blocks)):
+        records[field] = column
+
+    info = {'root': root.path, 'created': time.time(),
+            'rules': rules.__getstate__() if rules is not None else None}
+    info_bytes = json.dumps(info, default=sorted).encode('utf-8')
+    records_offset = HEADER.size + len(info_bytes)
+    padding = -records_offset % RECORD_ALIGNMENT
+    records_offset += padding
+    heap_offset = records_offset + records.nbytes
+    header = HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_FORMAT_VERSION, len(info_bytes), len(nodes), records_offset,
+                         heap_offset)
+    write_atomic(path, b''.join([header, info_bytes, b'\0' * padding, records.tobytes()] + heap))
+
+
+class BinarySnapshot:
+    """
+    Read side of a snapshot written by write_snapshot(), memory mapped and loaded lazily.
+
+    Opening maps the file and reads the header, nothing else: the record array and the name heap
+    are views of the mapping. Only the root node is built up front, as a SnapshotDirectory whose
+    children are built from their records the first time they are accessed, so the time until the
+    tree can be shown does not depend on its size. Built nodes are added to the cache as usual.
+
+    @params
+    path: str: snapshot file (default: cache/system_model_snapshot.bin)
+    """
+
+    def __init__(self, path: str = SNAPSHOT_FILE):
+        self.path = path
+        self._map = np.memmap(path, dtype=np.uint8, mode='r')
+        magic, version, info_length, count, records_offset, heap_offset = HEADER.unpack_from(self._map, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_FORMAT_VERSION:
+            raise ValueError(f"{path} is not a snapshot of format version {SNAPSHOT_FORMAT_VERSION}")
+        info = json.loads(self._map[HEADER.size:HEADER.size + info_length].tobytes().decode('utf-8'))
+        self.root_path = info['root']
+        self.rules = ScanRules(**info['rules']) if info.get('rules') is not None else None
+        self.records = np.frombuffer(self._map, dtype=RECORD_DTYPE, count=count, offset=records_offset)
+        self.heap = self._map[heap_offset:]
+        self.root = None
+
+    def __len__(self):
+        return len(self.records)
+
+    def name(self, row: int) -> str:
+        record = self.records[row]
+        offset = int(record['name_offset'])
+        return self.heap[offset:offset + int(record['name_length'])].tobytes().decode('utf-8', 'surrogateescape')
+
+    def load(self, cache: FileSystemCache) -> Directory:
+        """Build the root node in cache and attach the snapshot to it, returns the root."""
+        root = Directory(self.root_path, cache, self.name(0), None, populate=False)
+        self._fill(root, self.records[0])
+        self._defer_children(root, 0)
+        cache.update(self.root_path, root)
+        if root.st_mtime_ns is not None:
+            cache.set_dir_mtime(root, root.st_mtime_ns)
+        if self.rules is not None:
+            cache.scan_rules = self.rules
+        cache.snapshot = self
+        self.root = root
+        return root
+
+    def _defer_children(self, directory: Directory, row: int):
+        _CHILDREN_SLOT.__set__(directory, PendingChildren(self, row))
+        directory.__class__ = SnapshotDirectory
+
+    def build_children(self, directory: Directory, row: int) -> list:
+        """Build the child nodes of a directory row and add them to the directory's cache."""
+        cache = directory.cache
+        record = self.records[row]
+        start = int(record['child_start'])
+        block = self.records[start:start + int(record['child_count'])]
+        path = directory.path
+        children = []
+        for offset, child_record in enumerate(block):
+            name = self.name(start + offset)
+            child_path = os.path.join(path, name)
+            if child_record['type_code'] == DIRECTORY:
+                child = Directory(child_path, cache, name, directory, populate=False)
+                self._fill(child, child_record)
+                self._defer_children(child, start + offset)
+            else:
+                child = file_node_class(name)(child_path, cache, name, directory)
+                self._fill(child, child_record)
+            children.append(child)
+            cache.update(child_path, child)
+            if isinstance(child, Directory) and child.st_mtime_ns is not None:
+                cache.set_dir_mtime(child, child.st_mtime_ns)
+        return children
+
+    @staticmethod
+    def _fill(node, record):
+        flags = int(record['flags'])
+        if flags & HAS_SIZE:
+            node.size = int(record['size'])
+        if flags & HAS_STAT:
+            node.st_mtime_ns = int(record['mtime_ns'])
+            node.st_ctime_ns = int(record['ctime_ns'])
+            node.st_ino = int(record['inode'])
+            node.st_dev = int(record['device'])
+        if flags & HAS_BLOCKS:
+            node.st_blocks = int(record['blocks'])
+
+    def find(self, path: str):
+        """Return the node at path, building the directories on the way down, None if it is not in the snapshot."""
+        if self.root is None:
+            return None
+        relative = os.path.relpath(os.path.normpath(path), self.root_path)
+        if relative == os.curdir:
+            return self.root
+        if relative.startswith(os.pardir):
+            return None
+        node = self.root
+        for name in relative.split(os.sep):
+            node = next((child for child in node.children if child.name == name), None)
+            if node is None:
+                return None
+        return node
+
+    def materialize(self):
+        """Build every node that has not been built yet, e.g. before a rescan walks the whole tree."""
+        if self.root is not None:
+            for _ in self.root.walk():
+                pass
+
+    def sample_directory_mtimes(self, sample_size: int) -> dict:
+        """Return {path: mtime_ns} of up to sample_size random directories, without building nodes."""
+        rows = np.flatnonzero((self.records['type_code'] == DIRECTORY) & (self.records['flags'] & HAS_STAT != 0))
+        rows = rows[rows > 0]
+        if len(rows) > sample_size:
+            rows = np.random.choice(rows, sample_size, replace=False)
+        return {self.path_of(int(row)): int(self.records[row]['mtime_ns']) for row in rows}
+
+    def directory_count(self) -> int:
+        """Return the number of directories in the snapshot, including the root."""
+        return int(np.count_nonzero(self.records['type_code'] == DIRECTORY))
+
+    def path_of(self, row: int) -> str:
+        """Return the path of a row, built from the names of its ancestors."""
+        names = []
+        while row > 0:
+            names.append(self.name(row))
+            row = int(self.records[row]['parent'])
+        names.append(self.root_path)
+        return os.path.join(*reversed(names))
+
+
+class PendingChildren:
+    """Placeholder kept in the children slot of a SnapshotDirectory until its children are built."""
+    __slots__ = ('snapshot', 'row')
+
+    def __init__(self, snapshot: BinarySnapshot, row: int):
+        self.snapshot = snapshot
+        self.row = row
+
+
+class SnapshotDirectory(Directory):
+    """
+    Directory loaded from a BinarySnapshot whose children have not been built yet.
+
+    The first access to children builds them from the snapshot and turns the node into a plain
+    Directory, so loaded directories behave, pickle and compare like scanned ones afterwards.
+    """
+    __slots__ = ()
+
+    @property
+    def children(self) -> list:
+        if type(self) is SnapshotDirectory:
+            # the cache lock also guards cache.update, taking it first keeps the lock order fixed
+            with self.cache.lock:
+                if type(self) is SnapshotDirectory:
+                    pending = _CHILDREN_SLOT.__get__(self)
+                    _CHILDREN_SLOT.__set__(self, pending.snapshot.build_children(self, pending.row))
+                    self.__class__ = Directory
+        return _CHILDREN_SLOT.__get__(self)
+
+    @children.setter
+    def children(self, value: list):
+        # assigned children replace the ones in the snapshot
+        _CHILDREN_SLOT.__set__(self, value)
+        self.__class__ = Directory
+
+    def __reduce_ex__(self, protocol):
+        self.children  # build them, the snapshot mapping cannot be pickled
+        return self.__reduce_ex__(protocol)
+
+
+class SnapshotPersister(CachePersister):
+    """
+    CachePersister that writes binary snapshots of one tree instead of pickling the cache.
+
+    @params
+    cache: FileSystemCache: cache to persist, the persister attaches itself to it
+    root_path: str: directory whose tree is written
+    path: str: snapshot file (default: cache/system_model_snapshot.bin)
+    every_directories: int: checkpoint after this many directories (0 disables)
+    every_seconds: float: checkpoint after this many seconds (0 disables)
+    """
+
+    def __init__(self, cache: FileSystemCache, root_path: str, path: str = SNAPSHOT_FILE,
+                 every_directories: int = CHECKPOINT_EVERY_DIRECTORIES,
+                 every_seconds: float = CHECKPOINT_EVERY_SECONDS):
+        super().__init__(cache, path, every_directories, every_seconds)
+        self.root_path = os.path.normpath(root_path)
+
+    def _write(self):
+        try:
+            with self.cache.lock:
+                root = self.cache.get(self.root_path)
+                if not isinstance(root, Directory):
+                    return
+                write_snapshot(root, self.path, self.cache.scan_rules)
+        except Exception as e:
+            # the next checkpoint will retry with a fresh snapshot
+            print(f"Failed to write cache snapshot to {self.path}: {e}")
+            with self._condition:
+                self._dirty = True
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,130 @@
+from __future__ import annotations
+import threading
+import time
+
+from python.model.FileSystemCache import FileSystemCache, CACHE_FILE, write_atomic
+
+# default checkpoint interval, whichever comes first
+CHECKPOINT_EVERY_DIRECTORIES = 1000
+CHECKPOINT_EVERY_SECONDS = 60.0
+
+
+class CachePersister:
+    """
+    Persists a FileSystemCache from a background writer thread.
+
+    The cache reports progress through FileSystemCache.checkpoint(), once per finished directory.
+    A snapshot is written every `every_directories` checkpoints or `every_seconds` seconds,
+    whichever comes first, and once more when flush() or close() is called.
+
+    @params
+    cache: FileSystemCache: cache to persist, the persister attaches itself to it
+    path: str: pickle file to write (default: cache/system_model_cache.pkl)
+    every_directories: int: checkpoint after this many directories (0 disables)
+    every_seconds: float: checkpoint after this many seconds (0 disables)
+    """
+
+    def __init__(self, cache: FileSystemCache, path: str = CACHE_FILE,
+                 every_directories: int = CHECKPOINT_EVERY_DIRECTORIES,
+                 every_seconds: float = CHECKPOINT_EVERY_SECONDS):
+        self.cache = cache
+        self.path = path
+        self.every_directories = every_directories
+        self.every_seconds = every_seconds
+
+        self._condition = threading.Condition()
+        self._pending_directories = 0
+        self._last_write = time.monotonic()
+        self._dirty = False
+        self._write_requested = False
+        self._closing = False
+        self._writes_done = 0
+        self._thread = None
+
+    def start(self):
+        """Attach to the cache and start the writer thread."""
+        self.cache.persister = self
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='cache-writer', daemon=True)
+            self._thread.start()
+        return self
+
+    def directory_done(self, directory=None):
+        """Record a finished directory, requesting a checkpoint when one is due."""
+        with self._condition:
+            self._dirty = True
+            self._pending_directories += 1
+            due_by_count = self.every_directories and self._pending_directories >= self.every_directories
+            due_by_time = self.every_seconds and time.monotonic() - self._last_write >= self.every_seconds
+            if due_by_count or due_by_time:
+                self._write_requested = True
+                self._condition.notify()
+
+    def node_moved(self, old_path: str, new_path: str):
+        """Record a renamed or moved node, the whole cache is written so nothing needs to be remembered."""
+
+    def metadata_loaded(self, node):
+        """Record a node whose metadata was loaded, it is written with the rest of the cache."""
+
+    def flush(self, wait: bool = False):
+        """Request a write of the current cache, optionally blocking until it is on disk."""
+        with self._condition:
+            self._dirty = True
+            self._write_requested = True
+            target = self._writes_done + 1
+            self._condition.notify_all()
+            if wait:
+                while self._writes_done < target and self._thread is not None and self._thread.is_alive():
+                    self._condition.wait()
+
+    def close(self):
+        """Write any outstanding changes, stop the writer thread and detach from the cache."""
+        with self._condition:
+            self._closing = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self.cache.persister is self:
+            self.cache.persister = None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._write_requested and not self._closing:
+                    # wake up periodically so time based checkpoints happen without new directories
+                    timeout = self.every_seconds if self.every_seconds else None
+                    self._condition.wait(timeout)
+                    if self._dirty and self.every_seconds and \
+                            time.monotonic() - self._last_write >= self.every_seconds:
+                        self._write_requested = True
+                write = self._dirty
+                closing = self._closing
+                self._write_requested = False
+                self._dirty = False
+                self._pending_directories = 0
+                self._last_write = time.monotonic()
+
+            if write:
+                self._write()
+
+            with self._condition:
+                self._writes_done += 1
+                self._condition.notify_all()
+
+            if closing:
+                return
+
+    def _write(self):
+        try:
+            data = self.cache.dump_bytes()
+            write_atomic(self.path, data)
+        except Exception as e:
+            # the next checkpoint will retry with a fresh snapshot
+            print(f"Failed to write cache checkpoint to {self.path}: {e}")
+            with self._condition:
+                self._dirty = True
+
+
+if __name__ == "__main__":
+    pass
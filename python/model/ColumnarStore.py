@@ -0,0 +1,252 @@
+from __future__ import annotations
+import os
+import numpy as np
+
+from python.model.FileSystemNodeModel import Directory
+
+# type codes of the type column, indexed by code
+TYPE_NAMES = ('Directory', 'File', 'Image', 'Music', 'Document', 'Video')
+TYPE_CODES = {name: code for code, name in enumerate(TYPE_NAMES)}
+DIRECTORY = TYPE_CODES['Directory']
+FILE = TYPE_CODES['File']
+
+
+class ColumnarStore:
+    """
+    Struct-of-arrays copy of a tree for analytics over millions of nodes.
+
+    Every node is one row, rows are in breadth-first order: a parent always comes before its
+    children, the children of a directory are contiguous and depth never decreases. Columns are
+    NumPy arrays (parent row, size, mtime, type code, name id, extension id, depth), names and
+    extensions are kept once each in string tables. Aggregations such as directory size rollups,
+    largest-N and extension breakdowns are vectorized over the columns.
+
+    Rows are turned into NodeView objects only when a result is read, and into the live
+    FileSystemNode through node() when the store was built from a tree.
+
+    @params
+    root_path: str: path of the root row
+    names: list[str]: name table, indexed by the name column
+    extensions: list[str]: extension table, indexed by the extension column ('' for none)
+    parent, size, mtime_ns, type_code, name_id, extension_id, depth: np.ndarray: the columns
+    nodes: list: live node of each row (default: None, rows are only available as views)
+    """
+
+    def __init__(self, root_path: str, names: list, extensions: list, parent: np.ndarray, size: np.ndarray,
+                 mtime_ns: np.ndarray, type_code: np.ndarray, name_id: np.ndarray, extension_id: np.ndarray,
+                 depth: np.ndarray, nodes: list = None):
+        self.root_path = root_path
+        self.names = names
+        self.extensions = extensions
+        self.parent = parent
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.type_code = type_code
+        self.name_id = name_id
+        self.extension_id = extension_id
+        self.depth = depth
+        self.nodes = nodes
+        self._subtree_sizes = None
+        self._index_children()
+
+    @classmethod
+    def from_tree(cls, root) -> ColumnarStore:
+        """Build a store from a Directory tree, keeping a reference to each live node."""
+        names, name_ids = [], {}
+        extensions, extension_ids = [''], {'': 0}
+        size, mtime_ns, type_code, name_id, extension_id = [], [], [], [], []
+        nodes = [root]
+        parent_rows = [-1]
+        depths = [0]
+
+        row = 0
+        while row < len(nodes):
+            node = nodes[row]
+            name = node.name
+            name_row = name_ids.get(name)
+            if name_row is None:
+                name_row = name_ids[name] = len(names)
+                names.append(name)
+            code = DIRECTORY if isinstance(node, Directory) else TYPE_CODES.get(type(node).__name__, FILE)
+            if code == DIRECTORY:
+                extension = ''
+                for child in node.children:
+                    nodes.append(child)
+                    parent_rows.append(row)
+                    depths.append(depths[row] + 1)
+            else:
+                extension = os.path.splitext(name)[1]
+            extension_row = extension_ids.get(extension)
+            if extension_row is None:
+                extension_row = extension_ids[extension] = len(extensions)
+                extensions.append(extension)
+
+            size.append(node.size or 0)
+            mtime_ns.append(node.st_mtime_ns or 0)
+            type_code.append(code)
+            name_id.append(name_row)
+            extension_id.append(extension_row)
+            row += 1
+
+        return cls(root.path, names, extensions,
+                   parent=np.array(parent_rows, dtype=np.int32),
+                   size=np.array(size, dtype=np.int64),
+                   mtime_ns=np.array(mtime_ns, dtype=np.int64),
+                   type_code=np.array(type_code, dtype=np.uint8),
+                   name_id=np.array(name_id, dtype=np.int32),
+                   extension_id=np.array(extension_id, dtype=np.int32),
+                   depth=np.array(depths, dtype=np.int32),
+                   nodes=nodes)
+
+    def _index_children(self):
+        # breadth-first order keeps siblings together, so children are a [start, start + count) range
+        count = len(self.parent)
+        self.child_count = np.bincount(self.parent[1:], minlength=count).astype(np.int32) if count > 1 \
+            else np.zeros(count, dtype=np.int32)
+        self.child_start = np.empty(count, dtype=np.int64)
+        if count:
+            self.child_start[0] = 1
+            np.cumsum(self.child_count[:-1], out=self.child_start[1:])
+            self.child_start[1:] += 1
+        # depth never decreases, so every level is a contiguous slice of rows
+        self.level_start = np.searchsorted(self.depth, np.arange(int(self.depth.max()) + 2 if count else 1))
+
+    def __len__(self):
+        return len(self.parent)
+
+    def is_directory(self) -> np.ndarray:
+        """Return a boolean mask of the directory rows."""
+        return self.type_code == DIRECTORY
+
+    def subtree_sizes(self) -> np.ndarray:
+        """
+        Return the total size of every row: the file size for files, the sum of all files below it
+        for directories. Levels are folded into their parents from the deepest one up.
+        """
+        if self._subtree_sizes is None:
+            totals = np.where(self.is_directory(), 0, self.size).astype(np.int64)
+            for level in range(len(self.level_start) - 2, 0, -1):
+                start, end = self.level_start[level], self.level_start[level + 1]
+                parent_start, parent_end = self.level_start[level - 1], start
+                if start == end:
+                    continue
+                rolled = np.bincount(self.parent[start:end] - parent_start, weights=totals[start:end],
+                                     minlength=parent_end - parent_start)
+                totals[parent_start:parent_end] += rolled.astype(np.int64)
+            self._subtree_sizes = totals
+        return self._subtree_sizes
+
+    def largest(self, n: int = 10, directories: bool = False) -> list:
+        """
+        Return views of the n largest files, or of the n largest directories by total size.
+        """
+        mask = self.is_directory() if directories else ~self.is_directory()
+        rows = np.flatnonzero(mask)
+        if directories:
+            rows = rows[1:] if len(rows) and rows[0] == 0 else rows  # the root is not a result
+            sizes = self.subtree_sizes()[rows]
+        else:
+            sizes = self.size[rows]
+        if len(rows) > n:
+            top = np.argpartition(sizes, -n)[-n:]
+            rows, sizes = rows[top], sizes[top]
+        order = np.argsort(sizes, kind='stable')[::-1]
+        return [self.view(int(row)) for row in rows[order]]
+
+    def extension_sizes(self) -> dict:
+        """Return the total size of the files of each extension, '' for files without one."""
+        files = ~self.is_directory()
+        totals = np.bincount(self.extension_id[files], weights=self.size[files], minlength=len(self.extensions))
+        return {self.extensions[i]: int(total) for i, total in enumerate(totals) if total}
+
+    def children(self, row: int) -> range:
+        """Return the rows of the children of a row."""
+        start = int(self.child_start[row])
+        return range(start, start + int(self.child_count[row]))
+
+    def name(self, row: int) -> str:
+        return self.names[self.name_id[row]]
+
+    def path(self, row: int) -> str:
+        """Return the full path of a row, built from its ancestors' names."""
+        names = []
+        while row > 0:
+            names.append(self.names[self.name_id[row]])
+            row = int(self.parent[row])
+        names.append(self.root_path)
+        return os.path.join(*reversed(names))
+
+    def view(self, row: int) -> NodeView:
+        return NodeView(self, row)
+
+    def node(self, row: int):
+        """Return the live node of a row, None when the store was not built from a tree."""
+        return self.nodes[row] if self.nodes is not None else None
+
+
+class NodeView:
+    """
+    Read-only view of one row of a ColumnarStore, shaped like a FileSystemNode.
+
+    @params
+    store: ColumnarStore: store the row belongs to
+    row: int: row number
+    """
+    __slots__ = ('store', 'row')
+
+    def __init__(self, store: ColumnarStore, row: int):
+        self.store = store
+        self.row = row
+
+    @property
+    def name(self) -> str:
+        return self.store.name(self.row)
+
+    @property
+    def path(self) -> str:
+        return self.store.path(self.row)
+
+    @property
+    def size(self) -> int:
+        """Size of the file, or of everything below the directory."""
+        return int(self.store.subtree_sizes()[self.row])
+
+    @property
+    def st_mtime_ns(self) -> int:
+        return int(self.store.mtime_ns[self.row])
+
+    @property
+    def type_name(self) -> str:
+        return TYPE_NAMES[self.store.type_code[self.row]]
+
+    def is_directory(self) -> bool:
+        return self.store.type_code[self.row] == DIRECTORY
+
+    def extension(self) -> str:
+        return self.store.extensions[self.store.extension_id[self.row]]
+
+    @property
+    def parent(self):
+        parent_row = int(self.store.parent[self.row])
+        return NodeView(self.store, parent_row) if parent_row >= 0 else None
+
+    @property
+    def children(self) -> list:
+        return [NodeView(self.store, row) for row in self.store.children(self.row)]
+
+    def node(self):
+        """Return the live FileSystemNode of this row, if the store has one."""
+        return self.store.node(self.row)
+
+    def __eq__(self, other):
+        return isinstance(other, NodeView) and other.store is self.store and other.row == self.row
+
+    def __hash__(self):
+        return hash((id(self.store), self.row))
+
+    def __str__(self):
+        return self.name
+
+
+if __name__ == "__main__":
+    pass
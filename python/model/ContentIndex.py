@@ -0,0 +1,398 @@
+from __future__ import annotations
+import os
+import re
+import sqlite3
+import threading
+from itertools import chain, repeat
+import numpy as np
+from PyPDF2 import PdfReader
+from docx import Document as Doc
+
+from python.model.KeywordIndex import ID_DTYPE
+
+CONTENT_INDEX_FILE = 'cache/content.sqlite3'
+# files whose text is indexed, see extract_text()
+CONTENT_EXTENSIONS = ('.txt', '.pdf', '.docx')
+# text read from one file, the rest of a longer file is not searchable
+DEFAULT_BYTE_BUDGET = 1024 * 1024
+# words longer than this are encoded data or hashes rather than words and are not indexed
+MAX_TERM_LENGTH = 32
+# decoded posting lists kept in memory, so refining a query does not decompress the same lists again
+POSTINGS_CACHE_SIZE = 256
+# all segments are merged once this share of the document ids in them belongs to replaced or removed files
+DEAD_FRACTION = 4
+
+
+def extract_text(path: str, byte_budget: int = DEFAULT_BYTE_BUDGET) -> str:
+    """
+    Return the text of a .txt, .pdf or .docx file, '' for other files.
+
+    @params
+    path: str: file to read
+    byte_budget: int: bytes read from a text file, characters extracted from a PDF or DOCX; pages and
+                 paragraphs past the budget are never parsed
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.txt':
+        with open(path, 'rb') as file:
+            return file.read(byte_budget).decode('utf-8', errors='ignore')
+    if extension == '.pdf':
+        parts = (page.extract_text() or '' for page in PdfReader(path).pages)
+    elif extension == '.docx':
+        parts = (paragraph.text for paragraph in Doc(path).paragraphs)
+    else:
+        return ''
+    text, length = [], 0
+    for part in parts:
+        text.append(part)
+        length += len(part) + 1
+        if length >= byte_budget:
+            break
+    return '\n'.join(text)[:byte_budget]
+
+
+def tokenize(text: str) -> set:
+    """Return the distinct lowercased words of text, the terms it is indexed and queried by."""
+    return {word for word in re.split(r'\W+', text.lower()) if word and len(word) <= MAX_TERM_LENGTH}
+
+
+def extract_terms(path: str, byte_budget: int = DEFAULT_BYTE_BUDGET) -> list:
+    """Return the sorted terms of a file's text, run in MetadataPipeline workers."""
+    return sorted(tokenize(extract_text(path, byte_budget)))
+
+
+def encode_varints(values: np.ndarray) -> tuple:
+    """
+    Encode unsigned 32 bit integers as variable-byte numbers: seven bits per byte, lowest first, with the high
+    bit set on every byte but the last of a number. Small numbers take a single byte.
+
+    Returns the encoded bytes and the offset each number ends at, to split the bytes of consecutive lists.
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    sizes = np.ones(len(values), dtype=np.int64)
+    for shift in (7, 14, 21, 28):
+        sizes += values >= (1 << shift)
+    ends = np.cumsum(sizes)
+    data = np.empty(int(ends[-1]) if len(ends) else 0, dtype=np.uint8)
+    starts = ends - sizes
+    for byte in range(5):
+        has = sizes > byte
+        if not has.any():
+            break
+        part = (values[has] >> np.uint64(7 * byte)) & np.uint64(0x7f)
+        more = (sizes[has] > byte + 1).astype(np.uint64) << np.uint64(7)
+        data[starts[has] + byte] = part | more
+    return data.tobytes(), ends
+
+
+def decode_varints(data: bytes) -> np.ndarray:
+    """Return the numbers encoded by encode_varints() as uint64."""
+    data = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.empty_like(ends)
+    starts[:1] = 0
+    starts[1:] = ends[:-1] + 1
+    sizes = ends - starts + 1
+    values = np.zeros(len(ends), dtype=np.uint64)
+    for byte in range(5):
+        has = sizes > byte
+        if not has.any():
+            break
+        values[has] |= (data[starts[has] + byte] & 0x7f).astype(np.uint64) << np.uint64(7 * byte)
+    return values
+
+
+def encode_posting_lists(ids: np.ndarray, counts: np.ndarray) -> list:
+    """
+    Compress consecutive sorted lists of document ids at once, into one bytes object per list.
+
+    A list is stored as the gaps between its consecutive ids, the first gap counted from 0, each gap a
+    variable-byte number; a document containing most of the terms of its neighbours costs a byte per term.
+
+    @params
+    ids: np.ndarray: the ids of all lists, one after the other
+    counts: np.ndarray: length of each list, all greater than 0
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    gaps = np.diff(ids, prepend=0)
+    firsts = np.cumsum(counts) - counts
+    gaps[firsts] = ids[firsts]
+    data, ends = encode_varints(gaps)
+    bounds = ends[firsts + counts - 1].tolist()
+    return [data[start:end] for start, end in zip([0] + bounds[:-1], bounds)]
+
+
+def decode_posting_lists(blobs: list) -> tuple:
+    """Return the ids of lists compressed by encode_posting_lists(), one after the other, and their lengths."""
+    data = b''.join(blobs)
+    gaps = decode_varints(data)
+    # a list has as many ids as its bytes have final bytes
+    terminal = np.cumsum(np.frombuffer(data, dtype=np.uint8) < 0x80)
+    bounds = np.cumsum([len(blob) for blob in blobs])
+    counts = np.diff(terminal[bounds - 1], prepend=0) if len(data) else np.zeros(len(blobs), dtype=np.int64)
+    totals = np.cumsum(gaps)
+    firsts = np.cumsum(counts) - counts
+    # restart the running sum at the first id of every list
+    ids = totals - np.repeat(totals[firsts] - gaps[firsts], counts)
+    return ids.astype(ID_DTYPE), counts
+
+
+def encode_postings(ids) -> bytes:
+    """Compress one sorted list of document ids, see encode_posting_lists()."""
+    return encode_posting_lists(ids, np.array([len(ids)]))[0]
+
+
+def decode_postings(blob: bytes) -> np.ndarray:
+    """Return the sorted document ids compressed by encode_postings()."""
+    return np.cumsum(decode_varints(blob)).astype(ID_DTYPE)
+
+
+class ContentIndex:
+    """
+    On-disk inverted index of the text of documents, kept in a SQLite database.
+
+    Every indexed version of a file gets a new document id, ids only grow. The postings table maps each term
+    to the sorted ids of the documents containing it, compressed with encode_postings(), split into segments:
+    every call to update_many() appends one segment holding the postings of its files, without reading or
+    rewriting older lists. Segments cover ascending ranges of ids, so a term's list is the concatenation of
+    its rows in segment order. A segment is merged with the one before it as soon as it holds as many
+    postings, like a binary counter, which keeps the number of segments logarithmic in the size of the index
+    and rewrites every posting a logarithmic number of times.
+
+    Replaced and removed files only lose their row in the documents table; their ids are dropped from query
+    results and from the postings of merged segments. All segments are merged once 1/DEAD_FRACTION of the ids
+    are dead.
+
+    A query decompresses the lists of its terms and intersects them, shortest first. Queries read through
+    their own connection, so they are answered from the committed index while the indexer writes. Paths and
+    file versions are held in memory, deciding which files are out of date needs no queries.
+
+    @params
+    path: str: database file (default: cache/content.sqlite3)
+    """
+
+    def __init__(self, path: str = CONTENT_INDEX_FILE):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._write_lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self._writer = sqlite3.connect(path, check_same_thread=False)
+        self._writer.execute('PRAGMA journal_mode=WAL')
+        self._writer.execute('PRAGMA synchronous=NORMAL')
+        self._writer.execute("""
+            CREATE TABLE IF NOT EXISTS documents (
+                doc_id INTEGER PRIMARY KEY,
+                path TEXT NOT NULL UNIQUE,
+                st_size INTEGER NOT NULL,
+                st_mtime_ns INTEGER NOT NULL
+            )
+        """)
+        self._writer.execute("""
+            CREATE TABLE IF NOT EXISTS segments (
+                segment INTEGER PRIMARY KEY,
+                last_id INTEGER NOT NULL,
+                postings INTEGER NOT NULL
+            )
+        """)
+        self._writer.execute("""
+            CREATE TABLE IF NOT EXISTS postings (
+                segment INTEGER NOT NULL,
+                term TEXT NOT NULL,
+                doc_ids BLOB NOT NULL,
+                PRIMARY KEY (segment, term)
+            ) WITHOUT ROWID
+        """)
+        self._writer.commit()
+        self._reader = sqlite3.connect(path, check_same_thread=False)
+        self._documents = {}  # path -> (doc_id, st_size, st_mtime_ns)
+        self._paths = {}  # doc_id -> path of the live documents
+        for doc_id, path, st_size, st_mtime_ns in self._writer.execute(
+                "SELECT doc_id, path, st_size, st_mtime_ns FROM documents"):
+            self._documents[path] = (doc_id, st_size, st_mtime_ns)
+            self._paths[doc_id] = path
+        self._segments = self._writer.execute(
+            "SELECT segment, last_id, postings FROM segments ORDER BY segment").fetchall()
+        # ids of removed documents may still be in the postings, they are never handed out again
+        self._next_id = max(max(self._paths, default=0), max((last_id for _, last_id, _ in self._segments),
+                                                               default=0)) + 1
+        # ids of replaced and removed documents still in the postings, kept in the database header
+        self._dead = self._writer.execute('PRAGMA user_version').fetchone()[0]
+        self._version = 0  # incremented on every commit, outdates the decoded posting lists
+        self._postings = {}  # term -> (version, decoded posting list), see POSTINGS_CACHE_SIZE
+
+    def is_current(self, path: str, st_size: int, st_mtime_ns: int) -> bool:
+        """Return whether path is indexed at this size and mtime."""
+        known = self._documents.get(path)
+        return known is not None and known[1] == st_size and known[2] == st_mtime_ns
+
+    def paths(self) -> list:
+        """Return the paths of the indexed files."""
+        with self._write_lock:
+            return list(self._documents)
+
+    def update_many(self, entries: list):
+        """
+        Index new versions of files as one segment, replacing what they were indexed with before.
+
+        @params
+        entries: list[tuple]: (path, st_size, st_mtime_ns, terms), terms None for a file whose text could not
+                 be extracted; it is recorded without terms, so it is only retried once it changes
+        """
+        entries = {entry[0]: entry for entry in entries}.values()  # the last version of a path wins
+        if not entries:
+            return
+        with self._write_lock:
+            groups, documents = {}, []
+            for path, st_size, st_mtime_ns, terms in entries:
+                doc_id = self._next_id
+                self._next_id += 1
+                for term in terms or ():
+                    ids = groups.get(term)
+                    if ids is None:
+                        groups[term] = [doc_id]
+                    else:
+                        ids.append(doc_id)
+                documents.append((doc_id, path, st_size, st_mtime_ns))
+            segment = self._segments[-1][0] + 1 if self._segments else 1
+            counts = np.fromiter(map(len, groups.values()), dtype=np.int64, count=len(groups))
+            postings = int(counts.sum())
+            if groups:
+                ids = np.fromiter(chain.from_iterable(groups.values()), dtype=np.int64, count=postings)
+                self._writer.executemany("INSERT INTO postings (segment, term, doc_ids) VALUES (?, ?, ?)",
+                                         zip(repeat(segment), groups, encode_posting_lists(ids, counts)))
+            self._writer.execute("INSERT INTO segments (segment, last_id, postings) VALUES (?, ?, ?)",
+                                 (segment, self._next_id - 1, postings))
+            # the path is unique, replacing a file's row drops its previous version
+            self._writer.executemany(
+                "INSERT OR REPLACE INTO documents (doc_id, path, st_size, st_mtime_ns) VALUES (?, ?, ?, ?)",
+                documents)
+            replaced = sum(1 for _, path, _, _ in documents if path in self._documents)
+            self._writer.execute(f'PRAGMA user_version = {self._dead + replaced:d}')
+            self._writer.commit()
+            self._version += 1
+            self._dead += replaced
+            self._segments.append((segment, self._next_id - 1, postings))
+            for doc_id, path, st_size, st_mtime_ns in documents:
+                known = self._documents.get(path)
+                if known is not None:
+                    self._paths.pop(known[0], None)
+                self._documents[path] = (doc_id, st_size, st_mtime_ns)
+                self._paths[doc_id] = path
+            self._merge_segments()
+
+    def remove_many(self, paths: list):
+        """Remove files from the index, paths that are not indexed are ignored."""
+        with self._write_lock:
+            removed = [self._documents[path][0] for path in paths if path in self._documents]
+            if not removed:
+                return
+            self._writer.executemany("DELETE FROM documents WHERE doc_id = ?", ((doc_id,) for doc_id in removed))
+            self._writer.execute(f'PRAGMA user_version = {self._dead + len(removed):d}')
+            self._writer.commit()
+            self._version += 1
+            self._dead += len(removed)
+            for path in paths:
+                known = self._documents.pop(path, None)
+                if known is not None:
+                    self._paths.pop(known[0], None)
+            self._merge_segments()
+
+    def _merge_segments(self):
+        # merge the newest segment into the one before it while it is at least as large, and everything once
+        # too many ids are dead
+        segments = self._segments
+        while len(segments) > 1 and segments[-1][2] >= segments[-2][2]:
+            self._merge(len(segments) - 2)
+        if segments and self._dead and self._dead >= (len(self._paths) + self._dead) // DEAD_FRACTION:
+            self._merge(0)
+
+    def _merge(self, start: int):
+        # merge self._segments[start:] into the first of them, dropping the ids of dead documents
+        merged = self._segments[start:]
+        numbers = [segment for segment, _, _ in merged]
+        placeholders = ','.join('?' * len(numbers))
+        alive = np.zeros(self._next_id, dtype=bool)
+        alive[np.fromiter(self._paths, dtype=np.int64, count=len(self._paths))] = True
+        stored = self._writer.execute(
+            f"SELECT term, doc_ids FROM postings WHERE segment IN ({placeholders}) ORDER BY term, segment", numbers)
+        terms, blobs = [], []
+        for term, blob in stored:
+            terms.append(term)
+            blobs.append(blob)
+        # rows of the same term are adjacent and in segment order, so their ids concatenate in order
+        ids, counts = decode_posting_lists(blobs)
+        new_term = np.fromiter((i == 0 or terms[i] != terms[i - 1] for i in range(len(terms))), dtype=bool,
+                               count=len(terms))
+        first_rows = np.flatnonzero(new_term)
+        group = np.repeat(np.cumsum(new_term) - 1, counts)
+        keep = alive[ids]
+        counts = np.bincount(group[keep], minlength=len(first_rows))
+        kept = np.flatnonzero(counts)
+        postings = int(counts.sum())
+        rows = zip(repeat(numbers[0]), [terms[row] for row in first_rows[kept].tolist()],
+                   encode_posting_lists(ids[keep], counts[kept]) if postings else [])
+        self._writer.execute(f"DELETE FROM postings WHERE segment IN ({placeholders})", numbers)
+        self._writer.execute(f"DELETE FROM segments WHERE segment IN ({placeholders})", numbers)
+        self._writer.executemany("INSERT INTO postings (segment, term, doc_ids) VALUES (?, ?, ?)", rows)
+        self._writer.execute("INSERT INTO segments (segment, last_id, postings) VALUES (?, ?, ?)",
+                             (numbers[0], merged[-1][1], postings))
+        if start == 0:
+            self._writer.execute('PRAGMA user_version = 0')  # every dead id was dropped
+        self._writer.commit()
+        self._version += 1
+        if start == 0:
+            self._dead = 0
+        self._segments[start:] = [(numbers[0], merged[-1][1], postings)]
+
+    def _posting(self, term: str) -> np.ndarray:
+        version = self._version
+        cached = self._postings.get(term)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        # one primary key lookup per segment, in the order of their ids
+        blobs = [blob for blob, in self._reader.execute(
+            "SELECT doc_ids FROM postings WHERE segment IN (SELECT segment FROM segments) AND term = ? "
+            "ORDER BY segment", (term,))]
+        if not blobs:
+            ids = np.empty(0, dtype=ID_DTYPE)
+        elif len(blobs) == 1:
+            ids = decode_postings(blobs[0])
+        else:
+            ids = np.concatenate([decode_postings(blob) for blob in blobs])
+        if len(self._postings) >= POSTINGS_CACHE_SIZE:
+            self._postings.clear()
+        self._postings[term] = (version, ids)
+        return ids
+
+    def search(self, query: str) -> list:
+        """
+        Return the paths of the indexed files containing every word of query.
+
+        @params
+        query: str: words to look for, compared case-insensitively
+        """
+        terms = tokenize(query)
+        if not terms:
+            return []
+        with self._read_lock:
+            lists = sorted((self._posting(term) for term in terms), key=len)
+        result = lists[0]
+        for ids in lists[1:]:
+            if not len(result):
+                break
+            result = np.intersect1d(result, ids, assume_unique=True)
+        paths = self._paths
+        # ids of replaced and removed files stay in the postings until their segment is merged
+        return [path for path in map(paths.get, result.tolist()) if path is not None]
+
+    def __len__(self):
+        return len(self._documents)
+
+    def close(self):
+        with self._write_lock, self._read_lock:
+            self._writer.close()
+            self._reader.close()
+
+
+if __name__ == "__main__":
+    pass
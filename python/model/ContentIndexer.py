@@ -0,0 +1,160 @@
+from __future__ import annotations
+import os
+import time
+import threading
+from functools import partial
+
+from python.model.FileSystemCache import FileSystemCache
+from python.model.FileSystemNodeModel import File
+from python.model.ContentIndex import (ContentIndex, CONTENT_INDEX_FILE, CONTENT_EXTENSIONS, DEFAULT_BYTE_BUDGET,
+                                       extract_terms)
+from python.model.MetadataPipeline import MetadataPipeline, extract_batch, DEFAULT_BATCH_SIZE
+from python.model.MetadataPrefetcher import PROCESS_POOL_THRESHOLD
+
+# extracted files are written to the index as one segment once there are this many, or after FLUSH_SECONDS
+DEFAULT_FLUSH_SIZE = 1024
+FLUSH_SECONDS = 2.0
+
+
+class ContentIndexer:
+    """
+    Keeps a ContentIndex of the text of the cached .txt, .pdf and .docx files up to date in the background.
+
+    A pass compares the size and mtime of every cached document with the version it was indexed at, drops
+    files that no longer exist and extracts the text of new and changed ones, smallest first. Large passes
+    extract in a MetadataPipeline process pool, PDF parsing is CPU bound. Extracted files are written to the
+    index every flush_size files or FLUSH_SECONDS, so content queries answer from what is indexed so far while
+    the rest is still being extracted. After a pass the indexer waits until schedule() is called, for example
+    after the watcher applied changes.
+
+    The index is opened right away and attached to the cache as content_index, a document indexed in an
+    earlier session is searchable before the first pass has started.
+
+    @params
+    cache: FileSystemCache: cache whose documents are indexed
+    index_path: str: ContentIndex database (default: cache/content.sqlite3)
+    processes: int: number of worker processes for large passes (default: None, extract on the indexer thread)
+    byte_budget: int: text read per file, see extract_text()
+    flush_size: int: files extracted between writes to the index
+    """
+
+    def __init__(self, cache: FileSystemCache, index_path: str = CONTENT_INDEX_FILE, processes: int = None,
+                 byte_budget: int = DEFAULT_BYTE_BUDGET, flush_size: int = DEFAULT_FLUSH_SIZE):
+        self.cache = cache
+        self.index = ContentIndex(index_path)
+        self.processes = processes
+        self.byte_budget = byte_budget
+        self.flush_size = max(1, flush_size)
+        self._cancelled = threading.Event()
+        self._wanted = threading.Event()  # another pass was asked for
+        self._idle = threading.Event()  # no pass is running or asked for
+        self._pipeline = None  # MetadataPipeline of a running pass, cancelled with the indexer
+        self._thread = None
+        cache.content_index = self.index
+
+    def start(self):
+        """Start indexing in the background."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='content-index', daemon=True)
+            self._wanted.set()
+            self._thread.start()
+        return self
+
+    def schedule(self):
+        """Run another pass once the current one is done, files were added, changed or deleted."""
+        self._idle.clear()
+        self._wanted.set()
+
+    def cancel(self):
+        """Stop after the files currently being extracted, worker processes are stopped right away."""
+        self._cancelled.set()
+        self._wanted.set()
+        pipeline = self._pipeline
+        if pipeline is not None:
+            pipeline.cancel()
+
+    def join(self, timeout: float = None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def wait_idle(self, timeout: float = None) -> bool:
+        """Wait until every scheduled pass is done, returns False on timeout."""
+        return self._idle.wait(timeout)
+
+    def pending_files(self) -> tuple:
+        """
+        Return the (path, st_size, st_mtime_ns) of the cached documents that are not indexed at their current
+        version, and the indexed paths that no longer exist.
+        """
+        with self.cache.lock:
+            nodes = list(self.cache.values())
+        stale, current = [], set()
+        for node in nodes:
+            if not isinstance(node, File) or os.path.splitext(node.name)[1].lower() not in CONTENT_EXTENSIONS:
+                continue
+            try:
+                _, _, st_size, st_mtime_ns = node.stat_key()  # captured while scanning, no syscall
+            except OSError:
+                continue
+            path = node.path
+            current.add(path)
+            if not self.index.is_current(path, st_size, st_mtime_ns):
+                stale.append((path, st_size, st_mtime_ns))
+        # the cache may not hold every directory, only drop files that are gone from disk as well
+        removed = [path for path in self.index.paths() if path not in current and not os.path.exists(path)]
+        return stale, removed
+
+    def _run(self):
+        while True:
+            self._wanted.wait()
+            if self._cancelled.is_set():
+                break
+            self._wanted.clear()
+            try:
+                self._index_pass()
+            except Exception as e:
+                print(f"Content indexing failed: {e}")
+            if not self._wanted.is_set():
+                self._idle.set()
+
+    def _index_pass(self):
+        stale, removed = self.pending_files()
+        if removed:
+            self.index.remove_many(removed)
+        # small files first, more documents become searchable sooner
+        stale.sort(key=lambda entry: entry[1])
+        versions = {path: (st_size, st_mtime_ns) for path, st_size, st_mtime_ns in stale}
+        entries, flushed = [], time.monotonic()
+        for path, terms in self._extract([path for path, _, _ in stale]):
+            if self._cancelled.is_set():
+                break
+            entries.append((path, *versions[path], terms))
+            if len(entries) >= self.flush_size or time.monotonic() - flushed >= FLUSH_SECONDS:
+                self.index.update_many(entries)
+                entries, flushed = [], time.monotonic()
+        if entries:
+            self.index.update_many(entries)
+
+    def _extract(self, paths: list):
+        # yields (path, terms) in the order of paths, terms None where extraction failed
+        extractor = partial(extract_terms, byte_budget=self.byte_budget)
+        items = [(path,) for path in paths]
+        if self.processes and len(items) >= PROCESS_POOL_THRESHOLD:
+            with MetadataPipeline(processes=self.processes, extractor=extractor) as pipeline:
+                # set before checking the flag, cancel() sets the flag before reading it
+                self._pipeline = pipeline
+                try:
+                    if not self._cancelled.is_set():
+                        yield from pipeline.extract(items)
+                finally:
+                    self._pipeline = None
+        else:
+            # no per-file timeout here, SIGALRM can only be used on the main thread
+            for start in range(0, len(items), DEFAULT_BATCH_SIZE):
+                if self._cancelled.is_set():
+                    break
+                yield from extract_batch(items[start:start + DEFAULT_BATCH_SIZE], None, extractor)
+
+
+if __name__ == "__main__":
+    pass
@@ -4,16 +4,38 @@ from docx import Document as Doc
 
 
 class Document(File):
-    def __init__(self, path, cache):
-        super().__init__(path, cache)
+    __slots__ = ('_title', '_authors', '_keywords', '_metadata_loaded')
+
+    def __init__(self, path, cache, name, parent, size=None):
+        super().__init__(path, cache, name, parent, size)
         self._title = None
         self._authors = None
         self._keywords = None
-        self._populate_document_metadata()
+        self._metadata_loaded = False  # metadata is read from the file on first access
+
+    def load_metadata(self):
+        """Read the document metadata from the file if it has not been read yet."""
+        if not self._metadata_loaded:
+            self._metadata_loaded = True
+            self._populate_document_metadata()
+            self.metadata_updated()
+
+    def metadata_record(self) -> dict:
+        """Return the loaded metadata as a plain dict, as produced by MetadataPipeline workers."""
+        return {'title': self._title, 'authors': self._authors, 'keywords': self._keywords}
+
+    def apply_metadata(self, record: dict):
+        """Set the metadata from a record extracted elsewhere, without reading the file."""
+        self._title = record.get('title')
+        self._authors = record.get('authors')
+        self._keywords = record.get('keywords')
+        self._metadata_loaded = True
+        self.metadata_updated()
 
     @property
     def title(self):
         """Return the title of the document."""
+        self.load_metadata()
         return self._title
 
     @title.setter
@@ -23,6 +45,7 @@ class Document(File):
     @property
     def authors(self):
         """Return the authors of the document."""
+        self.load_metadata()
         return self._authors
 
     @authors.setter
@@ -32,6 +55,7 @@ class Document(File):
     @property
     def keywords(self):
         """Return the keywords of the document."""
+        self.load_metadata()
         return self._keywords
 
     @keywords.setter
@@ -0,0 +1,312 @@
+from __future__ import annotations
+import re
+import datetime
+from collections import namedtuple
+import numpy as np
+from python.model.KeywordIndex import KeywordIndex, ID_DTYPE
+
+# changed values are merged into the sorted arrays once there are this many, or 1/MERGE_FRACTION of them
+MERGE_PENDING = 4096
+MERGE_FRACTION = 8
+# fields matched by their words, and the metadata record entries they are read from
+TEXT_FIELDS = {'artist': ('artist',), 'album': ('album',), 'title': ('title', 'track_name'),
+               'author': ('authors',), 'location': ('location',), 'ext': (), 'kind': ()}
+# fields compared as numbers, the record entries of metadata fields
+NUMERIC_FIELDS = {'size': None, 'modified': None, 'year': 'year', 'width': 'width', 'height': 'height',
+                  'duration': 'duration'}
+# field matched against the text of documents, see ContentIndex
+CONTENT_FIELD = 'content'
+FIELD_ALIASES = {'extension': 'ext', 'type': 'kind', 'authors': 'author', 'track': 'title', 'country': 'location',
+                 'date': 'modified', 'mtime': 'modified'}
+# kind: values, for the node classes and the words users are likely to type for them
+KINDS = ('image', 'music', 'document', 'video', 'directory')
+KIND_ALIASES = {'photo': 'image', 'picture': 'image', 'audio': 'music', 'song': 'music', 'doc': 'document',
+                'movie': 'video', 'folder': 'directory', 'dir': 'directory'}
+SIZE_UNITS = {'': 1, 'b': 1, 'k': 1024, 'kb': 1024, 'm': 1024 ** 2, 'mb': 1024 ** 2, 'g': 1024 ** 3,
+              'gb': 1024 ** 3, 't': 1024 ** 4, 'tb': 1024 ** 4}
+# field:value, field:>value, field:a..b, "quoted words" and plain words, each optionally negated with '-'
+TERM_PATTERN = re.compile(r'(-?)(?:(\w+):(>=|<=|>|<|=)?("[^"]*"|\S+)|("[^"]*"|\S+))')
+
+FieldTerm = namedtuple('FieldTerm', ['field', 'operator', 'value', 'negated'])
+
+
+def parse_field_query(query: str) -> list:
+    """
+    Split a query into FieldTerms. Plain words get the field None, unknown fields are kept as plain words.
+
+    @params
+    query: str: query like 'kind:image location:france size:>5MB -ext:png holiday'
+    """
+    terms = []
+    for negated, field, operator, value, word in TERM_PATTERN.findall(query):
+        field = FIELD_ALIASES.get(field.lower(), field.lower())
+        if field and (field in TEXT_FIELDS or field in NUMERIC_FIELDS or field == CONTENT_FIELD):
+            terms.append(FieldTerm(field, operator or '=', value.strip('"'), bool(negated)))
+        else:
+            text = word if word else f'{field}:{operator}{value}'
+            terms.append(FieldTerm(None, '=', text.strip('"'), bool(negated)))
+    return terms
+
+
+def words_of(value) -> list:
+    """Return the lowercased words of a text field value, a string or a list of strings."""
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        value = ' '.join(str(part) for part in value if part)
+    return [word for word in re.split(r'\W+', str(value).lower()) if word]
+
+
+def node_kind(node) -> str:
+    """Return the kind: value of a node, named after the first node class in its hierarchy that has one."""
+    for cls in type(node).__mro__:
+        kind = cls.__name__.lower()
+        if kind in KINDS:
+            return kind
+    return 'file'
+
+
+def kind_of(word: str) -> str:
+    """Return the kind: value a word of a kind: term stands for, 'photos' is 'image' for example."""
+    for candidate in (word, word[:-1] if word.endswith('s') else word):
+        if candidate in KINDS:
+            return candidate
+        if candidate in KIND_ALIASES:
+            return KIND_ALIASES[candidate]
+    return word
+
+
+def parse_size(text: str) -> int:
+    """Parse a size like '5MB', '1.5g' or '300' (bytes) into bytes, units are powers of 1024."""
+    match = re.fullmatch(r'([\d.]+)\s*([a-z]*)', text.lower())
+    if not match or match.group(2) not in SIZE_UNITS:
+        raise ValueError(f"Invalid size: {text}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2)])
+
+
+def parse_date_range(text: str) -> tuple:
+    """Return the [start, end) range in nanoseconds of a local date given as YYYY, YYYY-MM or YYYY-MM-DD."""
+    parts = [int(part) for part in text.split('-')]
+    if not 1 <= len(parts) <= 3:
+        raise ValueError(f"Invalid date: {text}")
+    if len(parts) == 1:
+        start, end = datetime.datetime(parts[0], 1, 1), datetime.datetime(parts[0] + 1, 1, 1)
+    elif len(parts) == 2:
+        start = datetime.datetime(parts[0], parts[1], 1)
+        end = datetime.datetime(parts[0] + parts[1] // 12, parts[1] % 12 + 1, 1)
+    else:
+        start = datetime.datetime(*parts)
+        end = start + datetime.timedelta(days=1)
+    return int(start.timestamp()) * 10 ** 9, int(end.timestamp()) * 10 ** 9
+
+
+def value_range(field: str, operator: str, text: str) -> tuple:
+    """
+    Return the [low, high) range of a numeric field term, None for an open end.
+
+    Dates cover a whole year, month or day, so modified:2023 matches the year, modified:>2023 what comes after
+    it and modified:<=2023-05 everything up to the end of May. Ranges are written low..high, both inclusive.
+    """
+    if '..' in text:
+        low, high = text.split('..', 1)
+        return (value_range(field, '>=', low)[0] if low else None,
+                value_range(field, '<=', high)[1] if high else None)
+    if field == 'modified':
+        start, end = parse_date_range(text)
+    else:
+        start = parse_size(text) if field == 'size' else int(float(text))
+        end = start + 1
+    return {'=': (start, end), '>': (end, None), '>=': (start, None), '<': (None, start), '<=': (None, end)}[operator]
+
+
+class RangeIndex:
+    """
+    Numeric field of the nodes, indexed by node id, with sorted arrays for range lookups.
+
+    The current values live in arrays indexed by node id. A lookup binary-searches arrays of (value, node_id)
+    pairs sorted by value and drops the pairs whose node no longer has that value. Nodes whose value changed
+    since the sorted arrays were built are kept in a small set and checked directly; the arrays are rebuilt
+    once that set grows past MERGE_PENDING or 1/MERGE_FRACTION of their size.
+    """
+    __slots__ = ('values', 'present', '_sorted_values', '_sorted_ids', '_pending')
+
+    def __init__(self):
+        self.values = np.zeros(0, dtype=np.int64)  # node_id -> value
+        self.present = np.zeros(0, dtype=bool)  # node_id -> whether the node has a value
+        self._sorted_values = np.zeros(0, dtype=np.int64)
+        self._sorted_ids = np.zeros(0, dtype=ID_DTYPE)
+        self._pending = set()  # node ids changed since the sorted arrays were built
+
+    def set(self, node_id: int, value):
+        """Set the value of a node, None removes it."""
+        if node_id >= len(self.values):
+            size = max(node_id + 1, 2 * len(self.values), 1024)
+            self.values = np.concatenate((self.values, np.zeros(size - len(self.values), dtype=np.int64)))
+            self.present = np.concatenate((self.present, np.zeros(size - len(self.present), dtype=bool)))
+        if value is None:
+            if not self.present[node_id]:
+                return
+            self.present[node_id] = False
+        else:
+            if self.present[node_id] and self.values[node_id] == value:
+                return
+            self.values[node_id] = value
+            self.present[node_id] = True
+        self._pending.add(node_id)
+        if len(self._pending) >= max(MERGE_PENDING, len(self._sorted_ids) // MERGE_FRACTION):
+            self._merge()
+
+    def _merge(self):
+        ids = np.flatnonzero(self.present).astype(ID_DTYPE)
+        order = np.argsort(self.values[ids], kind='stable')
+        self._sorted_ids = ids[order]
+        self._sorted_values = self.values[self._sorted_ids]
+        self._pending = set()
+
+    def range(self, low=None, high=None) -> np.ndarray:
+        """Return the sorted ids of the nodes with low <= value < high, None for an open end."""
+        sorted_values = self._sorted_values
+        start = 0 if low is None else np.searchsorted(sorted_values, low, side='left')
+        end = len(sorted_values) if high is None else np.searchsorted(sorted_values, high, side='left')
+        ids = self._sorted_ids[start:end]
+        # pairs of nodes whose value changed or was removed since the merge are stale
+        ids = ids[self.present[ids] & (self.values[ids] == sorted_values[start:end])]
+        if self._pending:
+            pending = np.fromiter(self._pending, dtype=ID_DTYPE, count=len(self._pending))
+            values = self.values[pending]
+            inside = self.present[pending]
+            if low is not None:
+                inside &= values >= low
+            if high is not None:
+                inside &= values < high
+            ids = np.concatenate((ids, pending[inside]))
+        return np.unique(ids)
+
+
+class FieldIndex:
+    """
+    Per-field indexes of the cached nodes for field-qualified queries like 'kind:image location:france size:>5MB'.
+
+    Text fields (artist, album, title, author, location, ext, kind) have one KeywordIndex each, mapping the words
+    of the field to posting lists of node ids. Numeric fields (size, modified, year, width, height, duration) are
+    RangeIndexes. Metadata fields are only indexed once a node's metadata is loaded or applied from the metadata
+    store, indexing never reads files. content: terms are answered by the content callable, if one is set.
+
+    @params
+    keyword_index: KeywordIndex: index of the name keywords, used for plain words of a query
+    """
+
+    def __init__(self, keyword_index: KeywordIndex):
+        self.keyword_index = keyword_index
+        self.text = {field: KeywordIndex(ranked=False) for field in TEXT_FIELDS}
+        self.numeric = {field: RangeIndex() for field in NUMERIC_FIELDS}
+        self.id_space = 0
+        self.content = None  # callable returning the sorted ids of the nodes whose text contains a query
+
+    def add(self, node):
+        """Index the fields of a node, replacing the values it was indexed with before."""
+        node_id = node.node_id
+        self.id_space = max(self.id_space, node_id + 1)
+        record = node.metadata_record() if getattr(node, '_metadata_loaded', False) else {}
+        for field, entries in TEXT_FIELDS.items():
+            if field == 'ext':
+                words = [node.name.rpartition('.')[2].lower()] if '.' in node.name.lstrip('.') else []
+            elif field == 'kind':
+                words = [node_kind(node)]
+            else:
+                words = words_of([record.get(entry) for entry in entries if record.get(entry)])
+            index = self.text[field]
+            if words:
+                index.add(node, words)
+            else:
+                index.remove(node)
+        self.numeric['size'].set(node_id, node.size)
+        self.numeric['modified'].set(node_id, node.st_mtime_ns)
+        for field, entry in NUMERIC_FIELDS.items():
+            if entry is not None:
+                self.numeric[field].set(node_id, self._number(record.get(entry)))
+
+    def remove(self, node):
+        """Remove a node from every field."""
+        for index in self.text.values():
+            index.remove(node)
+        for index in self.numeric.values():
+            if node.node_id < len(index.values):
+                index.set(node.node_id, None)
+
+    @staticmethod
+    def _number(value):
+        # the leading number of strings, ID3 years look like '2004' or '2004-05-01'
+        if value is None:
+            return None
+        match = re.match(r'\d+(\.\d*)?', str(value))
+        return int(float(match.group())) if match else None
+
+    def match(self, term: FieldTerm) -> np.ndarray:
+        """Return the sorted ids of the nodes matching one term, ignoring its negation."""
+        if term.field is None:
+            return self.keyword_index.match_all(words_of(term.value))
+        if term.field == CONTENT_FIELD:
+            return self.content(term.value) if self.content is not None else np.empty(0, dtype=ID_DTYPE)
+        if term.field in self.text:
+            words = words_of(term.value)
+            if term.field == 'kind':
+                words = [kind_of(word) for word in words]
+            return self.text[term.field].match_all(words)
+        try:
+            return self.numeric[term.field].range(*value_range(term.field, term.operator, term.value))
+        except (ValueError, KeyError) as e:
+            print(f"Invalid {term.field} value {term.value!r}: {e}")
+            return np.empty(0, dtype=ID_DTYPE)
+
+    def evaluate(self, terms: list, all_ids=None) -> np.ndarray:
+        """
+        Return the sorted ids of the nodes matching every term and none of the negated ones.
+
+        The most selective term is evaluated first and the others filter it.
+
+        @params
+        terms: list: FieldTerms, see parse_field_query()
+        all_ids: callable: returns the sorted ids of all nodes, used when every term is negated
+        """
+        positive = [self.match(term) for term in terms if not term.negated]
+        if positive:
+            positive.sort(key=len)
+            result = positive[0]
+            for ids in positive[1:]:
+                result = np.intersect1d(result, ids, assume_unique=True)
+        else:
+            result = all_ids() if all_ids is not None else np.empty(0, dtype=ID_DTYPE)
+        for term in terms:
+            if term.negated and len(result):
+                result = result[~np.isin(result, self.match(term), assume_unique=True)]
+        return result.astype(ID_DTYPE, copy=False)
+
+
+if __name__ == "__main__":
+    # check the document and video fields against a scanned PDF and a video with an applied record
+    import os
+    import tempfile
+    from PyPDF2 import PdfWriter
+    from python.model.FileSystemCache import FileSystemCache
+    from python.model.FileSystemScanner import FileSystemScanner
+
+    with tempfile.TemporaryDirectory() as directory:
+        writer = PdfWriter()
+        writer.add_blank_page(width=72, height=72)
+        writer.add_metadata({'/Title': 'Quarterly report', '/Author': 'Ada Lovelace'})
+        with open(os.path.join(directory, 'report.pdf'), 'wb') as pdf_file:
+            writer.write(pdf_file)
+        with open(os.path.join(directory, 'clip.mp4'), 'wb') as video_file:
+            video_file.write(b'\0')
+        cache = FileSystemCache()
+        FileSystemScanner(directory, cache).scan()
+        cache.field_index()
+        cache.get(os.path.join(directory, 'report.pdf')).load_metadata()
+        cache.get(os.path.join(directory, 'clip.mp4')).apply_metadata({'duration': 95.0})
+        for query, expected in (('kind:document', 'report.pdf'), ('title:quarterly', 'report.pdf'),
+                                ('author:lovelace', 'report.pdf'), ('kind:video', 'clip.mp4'),
+                                ('duration:>60', 'clip.mp4')):
+            names = [node.name for node in cache.search(query)]
+            assert names == [expected], (query, names)
+            print(f"{query}: {names}")
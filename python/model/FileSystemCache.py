@@ -1,99 +1,534 @@
 from __future__ import annotations
 import pickle
 import os
-from datetime import datetime
+import tempfile
+import threading
+import time
+import random
 import re
+import numpy as np
+
+from python.model.ScanRules import ScanRules
+from python.model.KeywordIndex import KeywordIndex, ID_DTYPE
+from python.model.TrigramIndex import TrigramIndex
+from python.model.FieldIndex import FieldIndex, parse_field_query
+from python.model.RankedSearch import PAGE_SIZE, DEPTH_WEIGHT, recency_bonus, depth_bonus, top_k
+
+CACHE_FILE = 'cache/system_model_cache.pkl'
+CACHE_FORMAT_VERSION = 9  # bump when the pickled layout of the cache or its nodes changes
+# moved directories remembered before the path index is rebuilt from scratch
+PATH_INDEX_MAX_MOVES = 10000
+
+
+def write_atomic(path: str, data: bytes):
+    """
+    Write data to path via a temporary file in the same directory and an atomic rename,
+    so readers only ever see the previous file or the complete new one.
+    """
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path), suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            tmp_file.write(data)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
 
 
 class FileSystemCache:
-    """A simple cache for storing file and directory nodes."""
+    """
+    A simple cache for storing file and directory nodes.
+
+    Nodes are stored by a node_id the cache assigns on their first update, which stays the same
+    when a node is renamed or moved. Paths are derived from parent links, path_index only maps
+    paths to node ids as hints: a hint is checked against the node's current path when it is used.
+    Moving a directory therefore only re-keys the directory itself, the hints of the nodes below
+    it go stale and are corrected the next time one of them is looked up, by walking down from the
+    moved directory.
+    """
 
     def __init__(self):
-        self.body: dict = {}
-        self.keyword_index = {}
+        self.body: dict = {}  # node_id -> node
+        self.path_index: dict = {}  # path -> node_id, may be stale below moved directories
+        self.keyword_index = KeywordIndex()
+        self.dir_mtimes: dict = {}  # node_id -> st_mtime_ns of the directory when it was last listed
+        self._next_id = 0
+        self._moved = set()  # paths directories were moved to since the path index was last rebuilt
+        self.scan_rules = ScanRules()  # rules the cached tree was scanned with
+        self.lock = threading.RLock()  # guards body and keyword_index against the background writer
+        self.persister = None  # CachePersister writing checkpoints, if one is attached
+        self.watcher = None  # FileSystemWatcher keeping the cache in sync, if one is attached
+        self.version = 0  # incremented on every change, tells derived structures they are outdated
+        self._columnar = None  # (version, root path, ColumnarStore) of the last columnar() call
+        self.snapshot = None  # BinarySnapshot the tree was loaded from, builds nodes on first access
+        self.tree_store = None  # SQLiteTreeStore the tree was partially loaded from, loads directories on access
+        self._trigrams = None  # TrigramIndex over node names, built by the first substring search
+        self._fields = None  # FieldIndex of names, sizes, dates and metadata, built by the first field query
+        self.content_index = None  # ContentIndex of the text of documents, attached by a ContentIndexer
 
     def update(self, path: str, node: FileSystemNode):
-        """Update the cache with the given file or directory node."""
+        """Update the cache with the given file or directory node, replacing the node at path, if any."""
         path = os.path.normpath(path)
-        self.body[path] = node
-        node.cache_timestamp = datetime.now()
+        with self.lock:
+            self.version += 1
+            if node.node_id is None:
+                node.node_id = self._next_id
+                self._next_id += 1
+            replaced = self.body.get(self.path_index.get(path))
+            # without moves no hint is stale, the node found at path is the one being replaced
+            if replaced is not None and replaced is not node and (not self._moved or replaced.path == path):
+                self.remove_node(replaced)
+            self.body[node.node_id] = node
+            self.path_index[path] = node.node_id
+            node.cache_timestamp = time.time_ns()
 
-        # update reverse index
-        keywords = self.extract_keywords(node)
-        # print(f"Extracted Keywords: {keywords}\nFrom: {node}")
-        for keyword in keywords:
-            if keyword not in self.keyword_index:
-                self.keyword_index[keyword] = set()
-            self.keyword_index[keyword].add(node)
+            # update reverse index, a node updated again is re-indexed under its current keywords
+            keywords = self.extract_keywords(node)
+            # print(f"Extracted Keywords: {keywords}\nFrom: {node}")
+            self.keyword_index.add(node, keywords)
+            if self._trigrams is not None:
+                self._trigrams.add(node)
+            if self._fields is not None:
+                self._fields.add(node)
 
-    def search(self, query: str, match_any: bool = False):
+    def set_dir_mtime(self, node: FileSystemNode, mtime_ns: int):
+        """Record the st_mtime_ns a directory had when it was listed, under the lock the persister pickles with."""
+        with self.lock:
+            self.dir_mtimes[node.node_id] = mtime_ns
+
+    def search(self, query: str, match_any: bool = False, fuzzy: bool = False):
         """
         Function to perform keyword search on the given query, search type can be specified using match_any
         match_any = False -> AND search, must match all keywords
         match_any = True -> OR search, must match any keyword
+        Words prefixed with '-' exclude the nodes matching them, in both search types.
+        With fuzzy, keywords also match indexed keywords one or two edits away, see fuzzy_edits().
 
         @params:
         query: str: keywords to be searched, given as a search string
         match_any: bool: boolean to specify which search type to perform.
+        fuzzy: bool: tolerate misspelled keywords
         """
-        query_keywords = set(re.split(r'\W+', query.lower()))
-        query_keywords.discard('')
-        if match_any:
-            return self._search_match_any(query_keywords)
-        else:
-            return self._search_match_all(query_keywords)
-
-    def _search_match_all(self, query_keywords: set):
-        matching_files = set()
-        for keyword in query_keywords:
-            if keyword in self.keyword_index:
-                if not matching_files:
-                    matching_files = self.keyword_index[keyword].copy()
-                else:
-                    matching_files &= self.keyword_index[keyword]
+        with self.lock:
+            return set(self.nodes_of(self.search_ids(query, match_any, fuzzy)))
+
+    def search_ids(self, query: str, match_any: bool = False, fuzzy: bool = False):
+        """Run a search like search() and return the sorted node ids of the matches as a NumPy array."""
+        terms = parse_field_query(query)
+        if any(term.field for term in terms):
+            with self.lock:
+                return self._search_fields(terms)
+        query_keywords, excluded_keywords = self._parse_query(query)
+        with self.lock:
+            if fuzzy:
+                return self.keyword_index.match_fuzzy(query_keywords, match_any, excluded_keywords)
+            if match_any:
+                return self._search_match_any(query_keywords, excluded_keywords)
+            return self._search_match_all(query_keywords, excluded_keywords)
+
+    def ranked_search(self, query: str, limit: int = PAGE_SIZE, offset: int = 0, fuzzy: bool = False,
+                      substring: bool = False):
+        """
+        Return one page of the nodes matching any keyword of query, best first, and the number of matches.
+
+        Matches are ranked by their BM25 score for the query keywords plus a bonus for recently modified
+        nodes and one for nodes close to the root. Only the best offset + limit matches are ranked with a
+        bounded heap, so a broad query never materializes all of its matches; later pages rank further.
+
+        @params
+        query: str: keywords to be searched, '-' excludes like in search()
+        limit: int: number of nodes per page
+        offset: int: number of better matches to skip, a multiple of limit for page-wise loading
+        fuzzy: bool: tolerate misspelled keywords
+        substring: bool: match nodes whose names contain query instead of its keywords, keyword matches
+                   still rank first
+        """
+        terms = parse_field_query(query)
+        query_keywords, excluded_keywords = self._parse_query(query)
+        with self.lock:
+            index = self.keyword_index
+            if any(term.field for term in terms):
+                # field-qualified queries match like search(), the plain words rank the matches
+                ids = self._search_fields(terms)
+                query_keywords, _ = self._parse_query(' '.join(term.value for term in terms
+                                                               if term.field is None and not term.negated))
+            elif substring:
+                term = ' '.join(word for word in query.split() if not word.startswith('-'))
+                ids = index.exclude(self.trigram_index().search(term), excluded_keywords)
+            elif fuzzy:
+                ids = index.match_fuzzy(query_keywords, True, excluded_keywords)
             else:
-                return set()
+                ids = index.match_any(query_keywords, excluded_keywords)
+            if fuzzy:
+                # a misspelled keyword scores through the keywords it matched
+                query_keywords = {similar for keyword in query_keywords for similar in index.fuzzy_keywords(keyword)}
+            ids = ids[ids < len(index.mtimes)]  # only nodes the keyword index has seen
+            scores = index.bm25(ids, query_keywords) + recency_bonus(index.mtimes[ids], time.time_ns())
+            body = self.body
+            ranked = top_k(ids, scores, offset + limit, lambda node_id: depth_bonus(body[node_id]), DEPTH_WEIGHT)
+            return [body[node_id] for _, node_id in ranked[offset:]], len(ids)
+
+    def field_index(self) -> FieldIndex:
+        """
+        Return the FieldIndex of the cached nodes for field-qualified queries.
+
+        It is built on first use and kept up to date by update(), remove_node(), relocate(), metadata_updated() and
+        node_changed() afterwards. Metadata fields only cover nodes whose metadata is loaded. It is not saved with the cache.
+        """
+        with self.lock:
+            if self._fields is None:
+                fields = FieldIndex(self.keyword_index)
+                fields.content = self._content_ids
+                for node in self.body.values():
+                    fields.add(node)
+                self._fields = fields
+            return self._fields
+
+    def metadata_updated(self, node: FileSystemNode):
+        """Re-index the metadata fields of a node after its metadata was loaded or applied."""
+        with self.lock:
+            if self._fields is not None and self.contains_node(node):
+                self._fields.add(node)
+        if self.persister is not None:
+            self.persister.metadata_loaded(node)
+
+    def node_changed(self, node: FileSystemNode):
+        """
+        Re-index a node whose file was modified in place, its size and mtime changed but its path did not.
+
+        The size:, modified: and metadata fields and the mtime used for recency ranking are refreshed, metadata
+        fields are dropped while the metadata is not loaded again.
+        """
+        with self.lock:
+            if not self.contains_node(node):
+                return
+            self.version += 1
+            # keywords come from the path and stay the same, adding again only stores the new mtime
+            self.keyword_index.add(node, self.extract_keywords(node))
+            if self._fields is not None:
+                self._fields.add(node)
+
+    def _search_fields(self, terms: list):
+        """
+        Evaluate a field-qualified query like 'kind:image location:france size:>5MB modified:2023 -ext:png'.
+
+        Every term has to match: fields are artist, album, title, author, location, ext and kind, which match
+        words, and size, modified, year, width, height and duration, which take a value, a comparison like >5MB
+        or a range like 2020..2022. content:"quoted words" matches documents containing the words, once a
+        ContentIndexer has indexed them. Plain words match name keywords and '-' excludes a term.
+        """
+        fields = self.field_index()
+        return fields.evaluate(terms, lambda: np.fromiter(sorted(self.body), dtype=ID_DTYPE, count=len(self.body)))
+
+    def _content_ids(self, query: str):
+        # sorted ids of the cached nodes whose text contains every word of query, so far as it is indexed
+        if self.content_index is None:
+            return np.empty(0, dtype=ID_DTYPE)
+        with self.lock:
+            nodes = [self.get(path) for path in self.content_index.search(query)]
+            return np.unique(np.array([node.node_id for node in nodes if node is not None], dtype=ID_DTYPE))
+
+    def _parse_query(self, query: str):
+        query_keywords, excluded_keywords = set(), set()
+        for word in query.lower().split():
+            target = excluded_keywords if word.startswith('-') else query_keywords
+            target.update(re.split(r'\W+', word))
+        query_keywords.discard('')
+        excluded_keywords.discard('')
+        return query_keywords, excluded_keywords
+
+    def _search_match_all(self, query_keywords: set, excluded_keywords: set = ()):
+        return self.keyword_index.match_all(query_keywords, excluded_keywords)
+
+    def _search_match_any(self, query_keywords: set, excluded_keywords: set = ()):
+        return self.keyword_index.match_any(query_keywords, excluded_keywords)
+
+    def nodes_of(self, ids) -> list:
+        """Return the cached nodes with the given node ids."""
+        body = self.body
+        return [body[node_id] for node_id in ids.tolist() if node_id in body]
+
+    def complete(self, prefix: str, k: int = 10) -> list:
+        """Return up to k keywords starting with prefix, the ones occurring in the most nodes first."""
+        with self.lock:
+            return self.keyword_index.completions(prefix.lower(), k)
+
+    def trigram_index(self) -> TrigramIndex:
+        """
+        Return the TrigramIndex over the names of the cached nodes.
+
+        It is built on first use, which takes a few seconds for a million nodes, and kept up to date by
+        update(), remove_node() and relocate() afterwards. It is not saved with the cache.
+        """
+        with self.lock:
+            if self._trigrams is None:
+                self._trigrams = TrigramIndex.build(self.body.values())
+            return self._trigrams
+
+    def search_substring(self, term: str) -> list:
+        """Return the cached nodes whose names contain term, compared case-insensitively."""
+        with self.lock:
+            return self.nodes_of(self.trigram_index().search(term))
 
-        return matching_files
+    def get(self, path: str, default=None):
+        """Return the node at path, or default if there is none."""
+        path = os.path.normpath(path)
+        with self.lock:
+            node = self._hinted(path)
+            if node is None and self._moved:
+                node = self._resolve(path)
+            if node is None and self.snapshot is not None:
+                node = self.snapshot.find(path)
+            if node is None and self.tree_store is not None:
+                node = self.tree_store.find(path)
+        return node if node is not None else default
+
+    def _hinted(self, path: str):
+        node = self.body.get(self.path_index.get(path))
+        if node is not None and self._moved and node.path != path:
+            del self.path_index[path]  # the node was moved away
+            return None
+        return node
+
+    def _resolve(self, path: str):
+        """Find a node below a moved directory by walking down from it, then remember its path."""
+        if not any(ancestor in self._moved for ancestor in self._ancestors(path)):
+            return None
+        parent_path = os.path.dirname(path)
+        parent = self._hinted(parent_path) or self._resolve(parent_path)
+        if parent is None:
+            return None
+        name = os.path.basename(path)
+        node = next((child for child in parent.children if child.name == name), None)
+        if node is not None and self.body.get(node.node_id) is node:
+            self.path_index[path] = node.node_id
+            return node
+        return None
+
+    @staticmethod
+    def _ancestors(path: str):
+        """Yield path and the paths of the directories above it."""
+        while True:
+            yield path
+            parent_path = os.path.dirname(path)
+            if parent_path == path:
+                return
+            path = parent_path
 
-    def _search_match_any(self, query_keywords: set):
-        matching_files = set()
-        for keyword in query_keywords:
-            if keyword in self.keyword_index:
-                matching_files |= self.keyword_index[keyword] # union of matching files
+    def _rebuild_path_index(self):
+        """Replace every path hint with the current path of its node."""
+        self.path_index = {node.path: node_id for node_id, node in self.body.items()}
+        self._moved.clear()
 
-        return matching_files
+    def contains_node(self, node: FileSystemNode) -> bool:
+        """Check if the node itself (not just a node at its path) is in the cache."""
+        return node.node_id is not None and self.body.get(node.node_id) is node
 
     def is_modified(self, path: str):
-        """Check if the file or directory has been modified since it was last cached."""
-        cached_node = self.body[path]
-        if cached_node:
-            return cached_node.modification_date() != datetime.fromtimestamp(os.path.getmtime(path))
-        return True
+        """Check if the file or directory has been modified since it was last cached (one stat call)."""
+        cached_node = self.get(path)
+        if cached_node is None or cached_node.st_mtime_ns is None:
+            return True
+        try:
+            return os.stat(path).st_mtime_ns != cached_node.st_mtime_ns
+        except OSError:
+            return True
 
     def remove(self, path: str):
-        """Remove a file or directory from the cache."""
-        if path in self.body:
-            del self.body[path]
-
-    def save_to_file(self):
-        if not os.path.exists('cache/system_model_cache.pkl'):
-            # code to create file here
-            os.makedirs('cache', exist_ok=True)
-        with open('cache/system_model_cache.pkl', 'wb') as pickle_file:
-            pickle.dump(self, pickle_file)
-
-    def load_from_file(self):
+        """Remove a file or directory from the cache, including its keyword index entries."""
+        with self.lock:
+            node = self.get(path)
+            if node is not None:
+                self.remove_node(node)
+
+    def remove_node(self, node: FileSystemNode):
+        """Remove a node from the cache by its node_id, including its keyword index entries."""
+        with self.lock:
+            if not self.contains_node(node):
+                return
+            del self.body[node.node_id]
+            self.dir_mtimes.pop(node.node_id, None)
+            path = node.path
+            if self.path_index.get(path) == node.node_id:
+                del self.path_index[path]
+            self.version += 1
+            self.keyword_index.remove(node)
+            if self._trigrams is not None:
+                self._trigrams.remove(node)
+            if self._fields is not None:
+                self._fields.remove(node)
+
+    def relocate(self, node: FileSystemNode, move):
+        """
+        Re-key a node while move() changes its name or parent, in constant time.
+
+        Only the node's own path hint and keywords change, in O(keywords). Paths below a moved directory follow
+        from the parent links, their hints are corrected when they are next looked up.
+
+        @params
+        node: FileSystemNode: node that is being moved
+        move: callable: called without arguments to change the node's name or parent
+        """
+        with self.lock:
+            old_path = node.path
+            move()
+            new_path = node.path
+            self.version += 1
+            if self.path_index.get(old_path) == node.node_id:
+                del self.path_index[old_path]
+            if node.children:
+                if len(self._moved) >= PATH_INDEX_MAX_MOVES:
+                    self._rebuild_path_index()
+                self._moved.add(new_path)
+            self.path_index[new_path] = node.node_id
+            if self.persister is not None:
+                self.persister.node_moved(old_path, new_path)
+            # a rename changes the node's keywords, the reverse map knows the old ones
+            if self.contains_node(node):
+                self.keyword_index.add(node, self.extract_keywords(node))
+                if self._trigrams is not None:
+                    self._trigrams.add(node)
+                if self._fields is not None:
+                    self._fields.add(node)
+
+    def columnar(self, root_path: str):
+        """
+        Return a ColumnarStore of the tree below root_path for vectorized analytics.
+
+        The store is a snapshot, it is built on first use and rebuilt once the cache has changed.
+        Returns None if root_path is not a cached directory.
+        """
+        from python.model.ColumnarStore import ColumnarStore
+        from python.model.FileSystemNodeModel import Directory
+        root_path = os.path.normpath(root_path)
+        with self.lock:
+            if self.snapshot is not None:
+                # building the rest of a snapshot's nodes changes the version, do it up front
+                self.snapshot.materialize()
+            cached = self._columnar
+            if cached is not None and cached[0] == self.version and cached[1] == root_path:
+                return cached[2]
+            root = self.get(root_path)
+            if not isinstance(root, Directory):
+                return None
+            version = self.version
+            store = ColumnarStore.from_tree(root)
+            self._columnar = (version, root_path, store)
+            return store
+
+    def checkpoint(self, directory: FileSystemNode = None):
+        """Report a finished directory to the attached persister, which decides when to write."""
+        if self.persister is not None:
+            self.persister.directory_done(directory)
+
+    def dump_bytes(self) -> bytes:
+        """Pickle the cache while holding its lock so the snapshot is consistent."""
+        with self.lock:
+            return pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def save_to_file(self, path: str = CACHE_FILE):
+        """Write the whole cache to disk now, replacing the previous file atomically."""
+        write_atomic(path, self.dump_bytes())
+
+    def save_snapshot(self, root_path: str, path: str = None):
+        """Write the tree below root_path as a binary snapshot now, see BinarySnapshot."""
+        from python.model.BinarySnapshot import write_snapshot, SNAPSHOT_FILE
+        with self.lock:
+            write_snapshot(self[os.path.normpath(root_path)], path or SNAPSHOT_FILE, self.scan_rules)
+
+    def close(self):
+        """Stop the attached watcher, then flush and stop the attached persister, if any."""
+        if self.watcher is not None:
+            self.watcher.stop()
+        if self.persister is not None:
+            self.persister.close()
+
+    @classmethod
+    def load_from_file(cls, path: str = CACHE_FILE):
+        """
+        Load the last saved cache snapshot.
+
+        Returns the loaded FileSystemCache, or None if there is no snapshot or it was written
+        by an incompatible version of the cache format.
+        """
         print("loading cache from file")
-        # try:
-        #     with open('cache/system_model_cache.pkl', 'rb') as pickle_file:
-        #         loaded: FileSystemCache = pickle.load(pickle_file)
-        #         self.body = loaded.body
-        #         self.keyword_index = loaded.keyword_index
-        #     return True
-        # except:
-        #     return False
-        return False
+        try:
+            with open(path, 'rb') as pickle_file:
+                loaded = pickle.load(pickle_file)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Failed to load cache from {path}: {e}")
+            return None
+
+        if not isinstance(loaded, cls) or getattr(loaded, 'format_version', None) != CACHE_FORMAT_VERSION:
+            print(f"Ignoring cache at {path}: unsupported format")
+            return None
+        return loaded
+
+    @classmethod
+    def load_snapshot(cls, path: str = None):
+        """
+        Open a binary snapshot written by save_snapshot.
+
+        The file is memory mapped and only the root node is built, the rest of the tree is built
+        as it is accessed. Returns the new FileSystemCache, or None if there is no snapshot or it
+        was written in an unsupported format.
+        """
+        from python.model.BinarySnapshot import BinarySnapshot, SNAPSHOT_FILE
+        path = path or SNAPSHOT_FILE
+        print("loading cache snapshot from file")
+        try:
+            snapshot = BinarySnapshot(path)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Failed to load cache snapshot from {path}: {e}")
+            return None
+        cache = cls()
+        snapshot.load(cache)
+        return cache
+
+    def stale_directories(self, root: str, sample_size: int = 64) -> list:
+        """
+        Spot check a loaded snapshot against the disk.
+
+        Stats the root and a random sample of the directories below it and returns the ones that
+        are missing or whose st_mtime_ns differs from the recorded one.
+
+        @params
+        root: str: path of the scanned root directory
+        sample_size: int: number of directories below the root to check
+        """
+        root = os.path.normpath(root)
+        with self.lock:
+            recorded = {node.path: mtime for node, mtime in
+                        ((self.body.get(node_id), mtime) for node_id, mtime in self.dir_mtimes.items())
+                        if node is not None}
+        if self.snapshot is not None and self.snapshot.root_path == root:
+            # most directories of a snapshot are not built yet, sample its records instead
+            recorded = dict(self.snapshot.sample_directory_mtimes(sample_size), **{root: recorded.get(root)})
+            sample = [path for path in recorded if path != root]
+        else:
+            prefix = os.path.join(root, '')
+            below_root = [path for path in recorded if path.startswith(prefix)]
+            sample = random.sample(below_root, min(sample_size, len(below_root)))
+
+        stale = []
+        for path in [root] + sample:
+            try:
+                if os.stat(path).st_mtime_ns != recorded.get(path):
+                    stale.append(path)
+            except OSError:
+                stale.append(path)
+        return stale
 
     @staticmethod
     def extract_keywords(node: FileSystemNode):
@@ -116,7 +551,39 @@ class FileSystemCache:
         return self.body.values()
 
     def keys(self):
-        return self.body.keys()
+        """Return the paths of the cached nodes, built from their parent links."""
+        return [node.path for node in self.body.values()]
+
+    def __contains__(self, path: str):
+        return self.get(path) is not None
+
+    def __getstate__(self):
+        # locks and the writer thread cannot be pickled
+        state = self.__dict__.copy()
+        del state['lock']
+        state['persister'] = None
+        state['watcher'] = None
+        state['_columnar'] = None
+        state['snapshot'] = None
+        state['tree_store'] = None
+        state['_trigrams'] = None
+        state['_fields'] = None
+        state['content_index'] = None
+        state['format_version'] = CACHE_FORMAT_VERSION
+        return state
+
+    def __setstate__(self, state):
+        state.setdefault('dir_mtimes', {})
+        state.setdefault('scan_rules', ScanRules())
+        state.setdefault('watcher', None)
+        state.setdefault('version', 0)
+        state.setdefault('snapshot', None)
+        state.setdefault('tree_store', None)
+        state['_trigrams'] = None
+        state['_fields'] = None
+        state.setdefault('content_index', None)
+        self.__dict__.update(state)
+        self.lock = threading.RLock()
 
     def __str__(self):
         ret = ""
@@ -125,9 +592,9 @@ class FileSystemCache:
         return ret
 
     def __getitem__(self, key):
-        if key in self.body.keys():
-            if self.is_modified(key):
-                raise Exception(f"Item {key} outdated in cache.")
-            return self.body[key]
+        # lookups trust the cache, staleness is checked explicitly with is_modified or node.refresh()
+        node = self.get(key)
+        if node is not None:
+            return node
         else:
             raise Exception(f"Item {key} not in cache.")
@@ -1,5 +1,6 @@
 from __future__ import annotations
 import os
+import sys
 import shutil
 import hashlib
 from datetime import datetime
@@ -14,21 +15,93 @@ import subprocess
 import PIL.Image
 from PIL.ExifTags import TAGS
 
-from PyQt5.QtCore import QRunnable, QThreadPool
+from python.model.ScanRules import child_rel_path
+
+COUNTRY_COORDS_FILE = os.path.join(os.path.dirname(__file__), '..', '..', 'resources', 'country-coord.csv')
+# files represented by Document and Video nodes, see file_node_class()
+DOCUMENT_EXTENSIONS = ('.pdf', '.docx', '.doc')
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi', '.mkv', '.webm', '.m4v')
 
 
 class FileSystemNode:
-    """Represents a file or directory in the file system."""
+    """
+    Represents a file or directory in the file system.
+
+    Nodes use __slots__ and keep only their own name: the full path is derived from the parent
+    links, only a node without a parent (the root of a tree) stores its path. Names are interned,
+    so the same file name in many directories is stored once.
+    """
+    __slots__ = ('name', 'parent', 'cache', 'size', 'cache_timestamp', 'node_id', '_path', '_revert_path',
+                 'st_mtime_ns', 'st_ctime_ns', 'st_ino', 'st_dev', 'st_blocks')
 
     def __init__(self, path: str, cache: FileSystemCache, parent, size = None):
-        self.path = os.path.normpath(path)
-        self.name = os.path.basename(os.path.normpath(path))
-        self.revert_path = path
-        self.cache_timestamp = None
-        self.cache = cache
+        path = os.path.normpath(path)
+        self.name = sys.intern(os.path.basename(path))
         self.parent = parent if parent else None
-        self.children = []
+        self._path = path if self.parent is None else None
+        self._revert_path = None  # only set once the node was moved, see revert_path
+        self.cache_timestamp = None  # time.time_ns() of the last cache update
+        self.node_id = None  # assigned by the cache on the first update, kept across moves
+        self.cache = cache
         self.size = size
+        # stat fields captured once during the scan, see set_stat and refresh
+        self.st_mtime_ns = None
+        self.st_ctime_ns = None
+        self.st_ino = None
+        self.st_dev = None
+        self.st_blocks = None
+
+    @property
+    def path(self) -> str:
+        """Return the full path, built from the names of the node's ancestors."""
+        names = []
+        node = self
+        while node.parent is not None:
+            names.append(node.name)
+            node = node.parent
+        if not names:
+            return node._path
+        names.append(node._path)
+        return os.path.join(*reversed(names))
+
+    @property
+    def revert_path(self) -> str:
+        """Return the path the node had before it was moved, its current path if it never was."""
+        return self._revert_path if self._revert_path is not None else self.path
+
+    @revert_path.setter
+    def revert_path(self, value: str):
+        value = os.path.normpath(value)
+        self._revert_path = value if value != self.path else None
+
+    def walk(self):
+        """Yield this node and every node below it."""
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(node.children)
+
+    def set_stat(self, stat_result: os.stat_result):
+        """Keep the stat fields the model uses, normally taken from DirEntry.stat() while scanning."""
+        self.st_mtime_ns = stat_result.st_mtime_ns
+        self.st_ctime_ns = stat_result.st_ctime_ns
+        self.st_ino = stat_result.st_ino
+        self.st_dev = stat_result.st_dev
+        self.st_blocks = getattr(stat_result, 'st_blocks', None)  # not available on Windows
+
+    def refresh(self):
+        """Re-read the stat fields from disk, the accessors below never stat on their own once set."""
+        self.set_stat(os.stat(self.path))
+
+    def _ensure_stat(self):
+        if self.st_mtime_ns is None:
+            self.refresh()
+
+    def stat_key(self) -> tuple:
+        """Return the (st_dev, st_ino, st_size, st_mtime_ns) key of this version of the file."""
+        self._ensure_stat()
+        return self.st_dev, self.st_ino, self.get_size(), self.st_mtime_ns
 
     def find_node_from_cache(self, name: str) -> FileSystemNode:
         try:
@@ -44,10 +117,6 @@ class FileSystemNode:
         for child in self.children:
             child.print_tree(level + 1)
 
-    def name(self):
-        """Return the name of the file or directory."""
-        return self.name
-
     def get_size(self):
         """Return the size of the file in bytes."""
         if self.size is None:
@@ -59,11 +128,13 @@ class FileSystemNode:
 
     def creation_date(self):
         """Return the creation date of the file."""
-        return datetime.fromtimestamp(os.path.getctime(self.path))
+        self._ensure_stat()
+        return datetime.fromtimestamp(self.st_ctime_ns / 1e9)
 
     def modification_date(self):
         """Return the modification date of the file."""
-        return datetime.fromtimestamp(os.path.getmtime(self.path))
+        self._ensure_stat()
+        return datetime.fromtimestamp(self.st_mtime_ns / 1e9)
 
     def delete(self):
         """Delete the file or directory."""
@@ -73,7 +144,8 @@ class FileSystemNode:
             os.remove(self.path)
         if self.parent:
             self.parent.children.remove(self)
-        self.cache.remove(self.path)
+        for node in self.walk():
+            self.cache.remove_node(node)
 
     def change_permissions(self, mode):
         """Change the permissions of the file."""
@@ -101,16 +173,23 @@ class FileSystemNode:
 
     def _move_update_metadata(self, new_path):
         normalized_new_path = os.path.normpath(new_path)  # Normalize the new path
-        self.revert_path = self.path
-        self.path = normalized_new_path
-        # update data structure
-        self.parent.remove_child(self)
-        parent_dir = os.path.dirname(normalized_new_path)
-        self.parent = self.cache[parent_dir]
-        self.parent.add_child(self)
+        old_path = self.path
+        new_parent = self.cache[os.path.dirname(normalized_new_path)]
+
+        def relink():
+            # update data structure, paths below a moved directory follow from the parent links
+            self.parent.remove_child(self)
+            self.name = sys.intern(os.path.basename(normalized_new_path))
+            new_parent.add_child(self)
+
         # update cache
-        self.cache.remove(self.revert_path)
-        self.cache.update(normalized_new_path, self)
+        self.cache.relocate(self, relink)
+        self.revert_path = old_path
+        # a move can change ctime, device and inode
+        try:
+            self.refresh()
+        except OSError:
+            pass
 
 
     def to_json(self):
@@ -155,14 +234,10 @@ class FileSystemNode:
             return None
 
     def search(self, search_term: str):
-        """Search for nodes including search_term as a substring in cache"""
+        """Search for nodes whose names include search_term as a substring in cache"""
         search_term = search_term.lower()  # Ensure case-insensitive comparison
-        result_list = []
-
-        for keyword, nodes in self.cache.keyword_index.items():
-            if search_term in keyword:
-                print(f"Keyword found: {keyword}")
-                result_list.extend(nodes)  # Add all nodes associated with the found keyword
+        # the trigram index narrows the names to those sharing the term's trigrams instead of scanning every keyword
+        result_list = self.cache.search_substring(search_term)
 
         if result_list:
             return result_list
@@ -170,6 +245,11 @@ class FileSystemNode:
             print("Keyword not found")
             return []
 
+    def metadata_updated(self):
+        """Let the cache re-index the metadata fields of this node, detached nodes have no cache."""
+        if self.cache is not None:
+            self.cache.metadata_updated(self)
+
     def isinstance(self, obj_type: object):
         """Check if the node is an instance of the given type."""
         return isinstance(self.__class__, obj_type)
@@ -179,13 +259,21 @@ class FileSystemNode:
 
 
 class File(FileSystemNode):
+    __slots__ = ()
+    children = ()  # files never have children, shared instead of an empty list per file
+
     def __init__(self, path: str, cache: FileSystemCache, name, parent, size=None):
         super().__init__(os.path.normpath(path), cache, parent, size)
-        self.name = name  # give file a name
+        self.name = sys.intern(name)  # give file a name
 
     def __str__(self) -> str:
         return self.name
 
+    def set_stat(self, stat_result: os.stat_result):
+        """Keep the stat fields the model uses, including the file size."""
+        super().set_stat(stat_result)
+        self.size = stat_result.st_size
+
     def extension(self):
         """Return the file's extension."""
         _, ext = os.path.splitext(self.path)
@@ -194,66 +282,72 @@ class File(FileSystemNode):
 
 class Directory(FileSystemNode):
     """Represents a directory in the file system."""
+    __slots__ = ('children',)
 
-    def __init__(self, path: str, cacheObj: FileSystemCache, name, parent):
+    def __init__(self, path: str, cacheObj: FileSystemCache, name, parent, populate=True):
         super().__init__(os.path.normpath(path), cacheObj, parent, size=0)
-        self.name = name
-        self._populate()  # Populate the directory with its children
-        cacheObj.save_to_file()
+        self.children = []
+        self.name = sys.intern(name)
+        # the parallel scanner builds children itself, so it creates directories unpopulated
+        if populate:
+            self._populate()  # Populate the directory with its children
+            cacheObj.checkpoint(self)
 
     def _populate(self):
         """Populate the directory with its children and calculate directory size."""
         total_size = 0
-        print(f"Populating directory {self.path}\nParent: {self.parent}")
-        self.path = os.path.normpath(self.path)
+        path = self.path  # derived from the parent links, build it once
+        print(f"Populating directory {path}\nParent: {self.parent}")
         # Add the directory itself to the cache first
-        if self.path not in self.cache.body.keys():
-            self.cache.update(self.path, self)
-        with os.scandir(self.path) as entries:
+        if not self.cache.contains_node(self):
+            self.cache.update(path, self)
+        # record the listing time so an incremental rescan can skip this directory
+        self.set_stat(os.stat(path))
+        self.cache.set_dir_mtime(self, self.st_mtime_ns)
+        rules = self.cache.scan_rules
+        rel_path, depth = self._scan_position()
+        with os.scandir(path) as entries:
             for entry in entries:
+                entry_rel_path = child_rel_path(rel_path, entry.name)
                 if entry.is_dir():
-                    # Skip hidden directories
-                    if '.' in entry.name or entry.name.startswith('$'):
+                    # Skip excluded directories without listing them
+                    if rules.prune_directory(entry_rel_path, depth + 1):
                         continue
                     child = Directory(os.path.normpath(entry.path), self.cache, name=entry.name, parent=self)
                 else:
                     try:
-                        file_size = entry.stat().st_size
+                        stat_result = entry.stat()
+                        file_size = stat_result.st_size
                     except:
+                        stat_result = None
                         file_size = 0
-                    if entry.name.endswith('.mp3') or entry.name.endswith('.wav') or entry.name.endswith('.aac'):
-                        child = Music(entry.path, self.cache, name=entry.name, parent=self, size=file_size)
-                    elif entry.name.endswith('.jpeg') or entry.name.endswith('.jpg'):
-                        child = Image(entry.path, self.cache, name=entry.name, parent=self, size=file_size)
-                    else:
-                        child = File(entry.path, self.cache, name=entry.name, parent=self, size=file_size)
+                    if rules.skip_file(entry_rel_path, entry.name, file_size if stat_result is not None else None):
+                        continue
+                    file_class = file_node_class(entry.name)
+                    child = file_class(entry.path, self.cache, name=entry.name, parent=self, size=file_size)
+                    if stat_result is not None:
+                        child.set_stat(stat_result)
                     total_size += file_size
                 self.add_child(child)
-                print(f"Created {type(child).__name__}: {child.path} with parent: {child.parent.path}")
-                self.cache.update(child.path, child)
+                print(f"Created {type(child).__name__}: {entry.path} with parent: {path}")
+                self.cache.update(entry.path, child)
         self.size = total_size
-        print(f"Inserted directory: {self.path} to cache")
-
-    def _multithread_populate(self):
-        thread_pool = QThreadPool.globalInstance()
+        print(f"Inserted directory: {path} to cache")
 
-        # define callback function to add children from threads
-        def add_child(child):
-            self.children.append(child)
-            child.parent = self
-
-        try:
-            with os.scandir(self.path) as entries:
-                for entry in entries:
-                    task = ScanTask(entry, self.cache, add_child)
-                    thread_pool.start(task)
-        except FileNotFoundError:
-            print(f"Directory not found: {self.path}")
+    def _scan_position(self) -> tuple:
+        """Return this directory's path relative to the top of the tree and its depth below it."""
+        names = []
+        node = self
+        while node.parent is not None:
+            names.append(node.name)
+            node = node.parent
+        return '/'.join(reversed(names)), len(names)
 
     def add_child(self, child: object):
         """Add a child file or directory."""
         self.children.append(child)
         child.parent = self
+        child._path = None  # the path now follows from this directory
 
     def remove_child(self, child: object):
         """Remove a child file or directory."""
@@ -293,24 +387,9 @@ class Directory(FileSystemNode):
 
 
 
-class ScanTask(QRunnable):
-    def __init__(self, entry:os.DirEntry, cache, add_child_callback):
-        super().__init__()
-        self.entry = entry
-        self.cache = cache
-        self.add_child_callback = add_child_callback
-
-    def run(self):
-        if self.entry.is_dir():
-            child = Directory(self.entry.path, self.cache)
-        else:
-            child = File(self.entry.path, self.cache)
-
-        self.cache.update(child.path, child)
-        self.add_child_callback(child)
-
-
 class Image(File):
+    __slots__ = ('_width', '_height', '_coords', '_location', '_metadata_loaded')
+    _countries = None  # country coordinates table shared by all images, see load_countries
 
     def __init__(self, path: str, cache, name, parent, size=None):
         super().__init__(path, cache, name, parent, size)
@@ -318,11 +397,34 @@ class Image(File):
         self._height = None
         self._coords = None
         self._location = None
-        self._populate_image_metadata()
+        self._metadata_loaded = False  # metadata is read from the file on first access
+
+    def load_metadata(self):
+        """Read the image metadata from the file if it has not been read yet."""
+        if not self._metadata_loaded:
+            # mark first, extraction reads the properties it is filling in
+            self._metadata_loaded = True
+            self._populate_image_metadata()
+            self.metadata_updated()
+
+    def metadata_record(self) -> dict:
+        """Return the loaded metadata as a plain dict, as produced by MetadataPipeline workers."""
+        return {'width': self._width, 'height': self._height, 'coords': self._coords, 'location': self._location}
+
+    def apply_metadata(self, record: dict):
+        """Set the metadata from a record extracted elsewhere, without reading the file."""
+        self._width = record.get('width')
+        self._height = record.get('height')
+        coords = record.get('coords')
+        self._coords = tuple(coords) if coords else None  # stored records hold lists
+        self._location = record.get('location')
+        self._metadata_loaded = True
+        self.metadata_updated()
 
     @property
     def width(self):
         """Return the width of the image."""
+        self.load_metadata()
         return self._width
 
     @width.setter
@@ -332,6 +434,7 @@ class Image(File):
     @property
     def height(self):
         """Return the height of the image."""
+        self.load_metadata()
         return self._height
 
     @height.setter
@@ -341,6 +444,7 @@ class Image(File):
     @property
     def coords(self):
         """Return the location of the image."""
+        self.load_metadata()
         return self._coords
 
     @coords.setter
@@ -350,6 +454,7 @@ class Image(File):
     @property
     def location(self):
         """Return the location of the image."""
+        self.load_metadata()
         return self._location
 
     @location.setter
@@ -458,21 +563,28 @@ class Image(File):
         latitude, longitude = self.coords
 
         # Load the countries data
-        countries = pd.read_csv('../../resources/country-coord.csv')
+        countries = Image.load_countries()
 
-        # Apply the Haversine formula to each country's coordinates
-        countries['Distance'] = countries.apply(
-            lambda row: Image.haversine(latitude, longitude, row['Latitude (average)'],
-                                                 row['Longitude (average)']), axis=1)
+        # Apply the Haversine formula to all countries' coordinates at once
+        distances = Image.haversine(latitude, longitude, countries['Latitude (average)'].to_numpy(),
+                                    countries['Longitude (average)'].to_numpy())
 
         # Find the country with the minimum distance to the given coordinates
-        nearest_country = countries.loc[countries['Distance'].idxmin()]
+        nearest_country = countries.iloc[int(np.argmin(distances))]
 
         if not nearest_country.empty:
             return nearest_country['Country']
         else:
             return "No country found for these coordinates."
 
+    @staticmethod
+    def load_countries():
+        """
+        Return the country coordinates table, read from resources/country-coord.csv once per process.
+        """
+        if Image._countries is None:
+            Image._countries = pd.read_csv(COUNTRY_COORDS_FILE)
+        return Image._countries
 
     @staticmethod
     def dms_to_decimal(degrees, minutes, seconds, direction):
@@ -544,6 +656,7 @@ class Music(File):
     album: str: album name (default: None)
     year: str: year (default: None)
     """
+    __slots__ = ('_artist', '_track_name', '_album', '_year', '_metadata_loaded')
 
     def __init__(self, path: str, cache, name, parent, size=None):
         super().__init__(path, cache, name, parent, size)  # Call the constructor of the parent class
@@ -551,7 +664,27 @@ class Music(File):
         self._track_name = None  # Initialize track name attribute
         self._album = None # Initialize album attribute
         self._year = None  # Initialize year attribute
-        self.get_music_data()  # Call the method to retrieve metadata
+        self._metadata_loaded = False  # ID3 tags are read on first access
+
+    def load_metadata(self):
+        """Read the ID3 tags from the file if they have not been read yet."""
+        if not self._metadata_loaded:
+            self._metadata_loaded = True
+            self.get_music_data()  # Call the method to retrieve metadata
+            self.metadata_updated()
+
+    def metadata_record(self) -> dict:
+        """Return the loaded ID3 tags as a plain dict, as produced by MetadataPipeline workers."""
+        return {'artist': self._artist, 'track_name': self._track_name, 'album': self._album, 'year': self._year}
+
+    def apply_metadata(self, record: dict):
+        """Set the ID3 tags from a record extracted elsewhere, without reading the file."""
+        self._artist = record.get('artist')
+        self._track_name = record.get('track_name')
+        self._album = record.get('album')
+        self._year = record.get('year')
+        self._metadata_loaded = True
+        self.metadata_updated()
 
     def __repr__(self):
         """Representation of a Music object"""
@@ -562,6 +695,7 @@ class Music(File):
     @property
     def artist(self) -> str:
         """The artist of the music file."""
+        self.load_metadata()
         return self._artist
 
     @artist.setter
@@ -571,6 +705,7 @@ class Music(File):
     @property
     def track_name(self) -> str:
         """The name of the track."""
+        self.load_metadata()
         return self._track_name
 
     @track_name.setter
@@ -580,6 +715,7 @@ class Music(File):
     @property
     def album(self) -> str:
         """The album of the music file."""
+        self.load_metadata()
         return self._album
 
     @album.setter
@@ -589,6 +725,7 @@ class Music(File):
     @property
     def year(self) -> int:
         """The year of the music file."""
+        self.load_metadata()
         return self._year
 
     @year.setter
@@ -631,7 +768,7 @@ class Music(File):
         target_directory = os.path.join(parent_directory, self.artist)  # Target directory based on artist
         if not os.path.exists(target_directory):  # If target directory doesn't exist, create it
             os.mkdir(target_directory)  # Create the target directory
-            music_folder = Directory(target_directory, self.cache, 'Music', self.parent)  # Create a directory object
+            music_folder = Directory(target_directory, self.cache, self.artist, self.parent)  # Create a directory object
             self.parent.add_child(music_folder)  # Add the directory to the parent
 
         # Keep track of original path to revert changes
@@ -640,3 +777,17 @@ class Music(File):
         self.revert_path = revert_path  # Restore the original path
 
 
+def file_node_class(name: str) -> type:
+    """Return the File subclass used to represent a file with the given name."""
+    if name.endswith(('.mp3', '.wav', '.aac')):
+        return Music
+    if name.endswith(('.jpeg', '.jpg')):
+        return Image
+    # imported here, both modules import File from this one
+    if name.endswith(DOCUMENT_EXTENSIONS):
+        from python.model.Document import Document
+        return Document
+    if name.endswith(VIDEO_EXTENSIONS):
+        from python.model.Video import Video
+        return Video
+    return File
@@ -0,0 +1,296 @@
+from __future__ import annotations
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from python.model.FileSystemCache import FileSystemCache
+from python.model.FileSystemNodeModel import Directory, file_node_class
+from python.model.ScanRules import ScanRules, child_rel_path
+
+# Worker counts for the directory-listing pool. Local disks saturate with a handful of
+# concurrent scandir calls, network mounts need many more requests in flight to hide latency.
+LOCAL_DISK_WORKERS = 8
+NETWORK_MOUNT_WORKERS = 32
+
+# nodes collected before on_batch/on_progress are called, keeps callback and signal overhead negligible
+DEFAULT_BATCH_SIZE = 2000
+
+NETWORK_FILESYSTEMS = {'nfs', 'nfs4', 'cifs', 'smbfs', 'smb3', 'afpfs', 'fuse.sshfs', '9p', 'webdav'}
+
+
+def is_network_mount(path: str) -> bool:
+    """Check if the given path lives on a network filesystem (Linux only, False elsewhere)."""
+    path = os.path.realpath(path)
+    best_match, best_type = '', None
+    try:
+        with open('/proc/mounts') as mounts:
+            for line in mounts:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                mount_point = fields[1].replace('\\040', ' ')
+                if path == mount_point or path.startswith(mount_point.rstrip('/') + '/'):
+                    if len(mount_point) > len(best_match):
+                        best_match, best_type = mount_point, fields[2]
+    except OSError:
+        return False
+    return best_type in NETWORK_FILESYSTEMS
+
+
+def default_worker_count(path: str) -> int:
+    """Pick the number of listing workers for the filesystem the path is on."""
+    return NETWORK_MOUNT_WORKERS if is_network_mount(path) else LOCAL_DISK_WORKERS
+
+
+class FileSystemScanner:
+    """
+    Builds a Directory tree using a bounded pool of directory-listing workers.
+
+    Workers only call os.scandir and hand back plain tuples. As soon as a listing finishes the
+    worker queues its subdirectories, so the pool keeps pulling work from the shared queue while
+    a single assembly stage (the thread calling scan) creates the nodes and updates the cache.
+    The resulting tree and cache contents are the same as Directory._populate produces.
+
+    Every directory's st_mtime_ns is recorded in cache.dir_mtimes. In incremental mode a directory
+    whose mtime matches the recorded one is not listed again: its existing node, file children and
+    their extracted metadata are kept and only its subdirectories are checked. Nodes that no longer
+    exist on disk are removed from the cache at the end of the scan.
+
+    Directories and files are filtered with ScanRules inside the listing workers, a pruned directory
+    is never listed. The rules are kept in cache.scan_rules, when they differ from the rules the
+    cache was built with an incremental scan lists everything again.
+
+    Results are streamed while the scan runs: on_top_level(root) is called once the root's own
+    children exist, on_batch(nodes) receives every batch_size discovered nodes and on_progress(dirs,
+    files, bytes) the running totals. All callbacks run on the assembly thread.
+
+    @params
+    path: str: absolute path of the directory to scan
+    cache: FileSystemCache: cache the nodes are inserted into
+    name: str: name given to the root directory node (default: basename of path)
+    workers: int: number of listing workers (default: picked from the filesystem type)
+    incremental: bool: reuse unchanged directories already in the cache (default: False)
+    on_progress: callable: called with (directories, files, bytes) after every batch
+    on_batch: callable: called with the list of nodes discovered since the previous batch
+    on_top_level: callable: called with the root node when its immediate children are ready
+    batch_size: int: number of nodes per batch (default: 2000)
+    rules: ScanRules: which directories and files to keep (default: cache.scan_rules)
+    """
+
+    def __init__(self, path: str, cache: FileSystemCache, name: str = None, workers: int = None,
+                 incremental: bool = False, on_progress=None, on_batch=None, on_top_level=None,
+                 batch_size: int = DEFAULT_BATCH_SIZE, rules: ScanRules = None):
+        self.path = os.path.normpath(path)
+        self.cache = cache
+        self.name = name if name is not None else os.path.basename(self.path)
+        self.workers = workers if workers else default_worker_count(self.path)
+        self.rules = rules if rules is not None else cache.scan_rules
+        # nodes kept under other rules may be missing or unwanted, they cannot be reused
+        self.incremental = incremental and self.rules == cache.scan_rules
+        self.remove_vanished = incremental
+        self.on_progress = on_progress
+        self.on_batch = on_batch
+        self.on_top_level = on_top_level
+        self.batch_size = max(1, batch_size)
+        self.directory_count = 0
+        self.file_count = 0
+        self.byte_count = 0
+        self._batch = []
+        self._executor = None
+        self._listings = {}
+        self._lock = threading.Lock()
+        self._dropped = []  # former children that were not found again by this scan
+
+    def scan(self) -> Directory:
+        """Scan the directory tree and return the root Directory node."""
+        root = self._existing_directory(self.path)
+        if root is None:
+            root = Directory(self.path, self.cache, name=self.name, parent=None, populate=False)
+            self.cache.update(root.path, root)
+        self.cache.scan_rules = self.rules
+        self._dropped = []
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='scan') as executor:
+            self._executor = executor
+            self._submit(root.path, '', 0)
+            try:
+                # depth-first assembly, children are created before their subtrees are descended
+                stack = [(root, '', 0)]
+                while stack:
+                    directory, rel_path, depth = stack.pop()
+                    stat_result, entries = self._take_listing(directory.path)
+                    if entries is None:
+                        subdirectories = self._reuse(directory)
+                    else:
+                        subdirectories = self._assemble(directory, entries)
+                    if stat_result is not None:
+                        directory.set_stat(stat_result)
+                        self.cache.set_dir_mtime(directory, stat_result.st_mtime_ns)
+                    stack.extend((subdirectory, child_rel_path(rel_path, subdirectory.name), depth + 1)
+                                 for subdirectory in reversed(subdirectories))
+                    # only directories that were listed again can have changed children
+                    self.cache.checkpoint(directory if entries is not None else None)
+                    if directory is root and self.on_top_level is not None:
+                        self._emit_batch()
+                        self.on_top_level(root)
+            finally:
+                with self._lock:
+                    for future in self._listings.values():
+                        future.cancel()
+                    self._listings.clear()
+                self._executor = None
+
+        self._remove_vanished()
+        self._emit_batch()
+        return root
+
+    def _existing_directory(self, path: str):
+        """Return the cached Directory node for path when it may be reused, otherwise None."""
+        if not self.incremental:
+            return None
+        node = self.cache.get(path)
+        return node if isinstance(node, Directory) else None
+
+    def _submit(self, path: str, rel_path: str, depth: int):
+        future = self._executor.submit(self._list_directory, path, rel_path, depth)
+        with self._lock:
+            self._listings[path] = future
+
+    def _take_listing(self, path: str) -> list:
+        with self._lock:
+            future = self._listings.pop(path)
+        return future.result()
+
+    def _list_directory(self, path: str, rel_path: str, depth: int) -> tuple:
+        """
+        Worker task: list one directory, filter it with the scan rules and queue its subdirectories.
+
+        Returns (stat_result, entries) where entries is a list of (name, path, is_dir, stat_result)
+        tuples of the kept entries in scandir order, or None when the directory is unchanged since
+        the last scan. A directory that could not be listed returns (None, None): its cached children
+        are kept and its mtime is not recorded, so the next incremental scan lists it again.
+        """
+        # stat before listing, a change made while listing then shows up on the next scan
+        try:
+            stat_result = os.stat(path)
+        except OSError:
+            stat_result = None
+
+        existing = self._existing_directory(path)
+        if existing is not None and stat_result is not None and \
+                self.cache.dir_mtimes.get(existing.node_id) == stat_result.st_mtime_ns:
+            self._submit_existing(existing, rel_path, depth)
+            return stat_result, None
+
+        rules = self.rules
+        entries = []
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    entry_rel_path = child_rel_path(rel_path, entry.name)
+                    if is_dir:
+                        # directories are stat'ed by their own listing task
+                        if not rules.prune_directory(entry_rel_path, depth + 1):
+                            entries.append((entry.name, entry.path, True, None))
+                        continue
+                    try:
+                        entry_stat = entry.stat()
+                    except OSError:
+                        entry_stat = None
+                    if not rules.skip_file(entry_rel_path, entry.name,
+                                           entry_stat.st_size if entry_stat is not None else None):
+                        entries.append((entry.name, entry.path, False, entry_stat))
+        except OSError as e:
+            # a transient EACCES/EIO must not look like an emptied directory and drop the cached subtree
+            print(f"Failed to list directory {path}: {e}")
+            if existing is not None:
+                self._submit_existing(existing, rel_path, depth)
+            return None, None
+
+        for name, entry_path, is_dir, _ in entries:
+            if is_dir:
+                self._submit(os.path.normpath(entry_path), child_rel_path(rel_path, name), depth + 1)
+        return stat_result, entries
+
+    def _submit_existing(self, directory: Directory, rel_path: str, depth: int):
+        """Queue the listings of the cached subdirectories of a directory whose children are kept."""
+        for child in directory.children:
+            if isinstance(child, Directory):
+                self._submit(child.path, child_rel_path(rel_path, child.name), depth + 1)
+
+    def _assemble(self, directory: Directory, entries: list) -> list:
+        """Create the child nodes of a directory from its listing and return its subdirectories."""
+        subdirectories = []
+        children = []
+        total_size = 0
+        for name, entry_path, is_dir, entry_stat in entries:
+            if is_dir:
+                entry_path = os.path.normpath(entry_path)
+                # keep unchanged subdirectory nodes so their subtrees can be reused
+                child = self._existing_directory(entry_path)
+                if child is None:
+                    child = Directory(entry_path, self.cache, name=name, parent=directory, populate=False)
+                subdirectories.append(child)
+            else:
+                file_size = entry_stat.st_size if entry_stat is not None else 0
+                file_class = file_node_class(name)
+                child = file_class(entry_path, self.cache, name=name, parent=directory, size=file_size)
+                if entry_stat is not None:
+                    child.set_stat(entry_stat)
+                total_size += file_size
+            child.parent = directory
+            children.append(child)
+            # the listing already has the path, node paths are rebuilt from parent links on access
+            self.cache.update(entry_path, child)
+            self._discovered(child)
+        kept = set(map(id, children))
+        self._dropped.extend(child for child in directory.children if id(child) not in kept)
+        # swap the list in one step so a UI reading the partial tree never sees it half built
+        directory.children = children
+        directory.size = total_size
+        return subdirectories
+
+    def _reuse(self, directory: Directory) -> list:
+        """Keep the children of an unchanged directory and return its subdirectories."""
+        subdirectories = []
+        for child in directory.children:
+            self._discovered(child)
+            if isinstance(child, Directory):
+                subdirectories.append(child)
+        return subdirectories
+
+    def _discovered(self, node):
+        """Count a node and add it to the current batch."""
+        if isinstance(node, Directory):
+            self.directory_count += 1
+        else:
+            self.file_count += 1
+            self.byte_count += node.size or 0
+        self._batch.append(node)
+        if len(self._batch) >= self.batch_size:
+            self._emit_batch()
+
+    def _emit_batch(self):
+        batch, self._batch = self._batch, []
+        if batch and self.on_batch is not None:
+            self.on_batch(batch)
+        if self.on_progress is not None:
+            self.on_progress(self.directory_count, self.file_count, self.byte_count)
+
+    def _remove_vanished(self):
+        """Drop cached nodes below the scanned root that were not found by this scan."""
+        if not self.remove_vanished:
+            return
+        # files listed again are new nodes that already replaced the old ones in the cache
+        for node in self._dropped:
+            for descendant in node.walk():
+                self.cache.remove_node(descendant)
+        self._dropped = []
+
+
+if __name__ == "__main__":
+    pass
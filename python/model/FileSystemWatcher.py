@@ -0,0 +1,527 @@
+from __future__ import annotations
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import threading
+import ctypes
+import ctypes.util
+
+from python.model.FileSystemCache import FileSystemCache
+from python.model.FileSystemNodeModel import Directory, File, file_node_class
+from python.model.ScanRules import child_rel_path
+
+# seconds without new events before a batch is applied, and the longest a batch is held back
+DEFAULT_DEBOUNCE = 0.5
+DEFAULT_MAX_DELAY = 2.0
+# seconds between sweeps of the polling fallback
+DEFAULT_POLL_INTERVAL = 5.0
+
+# inotify constants from <sys/inotify.h>
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# IN_CLOSE_WRITE instead of IN_MODIFY, a file being written reports once instead of per write()
+WATCH_MASK = (IN_CLOSE_WRITE | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE |
+              IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_EXCL_UNLINK)
+_EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, len
+
+
+class InotifyBackend:
+    """
+    Thin ctypes wrapper around Linux inotify, one watch per directory of the tree.
+
+    read() turns raw events into tuples understood by FileSystemWatcher:
+    ('file', path), ('dir', path), ('moved_from', path, cookie), ('moved_to', path, cookie),
+    ('overflow',).
+    """
+
+    def __init__(self):
+        if not sys.platform.startswith('linux'):
+            raise OSError(errno.ENOSYS, 'inotify is only available on Linux')
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self._paths = {}  # watch descriptor -> directory path
+        self._watches = {}  # directory path -> watch descriptor
+
+    def watch(self, path: str):
+        """Watch one directory, raises OSError (e.g. ENOSPC when out of watches)."""
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), path)
+        self._paths[wd] = path
+        self._watches[path] = wd
+
+    def unwatch(self, path: str):
+        wd = self._watches.pop(path, None)
+        if wd is not None:
+            self._paths.pop(wd, None)
+            self._libc.inotify_rm_watch(self._fd, wd)
+
+    def moved(self, old_path: str, new_path: str):
+        """Follow a renamed directory, its watches stay valid but their paths change."""
+        prefix = os.path.join(old_path, '')
+        for path in [path for path in self._watches if path == old_path or path.startswith(prefix)]:
+            wd = self._watches.pop(path)
+            renamed = new_path + path[len(old_path):]
+            self._watches[renamed] = wd
+            self._paths[wd] = renamed
+
+    def read(self, timeout: float) -> list:
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                events.append(('overflow',))
+                continue
+            directory = self._paths.get(wd)
+            if mask & IN_IGNORED:
+                # the watch went away with its directory, the parent's event handles the tree
+                if directory is not None:
+                    self._watches.pop(directory, None)
+                self._paths.pop(wd, None)
+                continue
+            if directory is None or mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_MOVED_FROM:
+                events.append(('moved_from', path, cookie))
+            elif mask & IN_MOVED_TO:
+                events.append(('moved_to', path, cookie))
+            elif mask & (IN_CREATE | IN_DELETE):
+                events.append(('dir', directory))
+            elif mask & (IN_CLOSE_WRITE | IN_ATTRIB):
+                events.append(('dir', path) if mask & IN_ISDIR else ('file', path))
+        return events
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class PollingBackend:
+    """
+    Fallback for platforms without inotify or trees with more directories than inotify watches.
+
+    Every interval the recorded stat of each directory and file node is compared with the disk,
+    changed directories and files are reported like inotify events. Renames show up as a delete
+    and a create, so moved nodes are rebuilt instead of reused.
+
+    @params
+    root: Directory: top of the watched tree
+    interval: float: seconds between sweeps
+    """
+
+    def __init__(self, root: Directory, interval: float = DEFAULT_POLL_INTERVAL):
+        self.root = root
+        self.interval = interval
+        self._next_sweep = time.monotonic() + interval
+
+    def watch(self, path: str):
+        pass
+
+    def unwatch(self, path: str):
+        pass
+
+    def moved(self, old_path: str, new_path: str):
+        pass
+
+    def read(self, timeout: float) -> list:
+        wait = self._next_sweep - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return []
+        if wait > 0:
+            time.sleep(wait)
+        self._next_sweep = time.monotonic() + self.interval
+        return self._sweep()
+
+    def _sweep(self) -> list:
+        events = []
+        stack = [self.root]
+        while stack:
+            directory = stack.pop()
+            try:
+                if os.stat(directory.path).st_mtime_ns != directory.st_mtime_ns:
+                    events.append(('dir', directory.path))
+            except OSError:
+                if directory.parent is not None:
+                    events.append(('dir', directory.parent.path))
+                continue
+            for child in list(directory.children):
+                if isinstance(child, Directory):
+                    stack.append(child)
+                    continue
+                try:
+                    stat_result = os.stat(child.path)
+                except OSError:
+                    continue  # reported through the directory's mtime
+                if stat_result.st_mtime_ns != child.st_mtime_ns or stat_result.st_size != child.size:
+                    events.append(('file', child.path))
+        return events
+
+    def close(self):
+        pass
+
+
+class FileSystemWatcher:
+    """
+    Keeps a scanned tree and its FileSystemCache in sync with the disk.
+
+    Uses inotify on Linux and falls back to polling elsewhere, or when the tree needs more watches
+    than the system allows. Events are collected on a daemon thread and applied in batches once no
+    new event arrived for `debounce` seconds, or at the latest `max_delay` seconds after the first.
+    A batch is coalesced before anything is touched: each affected directory is listed once, no
+    matter how many of its entries changed, and each modified file is stat'ed once.
+
+    Applying a batch updates the tree, the cache body and its keyword index under the cache lock:
+    - created entries become new nodes, new directories are populated and watched
+    - deleted entries are removed with their whole subtree
+    - renames within the tree move the existing node, so loaded metadata is kept
+    - modified files get fresh stat fields and their metadata is read again on next access
+    The cache's scan rules decide which new entries are kept. When the inotify queue overflows the
+    whole tree is brought up to date with an incremental FileSystemScanner pass.
+
+    @params
+    root: Directory: top of the scanned tree
+    cache: FileSystemCache: cache the tree's nodes are in, the watcher attaches itself to it
+    debounce: float: seconds of quiet before a batch is applied (default: 0.5)
+    max_delay: float: longest time a batch is held back while events keep coming (default: 2.0)
+    poll_interval: float: seconds between sweeps when polling (default: 5.0)
+    use_inotify: bool: False forces the polling backend (default: True)
+    on_change: callable: called with the list of changed directory paths after each batch
+    """
+
+    def __init__(self, root: Directory, cache: FileSystemCache, debounce: float = DEFAULT_DEBOUNCE,
+                 max_delay: float = DEFAULT_MAX_DELAY, poll_interval: float = DEFAULT_POLL_INTERVAL,
+                 use_inotify: bool = True, on_change=None):
+        self.root = root
+        self.cache = cache
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify
+        self.on_change = on_change
+        self.backend = None
+        self._stopped = threading.Event()
+        self._thread = None
+        self._reset_pending()
+
+    def _reset_pending(self):
+        self._dirty_directories = set()
+        self._modified_files = set()
+        self._moves_from = {}  # cookie -> source path of a rename still waiting for its target
+        self._renames = []
+        self._rescan = False
+        self._first_event = None
+        self._last_event = None
+
+    def start(self):
+        """Watch the tree and start applying changes in the background."""
+        if self._thread is None:
+            self.backend = self._create_backend()
+            self.cache.watcher = self
+            self._thread = threading.Thread(target=self._run, name='fs-watcher', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop watching, changes still pending are dropped."""
+        self._stopped.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+        if self.backend is not None:
+            self.backend.close()
+            self.backend = None
+        if self.cache.watcher is self:
+            self.cache.watcher = None
+
+    def _create_backend(self):
+        if self.use_inotify:
+            try:
+                backend = InotifyBackend()
+            except (OSError, AttributeError) as e:
+                print(f"inotify unavailable ({e}), polling {self.root.path} instead")
+            else:
+                try:
+                    for directory in self._directories(self.root):
+                        backend.watch(directory.path)
+                    return backend
+                except OSError as e:
+                    # usually ENOSPC: fs.inotify.max_user_watches is lower than the number of directories
+                    print(f"Cannot watch {self.root.path} with inotify ({e}), polling instead")
+                    backend.close()
+        return PollingBackend(self.root, self.poll_interval)
+
+    @staticmethod
+    def _directories(root: Directory):
+        stack = [root]
+        while stack:
+            directory = stack.pop()
+            yield directory
+            stack.extend(child for child in directory.children if isinstance(child, Directory))
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                events = self.backend.read(min(self.debounce, 0.5))
+            except OSError as e:
+                print(f"Watching {self.root.path} failed: {e}")
+                return
+            now = time.monotonic()
+            if events:
+                if self._first_event is None:
+                    self._first_event = now
+                self._last_event = now
+                for event in events:
+                    self._queue(event)
+
+            if self._first_event is not None and (now - self._last_event >= self.debounce or
+                                                  now - self._first_event >= self.max_delay):
+                self._apply()
+
+    def _queue(self, event: tuple):
+        """Coalesce one event into the pending batch."""
+        kind = event[0]
+        if kind == 'dir':
+            self._dirty_directories.add(event[1])
+        elif kind == 'file':
+            self._modified_files.add(event[1])
+        elif kind == 'moved_from':
+            _, path, cookie = event
+            self._moves_from[cookie] = path
+            self._dirty_directories.add(os.path.dirname(path))
+        elif kind == 'moved_to':
+            _, path, cookie = event
+            source = self._moves_from.pop(cookie, None)
+            if source is not None:
+                self._renames.append((source, path))
+            self._dirty_directories.add(os.path.dirname(path))
+        elif kind == 'overflow':
+            self._rescan = True
+
+    def _apply(self):
+        """Apply the pending batch to the tree and the cache."""
+        dirty = self._dirty_directories
+        modified = self._modified_files
+        renames = self._renames
+        rescan = self._rescan
+        self._reset_pending()
+
+        if rescan:
+            changed = [self.root.path]
+        else:
+            changed = sorted(dirty | {os.path.dirname(path) for path in modified})
+        try:
+            if rescan:
+                self._rescan_tree()
+            else:
+                with self.cache.lock:
+                    for old_path, new_path in renames:
+                        self._apply_rename(old_path, new_path)
+                    for path in modified:
+                        if os.path.dirname(path) not in dirty:
+                            self._apply_modified(path)
+                    new_directories = []
+                    for path in sorted(dirty):
+                        new_directories.extend(self._resync_directory(path))
+                # a directory can gain entries between being listed and being watched, look again
+                self._dirty_directories.update(directory.path for directory in new_directories)
+                if new_directories:
+                    self._first_event = self._last_event = time.monotonic()
+        except OSError as e:
+            # a path vanished while the batch was applied, keep watching, its parent's events fix the tree up
+            print(f"Failed to apply changes below {self.root.path}: {e}")
+
+        self.cache.checkpoint()
+        if self.on_change is not None and changed:
+            self.on_change(changed)
+
+    def _rescan_tree(self):
+        from python.model.FileSystemScanner import FileSystemScanner
+        print(f"Watch queue overflowed, rescanning {self.root.path}")
+        FileSystemScanner(self.root.path, self.cache, name=self.root.name, incremental=True).scan()
+        for directory in self._directories(self.root):
+            try:
+                self.backend.watch(directory.path)
+            except OSError:
+                pass
+
+    def _apply_rename(self, old_path: str, new_path: str):
+        """Move a node renamed within the tree to its new place, keeping the node and its metadata."""
+        node = self.cache.get(old_path)
+        new_parent = self.cache.get(os.path.dirname(os.path.normpath(new_path)))
+        if node is None or node is self.root:
+            return
+        if node.parent is not None and node in node.parent.children:
+            node.parent.children = [child for child in node.parent.children if child is not node]
+        if not isinstance(new_parent, Directory):
+            # moved out of the scanned part of the tree
+            self._remove_subtree(node)
+            return
+
+        new_path = os.path.normpath(new_path)
+        new_name = os.path.basename(new_path)
+        for replaced in [child for child in new_parent.children if child.name == new_name]:
+            # the rename overwrote an existing entry
+            new_parent.children = [child for child in new_parent.children if child is not replaced]
+            self._remove_subtree(replaced)
+
+        def relink():
+            # paths below a renamed directory follow from the parent links
+            node.name = sys.intern(new_name)
+            node.parent = new_parent
+            new_parent.children = new_parent.children + [node]
+
+        self.cache.relocate(node, relink)
+        if isinstance(node, Directory):
+            self.backend.moved(os.path.normpath(old_path), new_path)
+
+    def _apply_modified(self, path: str):
+        """Refresh the stat fields of a modified file and make its metadata load again."""
+        node = self.cache.get(path)
+        if not isinstance(node, File):
+            return
+        try:
+            stat_result = os.stat(node.path)
+        except OSError:
+            return  # deleted, the directory event removes it
+        old_size = node.size or 0
+        self._update_file(node, stat_result)
+        if node.parent is not None:
+            node.parent.size = (node.parent.size or 0) + (node.size or 0) - old_size
+
+    def _update_file(self, node: File, stat_result: os.stat_result):
+        changed = node.st_mtime_ns != stat_result.st_mtime_ns or node.size != stat_result.st_size
+        if changed and hasattr(node, 'load_metadata'):
+            node._metadata_loaded = False
+        node.set_stat(stat_result)
+        if changed:
+            # the indexes still hold the old size, mtime and metadata
+            self.cache.node_changed(node)
+
+    def _resync_directory(self, path: str) -> list:
+        """
+        List one directory and make its node's children match the disk.
+
+        Returns the Directory nodes that were created.
+        """
+        directory = self.cache.get(path)
+        if not isinstance(directory, Directory):
+            return []
+        try:
+            stat_result = os.stat(directory.path)
+            with os.scandir(directory.path) as it:
+                entries = list(it)
+        except OSError:
+            return []  # gone, its parent's listing removes it
+
+        rules = self.cache.scan_rules
+        rel_path, depth = directory._scan_position()
+        existing = {child.name: child for child in directory.children}
+        children = []
+        created = []
+        total_size = 0
+        for entry in entries:
+            entry_rel_path = child_rel_path(rel_path, entry.name)
+            child = existing.pop(entry.name, None)
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+
+            if is_dir:
+                if rules.prune_directory(entry_rel_path, depth + 1):
+                    if child is not None:
+                        self._remove_subtree(child)
+                    continue
+                if not isinstance(child, Directory):
+                    if child is not None:
+                        self._remove_subtree(child)
+                    # listed below like any other directory, it may be gone again by then
+                    child = Directory(os.path.normpath(entry.path), self.cache, name=entry.name, parent=directory,
+                                      populate=False)
+                    self.cache.update(child.path, child)
+                    created.append(child)
+                    try:
+                        self.backend.watch(child.path)
+                    except OSError as e:
+                        print(f"Cannot watch {child.path}: {e}")
+                    created.extend(self._resync_directory(child.path))
+            else:
+                try:
+                    entry_stat = entry.stat()
+                except OSError:
+                    entry_stat = None
+                size = entry_stat.st_size if entry_stat is not None else 0
+                if rules.skip_file(entry_rel_path, entry.name, size if entry_stat is not None else None):
+                    if child is not None:
+                        self._remove_subtree(child)
+                    continue
+                file_class = file_node_class(entry.name)
+                if child is None or type(child) is not file_class:
+                    if child is not None:
+                        self._remove_subtree(child)
+                    child = file_class(entry.path, self.cache, name=entry.name, parent=directory, size=size)
+                    if entry_stat is not None:
+                        child.set_stat(entry_stat)
+                    self.cache.update(child.path, child)
+                elif entry_stat is not None:
+                    self._update_file(child, entry_stat)
+                total_size += child.size or 0
+            child.parent = directory
+            children.append(child)
+
+        for child in existing.values():
+            self._remove_subtree(child)
+        # swap the list in one step so a UI reading the tree never sees it half updated
+        directory.children = children
+        directory.size = total_size
+        directory.set_stat(stat_result)
+        self.cache.set_dir_mtime(directory, stat_result.st_mtime_ns)
+        return created
+
+    def _remove_subtree(self, node):
+        """Remove a node and everything below it from the cache and stop watching its directories."""
+        for descendant in node.walk():
+            if isinstance(descendant, Directory):
+                self.backend.unwatch(descendant.path)
+            self.cache.remove_node(descendant)
+
+
+if __name__ == "__main__":
+    pass
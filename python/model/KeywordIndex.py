@@ -0,0 +1,504 @@
+from __future__ import annotations
+import sys
+import math
+import numpy as np
+from python.model.Lexicon import Lexicon
+from python.model.LevenshteinAutomaton import fuzzy_edits
+
+# compact once this many postings were removed and they make up this share of the live ones
+COMPACT_MIN_REMOVALS = 10000
+COMPACT_REMOVED_FRACTION = 0.5
+# node ids are stored as uint32, a posting list costs 4 bytes per node
+ID_DTYPE = np.uint32
+# pending additions and removals are merged into the sorted array once there are this many, or
+# 1/MERGE_FRACTION of the array if that is more, which keeps merging amortized O(1) per change
+MERGE_PENDING = 4096
+MERGE_FRACTION = 8
+# a term matching more than 1/DENSE_FRACTION of the id space also keeps a bitmap for lookups
+DENSE_FRACTION = 32
+# BM25 term frequency saturation and document length normalization
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+class PostingList:
+    """
+    Node ids of one keyword as a sorted integer array.
+
+    Additions and removals are buffered in two small sets and merged into the array when a query
+    needs it or the buffers grow past MERGE_PENDING. Dense lists (more than 1/DENSE_FRACTION of the
+    id space) also keep a packed bitmap with one bit per node id, so they can be combined with
+    other dense lists a machine word at a time and tested against arrays of candidates in one
+    vectorized lookup. Once built the bitmap is updated in place on every change.
+    """
+    __slots__ = ('_ids', '_added', '_removed', '_bitmap')
+
+    def __init__(self, ids=()):
+        self._ids = np.sort(np.fromiter(ids, dtype=ID_DTYPE))
+        self._added = set()  # never in _ids
+        self._removed = set()  # always in _ids
+        self._bitmap = None
+
+    def add(self, node_id: int):
+        if node_id in self._removed:
+            self._removed.discard(node_id)
+        elif not self._in_array(node_id):
+            self._added.add(node_id)
+        else:
+            return
+        bitmap = self._bitmap
+        if bitmap is not None:
+            if node_id >> 3 < len(bitmap):
+                bitmap[node_id >> 3] |= 1 << (node_id & 7)
+            else:
+                self._bitmap = None
+        self._changed()
+
+    def discard(self, node_id: int):
+        if node_id in self._added:
+            self._added.discard(node_id)
+        elif self._in_array(node_id) and node_id not in self._removed:
+            self._removed.add(node_id)
+        else:
+            return
+        if self._bitmap is not None:
+            self._bitmap[node_id >> 3] &= ~(1 << (node_id & 7)) & 0xFF
+        self._changed()
+
+    def __contains__(self, node_id: int) -> bool:
+        return node_id in self._added or (self._in_array(node_id) and node_id not in self._removed)
+
+    def __len__(self):
+        return len(self._ids) + len(self._added) - len(self._removed)
+
+    def __iter__(self):
+        return iter(self.array().tolist())
+
+    def _in_array(self, node_id: int) -> bool:
+        ids = self._ids
+        # new nodes get the highest ids, skip the search for them
+        if not len(ids) or node_id > ids[-1]:
+            return False
+        # a plain int would make NumPy cast the whole array to int64 first
+        position = ids.searchsorted(ID_DTYPE(node_id))
+        return ids[position] == node_id
+
+    def _changed(self):
+        if len(self._added) + len(self._removed) >= max(MERGE_PENDING, len(self._ids) // MERGE_FRACTION):
+            self._merge()
+
+    def _merge(self):
+        ids = self._ids
+        if self._removed:
+            ids = ids[~np.isin(ids, np.fromiter(self._removed, dtype=ID_DTYPE, count=len(self._removed)))]
+        if self._added:
+            added = np.fromiter(self._added, dtype=ID_DTYPE, count=len(self._added))
+            added.sort()
+            if len(ids) and added[0] < ids[-1]:
+                ids = np.concatenate((ids, added))
+                ids.sort(kind='stable')  # two sorted runs, merged in linear time
+            else:
+                ids = np.concatenate((ids, added))
+        self._ids = ids
+        self._added = set()
+        self._removed = set()
+
+    def array(self) -> np.ndarray:
+        """Return the sorted node ids, merging pending changes first. The array must not be modified."""
+        if self._added or self._removed:
+            self._merge()
+        return self._ids
+
+    def is_dense(self, id_space: int) -> bool:
+        """Return whether the list is large enough relative to the id space to be used as a bitmap."""
+        return len(self) * DENSE_FRACTION > id_space
+
+    def bitmap(self, id_space: int) -> np.ndarray:
+        """
+        Return the ids as a packed little-endian bitmap of (id_space + 7) // 8 bytes.
+
+        The bitmap is kept and updated with the list afterwards, it must not be modified.
+
+        @params
+        id_space: int: one more than the largest node id the bitmap has to cover
+        """
+        size = (id_space + 7) >> 3
+        bitmap = self._bitmap
+        if bitmap is None or len(bitmap) < size:
+            # leave room for the ids of nodes added later, so a growing tree does not rebuild it every time
+            mask = np.zeros((size + (size >> 3) + 8) << 3, dtype=bool)
+            mask[self.array()] = True
+            bitmap = self._bitmap = np.packbits(mask, bitorder='little')
+        return bitmap[:size]
+
+    def contains_all(self, ids: np.ndarray, id_space: int) -> np.ndarray:
+        """Return a boolean mask of which of the sorted ids are in this list."""
+        if self.is_dense(id_space):
+            bitmap = self.bitmap(id_space)
+            covered = ids[:np.searchsorted(ids, ID_DTYPE(len(bitmap) << 3))]
+            mask = np.zeros(len(ids), dtype=bool)
+            mask[:len(covered)] = (bitmap[covered >> 3] >> (covered & 7)) & 1
+            return mask
+        own = self.array()
+        if not len(own):
+            return np.zeros(len(ids), dtype=bool)
+        positions = np.searchsorted(own, ids)
+        positions[positions == len(own)] = 0
+        return own[positions] == ids
+
+    def __getstate__(self):
+        # merged on save, the bitmap is rebuilt when a query needs it
+        return self.array(), None
+
+    def __setstate__(self, state):
+        self._ids, _ = state
+        self._added = set()
+        self._removed = set()
+        self._bitmap = None
+
+
+def bitmap_ids(bitmap: np.ndarray) -> np.ndarray:
+    """Return the sorted ids whose bits are set in a packed little-endian bitmap."""
+    whole = len(bitmap) >> 3 << 3
+    occupied = np.flatnonzero(bitmap[:whole].view(np.uint64))
+    if len(occupied) << 3 >= whole >> 3:
+        # results spread over the id space, unpacking everything at once is cheapest
+        return np.flatnonzero(np.unpackbits(bitmap, bitorder='little').view(bool)).astype(ID_DTYPE)
+    # few occupied 64-bit words, only unpack those
+    offsets = ((occupied << 3)[:, None] + np.arange(8)).reshape(-1)
+    offsets = np.concatenate((offsets, np.arange(whole, len(bitmap))))
+    bits = np.unpackbits(bitmap[offsets], bitorder='little').reshape(-1, 8)
+    rows, columns = np.nonzero(bits)
+    return ((offsets[rows] << 3) + columns).astype(ID_DTYPE)
+
+
+class KeywordIndex:
+    """
+    Inverted index from keywords to the ids of the nodes they occur in, with a reverse map from
+    each node to its keywords.
+
+    Postings are PostingList objects of integer node ids, so the index holds no node references
+    and queries run as vectorized operations on id arrays and, for terms matching a large share of
+    the tree, packed bitmaps: match_all() intersects, match_any() unions and both subtract the
+    nodes of excluded keywords. The reverse map makes removing, renaming and moving a node
+    cost O(its keywords). Python dicts do not give memory back when entries are removed and
+    removed ids wait in the posting lists' buffers, so after many removals compact() rebuilds
+    everything at its live size. That happens automatically once the removed postings exceed
+    COMPACT_REMOVED_FRACTION of the live ones.
+
+    For ranking, the number of keywords and the modification time of every node are kept in
+    arrays indexed by node id, so bm25() can score an array of candidates without touching nodes.
+
+    Reading works like a dict of posting lists: index[keyword], keyword in index, get(), items()
+    and keys().
+
+    @params
+    compact_fraction: float: removed/live postings ratio that triggers a compaction
+    compact_min_removals: int: never compact before this many removals
+    ranked: bool: keep the keyword counts and modification times bm25() and ranking need
+    """
+
+    def __init__(self, compact_fraction: float = COMPACT_REMOVED_FRACTION,
+                 compact_min_removals: int = COMPACT_MIN_REMOVALS, ranked: bool = True):
+        self.postings: dict = {}  # keyword -> PostingList of node ids
+        self.node_keywords: dict = {}  # node_id -> tuple of the node's keywords
+        self.compact_fraction = compact_fraction
+        self.compact_min_removals = compact_min_removals
+        self.id_space = 0  # one more than the largest node id ever indexed
+        self.posting_count = 0  # live (keyword, node) pairs
+        self.removed_since_compaction = 0
+        self.compactions = 0
+        self.version = 0  # incremented on every posting change
+        self.lexicon = None  # sorted Lexicon of the keywords, built by the first completions() call
+        self.lengths = np.zeros(0, dtype=np.uint16) if ranked else None  # node_id -> number of keywords
+        self.mtimes = np.zeros(0, dtype=np.int64) if ranked else None  # node_id -> st_mtime_ns when indexed
+
+    def add(self, node, keywords):
+        """Index a node under keywords, replacing the keywords it was indexed under before."""
+        # interned, the reverse map then only costs a pointer per keyword
+        keywords = tuple(sys.intern(keyword) for keyword in keywords)
+        node_id = node.node_id
+        if self.lengths is not None:
+            self._store_fields(node_id, len(keywords), node.st_mtime_ns or 0)
+        previous = self.node_keywords.get(node_id)
+        if previous is not None:
+            if previous == keywords:
+                return
+            kept = set(keywords)
+            self._unlink(node_id, [keyword for keyword in previous if keyword not in kept])
+            added = [keyword for keyword in keywords if keyword not in previous]
+        else:
+            added = keywords
+        self._link(node_id, added)
+        self.node_keywords[node_id] = keywords
+
+    def remove(self, node):
+        """Remove a node from every keyword it is indexed under."""
+        keywords = self.node_keywords.pop(node.node_id, None)
+        if keywords is not None:
+            self._unlink(node.node_id, keywords)
+            self._maybe_compact()
+
+    def _store_fields(self, node_id: int, length: int, mtime_ns: int):
+        if node_id >= len(self.lengths):
+            # doubled, so growing the arrays node by node is amortized O(1)
+            size = max(node_id + 1, 2 * len(self.lengths), 1024)
+            self.lengths = np.concatenate((self.lengths, np.zeros(size - len(self.lengths), dtype=np.uint16)))
+            self.mtimes = np.concatenate((self.mtimes, np.zeros(size - len(self.mtimes), dtype=np.int64)))
+        self.lengths[node_id] = min(length, 0xFFFF)
+        self.mtimes[node_id] = mtime_ns
+
+    def bm25(self, ids: np.ndarray, keywords) -> np.ndarray:
+        """
+        Return the BM25 scores of the nodes with the given ids for a query of keywords.
+
+        A node's keywords are a set, so every term frequency is 0 or 1 and the score of a node is
+        the sum of the idf of the query keywords it has, scaled down for nodes with many keywords.
+
+        @params
+        ids: np.ndarray: sorted ids of indexed nodes to score
+        keywords: iterable: keywords of the query
+        """
+        count = max(1, len(self.node_keywords))
+        average = max(1.0, self.posting_count / count)
+        scores = np.zeros(len(ids))
+        for keyword in set(keywords):
+            postings = self.postings.get(keyword)
+            if postings is not None and len(ids):
+                frequency = len(postings)
+                idf = math.log(1 + (count - frequency + 0.5) / (frequency + 0.5))
+                scores += idf * postings.contains_all(ids, self.id_space)
+        lengths = self.lengths[ids]
+        return scores * ((BM25_K1 + 1) / (1 + BM25_K1 * (1 - BM25_B + BM25_B * lengths / average)))
+
+    def _link(self, node_id: int, keywords):
+        for keyword in keywords:
+            ids = self.postings.get(keyword)
+            if ids is None:
+                ids = self.postings[keyword] = PostingList()
+            ids.add(node_id)
+            if self.lexicon is not None:
+                self.lexicon.add(keyword, len(ids))
+        self.version += 1
+        self.posting_count += len(keywords)
+        self.id_space = max(self.id_space, node_id + 1)
+
+    def _unlink(self, node_id: int, keywords):
+        for keyword in keywords:
+            ids = self.postings.get(keyword)
+            if ids is not None and node_id in ids:
+                ids.discard(node_id)
+                self.posting_count -= 1
+                self.removed_since_compaction += 1
+                if self.lexicon is not None:
+                    self.lexicon.discard(keyword, len(ids))
+                if not len(ids):
+                    del self.postings[keyword]
+        self.version += 1
+
+    def keywords_of(self, node) -> tuple:
+        """Return the keywords a node is indexed under, () if it is not indexed."""
+        return self.node_keywords.get(node.node_id, ())
+
+    def match_all(self, keywords, excluded=()) -> np.ndarray:
+        """
+        Return the sorted ids of the nodes indexed under every one of keywords and none of excluded.
+
+        When every keyword is dense the lists are intersected as packed bitmaps, 64 ids per machine
+        operation, and only the surviving ids are extracted. Otherwise the shortest list is filtered
+        by the others, which costs time proportional to its length.
+
+        @params
+        keywords: iterable: keywords every match has to be indexed under
+        excluded: iterable: keywords no match may be indexed under
+        """
+        lists = [self.postings.get(keyword) for keyword in keywords]
+        if not lists or any(ids is None for ids in lists):
+            return np.empty(0, dtype=ID_DTYPE)
+        lists.sort(key=len)
+        excluded = self._lists(excluded)
+        if lists[0].is_dense(self.id_space):
+            bitmap = lists[0].bitmap(self.id_space).copy()
+            for ids in lists[1:]:
+                np.bitwise_and(bitmap, ids.bitmap(self.id_space), out=bitmap)
+            excluded = self._subtract_dense(bitmap, excluded)
+            result = bitmap_ids(bitmap)
+        else:
+            result = lists[0].array()
+            for ids in lists[1:]:
+                if not len(result):
+                    break
+                result = result[ids.contains_all(result, self.id_space)]
+        return self._subtract(result, excluded)
+
+    def match_any(self, keywords, excluded=()) -> np.ndarray:
+        """
+        Return the sorted ids of the nodes indexed under at least one of keywords and none of excluded.
+
+        @params
+        keywords: iterable: keywords a match has to be indexed under at least one of
+        excluded: iterable: keywords no match may be indexed under
+        """
+        lists = self._lists(keywords)
+        excluded = self._lists(excluded)
+        if not lists:
+            return np.empty(0, dtype=ID_DTYPE)
+        if len(lists) == 1:
+            result = lists[0].array()
+        elif any(ids.is_dense(self.id_space) for ids in lists):
+            # mostly overlapping large lists, OR them as bitmaps instead of sorting them together
+            bitmap = np.zeros((self.id_space + 7) >> 3, dtype=np.uint8)
+            sparse = []
+            for ids in lists:
+                if ids.is_dense(self.id_space):
+                    np.bitwise_or(bitmap, ids.bitmap(self.id_space), out=bitmap)
+                else:
+                    sparse.append(ids.array())
+            if sparse:
+                # set the bits of all sparse lists in one call, there can be thousands of them
+                sparse = np.concatenate(sparse)
+                np.bitwise_or.at(bitmap, sparse >> 3, np.left_shift(1, sparse & 7).astype(np.uint8))
+            excluded = self._subtract_dense(bitmap, excluded)
+            result = bitmap_ids(bitmap)
+        else:
+            result = np.unique(np.concatenate([ids.array() for ids in lists]))
+        return self._subtract(result, excluded)
+
+    def exclude(self, ids: np.ndarray, keywords) -> np.ndarray:
+        """Return the sorted ids that are not indexed under any of keywords."""
+        return self._subtract(ids, self._lists(keywords))
+
+    def _lists(self, keywords) -> list:
+        return [self.postings[keyword] for keyword in keywords if keyword in self.postings]
+
+    def _subtract_dense(self, bitmap: np.ndarray, lists) -> list:
+        # clear the bits of the dense lists in place, the sparse ones are returned for _subtract()
+        sparse = []
+        for ids in lists:
+            if ids.is_dense(self.id_space):
+                np.bitwise_and(bitmap, np.invert(ids.bitmap(self.id_space)), out=bitmap)
+            else:
+                sparse.append(ids)
+        return sparse
+
+    def _subtract(self, ids: np.ndarray, lists) -> np.ndarray:
+        for postings in lists:
+            if not len(ids):
+                break
+            ids = ids[~postings.contains_all(ids, self.id_space)]
+        return ids
+
+    def completions(self, prefix: str, k: int = 10) -> list:
+        """
+        Return up to k keywords starting with prefix, ranked by the number of nodes they occur in.
+
+        @params
+        prefix: str: start of the keywords to complete
+        k: int: number of completions to return
+        """
+        postings = self.postings
+
+        def frequency(keyword):
+            return len(postings[keyword])
+
+        return self._lexicon().completions(prefix, k, frequency, self.version)
+
+    def fuzzy_keywords(self, word: str, max_edits: int = None) -> list:
+        """
+        Return the indexed keywords within max_edits edits of word, closest first.
+
+        @params
+        word: str: possibly misspelled keyword
+        max_edits: int: largest edit distance, by default fuzzy_edits(word) which grows with the word's length
+        """
+        if max_edits is None:
+            max_edits = fuzzy_edits(word)
+        return self._lexicon().fuzzy(word, max_edits)
+
+    def match_fuzzy(self, keywords, match_any: bool = False, excluded=()) -> np.ndarray:
+        """
+        Return the sorted ids of the nodes matching keywords that may be misspelled, and none of excluded.
+
+        Every keyword stands for the indexed keywords within fuzzy_edits() of it. A node matches a keyword if it
+        is indexed under any of them, and has to match all keywords or, with match_any, at least one. Excluded
+        keywords are matched exactly.
+
+        @params
+        keywords: iterable: possibly misspelled keywords
+        match_any: bool: match nodes matching any instead of all keywords
+        excluded: iterable: keywords no match may be indexed under
+        """
+        expanded = [self.fuzzy_keywords(keyword) for keyword in keywords]
+        if match_any:
+            return self.match_any([keyword for similar in expanded for keyword in similar], excluded)
+        if not expanded:
+            return np.empty(0, dtype=ID_DTYPE)
+        result = None
+        for similar in expanded:
+            ids = self.match_any(similar)
+            result = ids if result is None else np.intersect1d(result, ids, assume_unique=True)
+            if not len(result):
+                break
+        return self._subtract(result, self._lists(excluded))
+
+    def _lexicon(self) -> Lexicon:
+        if self.lexicon is None:
+            postings = self.postings
+            self.lexicon = Lexicon(postings, lambda keyword: len(postings[keyword]))
+        return self.lexicon
+
+    def fragmentation(self) -> float:
+        """Return the postings removed since the last compaction relative to the live ones."""
+        return self.removed_since_compaction / max(1, self.posting_count)
+
+    def _maybe_compact(self):
+        if self.removed_since_compaction >= self.compact_min_removals and \
+                self.fragmentation() >= self.compact_fraction:
+            self.compact()
+
+    def compact(self):
+        """Merge the buffered changes of every posting list and rebuild both maps at their live size."""
+        for ids in self.postings.values():
+            ids.array()
+        self.postings = dict(self.postings)
+        self.node_keywords = dict(self.node_keywords)
+        self.removed_since_compaction = 0
+        self.compactions += 1
+
+    def __getstate__(self):
+        # the lexicon is rebuilt by the next completions() call
+        state = self.__dict__.copy()
+        state['lexicon'] = None
+        return state
+
+    def __setstate__(self, state):
+        state.setdefault('version', 0)
+        state.setdefault('lexicon', None)
+        state.setdefault('lengths', np.zeros(0, dtype=np.uint16))
+        state.setdefault('mtimes', np.zeros(0, dtype=np.int64))
+        self.__dict__.update(state)
+
+    def __getitem__(self, keyword: str) -> PostingList:
+        return self.postings[keyword]
+
+    def __contains__(self, keyword: str) -> bool:
+        return keyword in self.postings
+
+    def __len__(self):
+        return len(self.postings)
+
+    def get(self, keyword: str, default=None):
+        return self.postings.get(keyword, default)
+
+    def items(self):
+        return self.postings.items()
+
+    def keys(self):
+        return self.postings.keys()
+
+    def __str__(self):
+        return str({keyword: ids.array().tolist() for keyword, ids in self.postings.items()})
+
+
+if __name__ == "__main__":
+    pass
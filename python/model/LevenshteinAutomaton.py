@@ -0,0 +1,96 @@
+from __future__ import annotations
+from bisect import bisect_left
+
+# sorts after every character a word can contain, bounds the range of words starting with a prefix
+PREFIX_END = '\U0010ffff'
+
+
+def fuzzy_edits(word: str) -> int:
+    """Return the number of edits a fuzzy search tolerates for word: none up to 2 characters, 1 up to 5, else 2."""
+    if len(word) <= 2:
+        return 0
+    return 1 if len(word) <= 5 else 2
+
+
+class LevenshteinAutomaton:
+    """
+    Deterministic automaton accepting the words within max_edits insertions, deletions or substitutions of word.
+
+    A state is the last row of the edit distance table between word and the characters read so far, with every
+    entry capped at max_edits + 1, so there are only few distinct states. Transitions are computed on first use
+    and memoized; characters that do not occur in word all lead to the same state and share one entry. A state
+    whose entries all exceed max_edits is dead: no continuation of the characters read so far can match.
+
+    @params
+    word: str: word to match
+    max_edits: int: largest edit distance a match may have
+    """
+
+    def __init__(self, word: str, max_edits: int):
+        self.word = word
+        self.max_edits = max_edits
+        self.start = tuple(min(i, max_edits + 1) for i in range(len(word) + 1))
+        self._letters = set(word)
+        self._transitions = {}  # (state, character) -> state, None for dead states
+
+    def step(self, state: tuple, character: str):
+        """Return the state after reading character in state, None if no word can match from there."""
+        if character not in self._letters:
+            character = ''  # matches no character of word
+        key = (state, character)
+        try:
+            return self._transitions[key]
+        except KeyError:
+            pass
+        limit = self.max_edits + 1
+        row = [min(state[0] + 1, limit)]
+        for i, letter in enumerate(self.word):
+            row.append(min(state[i + 1] + 1, row[i] + 1, state[i] + (letter != character), limit))
+        following = tuple(row) if min(row) < limit else None
+        self._transitions[key] = following
+        return following
+
+    def run(self, text: str):
+        """Return the edit distance of text to word, or None if it exceeds max_edits."""
+        state = self.start
+        for character in text:
+            state = self.step(state, character)
+            if state is None:
+                return None
+        return state[-1] if state[-1] <= self.max_edits else None
+
+    def search(self, words: list) -> list:
+        """
+        Return (distance, word) for the words of a sorted list that match.
+
+        The sorted list is walked as an implicit trie: words sharing a prefix form a contiguous range, the range
+        of each next character is found by binary search, and ranges whose prefix leads to a dead state are
+        skipped without reading any of their words. The work is therefore proportional to the prefixes that can
+        still match, not to the length of the list.
+
+        @params
+        words: list: sorted words to search
+        """
+        matches = []
+        # (prefix, state, low, high): words[low:high] all start with prefix, which leads to state
+        stack = [('', self.start, 0, len(words))]
+        while stack:
+            prefix, state, low, high = stack.pop()
+            depth = len(prefix)
+            if low < high and words[low] == prefix:
+                # the prefix itself is a word, it sorts first in its range
+                if state[-1] <= self.max_edits:
+                    matches.append((state[-1], prefix))
+                low += 1
+            while low < high:
+                extended = prefix + words[low][depth]
+                end = bisect_left(words, extended + PREFIX_END, low, high)
+                following = self.step(state, extended[-1])
+                if following is not None:
+                    stack.append((extended, following, low, end))
+                low = end
+        return matches
+
+
+if __name__ == "__main__":
+    pass
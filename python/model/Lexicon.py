@@ -0,0 +1,163 @@
+from __future__ import annotations
+import heapq
+from bisect import bisect_left
+from itertools import chain
+from python.model.LevenshteinAutomaton import LevenshteinAutomaton
+
+# new and removed words are merged into the sorted list once there are this many, or 1/MERGE_FRACTION of it if
+# that is more
+MERGE_PENDING = 1024
+MERGE_FRACTION = 8
+# sorts after every character a keyword can contain, bounds the range of words starting with a prefix
+PREFIX_END = '\U0010ffff'
+# words occurring in at least this many nodes are also kept in the lexicon's list of common words
+COMMON_FREQUENCY = 2
+
+
+class SortedWords:
+    """
+    Sorted list of words with buffered changes. The words starting with a prefix are a contiguous range of the
+    list, found by two binary searches. New words wait in a small set until there are enough changes to merge,
+    removed words stay in the list until then and are skipped.
+    """
+    __slots__ = ('words', 'pending', 'removed')
+
+    def __init__(self, words=()):
+        self.words = sorted(words)
+        self.pending = set()  # added, not yet in words
+        self.removed = set()  # still in words, dropped on the next merge
+
+    def add(self, word: str):
+        if word in self.removed:
+            self.removed.discard(word)
+        else:
+            self.pending.add(word)
+            self._changed()
+
+    def discard(self, word: str):
+        if word in self.pending:
+            self.pending.discard(word)
+        else:
+            self.removed.add(word)
+            self._changed()
+
+    def _changed(self):
+        if len(self.pending) + len(self.removed) >= max(MERGE_PENDING, len(self.words) // MERGE_FRACTION):
+            self._merge()
+
+    def _merge(self):
+        removed = self.removed
+        kept = (word for word in self.words if word not in removed) if removed else self.words
+        # two sorted runs, timsort merges them in linear time
+        self.words = sorted(chain(kept, sorted(self.pending)))
+        self.pending = set()
+        self.removed = set()
+
+    def starting_with(self, prefix: str):
+        """Iterate over the words starting with prefix in sorted order, lazily."""
+        words = self.words
+        low = bisect_left(words, prefix)
+        high = bisect_left(words, prefix + PREFIX_END, low)
+        listed = (words[i] for i in range(low, high))
+        if self.removed:
+            removed = self.removed
+            listed = (word for word in listed if word not in removed)
+        if not self.pending:
+            return listed
+        return heapq.merge(listed, sorted(word for word in self.pending if word.startswith(prefix)))
+
+    def __len__(self):
+        return len(self.words) + len(self.pending) - len(self.removed)
+
+
+class Lexicon:
+    """
+    Sorted lexicon of the keywords of a KeywordIndex, for prefix completion ranked by document frequency.
+
+    Most keywords of a file tree occur in a single file, numbers and dates in names for example, so a short
+    prefix can match a large share of the lexicon. The words occurring in at least COMMON_FREQUENCY nodes are
+    therefore also kept in a second, much shorter list. Ranking only has to look at the common words starting
+    with the prefix; if there are fewer than k of them the rest are the rare words, which all share the lowest
+    frequency and are taken alphabetically, stopping after the first few. Completions are memoized per prefix
+    until the index changes, so typing and deleting characters does not rank the same range twice.
+
+    @params
+    words: iterable: keywords to start with
+    frequency: callable: returns the number of nodes a keyword occurs in
+    """
+    __slots__ = ('words', 'common', '_memo')
+
+    def __init__(self, words=(), frequency=None):
+        words = list(words)
+        self.words = SortedWords(words)
+        self.common = SortedWords(word for word in words if frequency(word) >= COMMON_FREQUENCY) \
+            if frequency is not None else SortedWords()
+        self._memo = {}  # (prefix, k) -> (index version, completions)
+
+    def add(self, word: str, count: int):
+        """Record that word now occurs in count nodes, one more than before."""
+        if count == 1:
+            self.words.add(word)
+        if count == COMMON_FREQUENCY:
+            self.common.add(word)
+
+    def discard(self, word: str, count: int):
+        """Record that word now occurs in count nodes, one less than before."""
+        if count == 0:
+            self.words.discard(word)
+        if count == COMMON_FREQUENCY - 1:
+            self.common.discard(word)
+
+    def completions(self, prefix: str, k: int, frequency, version: int = None) -> list:
+        """
+        Return up to k words starting with prefix, most frequent first and alphabetically among equals.
+
+        @params
+        prefix: str: start of the words to complete
+        k: int: number of completions to return
+        frequency: callable: returns the number of nodes a word occurs in
+        version: int: version of the index, completions are reused while it stays the same
+        """
+        memo = self._memo.get((prefix, k))
+        if memo is not None and version is not None and memo[0] == version:
+            return list(memo[1])
+        ranked = heapq.nsmallest(k, ((-frequency(word), word) for word in self.common.starting_with(prefix)))
+        result = [word for _, word in ranked]
+        if len(result) < k:
+            for word in self.words.starting_with(prefix):
+                if frequency(word) < COMMON_FREQUENCY:
+                    result.append(word)
+                    if len(result) == k:
+                        break
+        if version is not None:
+            if len(self._memo) > 1024:
+                self._memo.clear()
+            self._memo[(prefix, k)] = (version, result)
+        return list(result)
+
+    def fuzzy(self, word: str, max_edits: int) -> list:
+        """
+        Return the words within max_edits edits of word, closest first and alphabetically among equals.
+
+        @params
+        word: str: possibly misspelled word
+        max_edits: int: largest edit distance a returned word may have
+        """
+        words = self.words
+        if len(words.pending) > MERGE_PENDING // 4:
+            words._merge()
+        automaton = LevenshteinAutomaton(word, max_edits)
+        matches = automaton.search(words.words)
+        for pending in words.pending:
+            distance = automaton.run(pending)
+            if distance is not None:
+                matches.append((distance, pending))
+        matches.sort()
+        return [match for _, match in matches if match not in words.removed]
+
+    def __len__(self):
+        return len(self.words)
+
+
+if __name__ == "__main__":
+    pass
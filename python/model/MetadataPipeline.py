@@ -0,0 +1,217 @@
+from __future__ import annotations
+import os
+import signal
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+
+DEFAULT_BATCH_SIZE = 64
+DEFAULT_FILE_TIMEOUT = 10.0  # seconds one file may take before it is given up on
+
+
+class _FileTimeout(Exception):
+    pass
+
+
+def _raise_timeout(signum, frame):
+    raise _FileTimeout()
+
+
+def _extract_one(node_class: type, path: str):
+    """Build a detached node for path and return its metadata record."""
+    node = node_class(path, None, os.path.basename(path), None)
+    node.load_metadata()
+    return node.metadata_record()
+
+
+def extract_batch(items: list, timeout: float = DEFAULT_FILE_TIMEOUT, extractor=_extract_one) -> list:
+    """
+    Worker process entry point: extract the metadata of a batch of files.
+
+    @params
+    items: list[tuple]: arguments of extractor for each file, ending with its path; for the default extractor
+           the node class and path, the class decides how the metadata is read
+    timeout: float: seconds allowed per file, enforced with SIGALRM where the platform has it
+    extractor: callable: module level function returning the record of one file, it is pickled to the workers
+
+    Returns a list of (path, record) tuples, record is None for files that failed or timed out.
+    """
+    use_alarm = timeout and hasattr(signal, 'setitimer')
+    if use_alarm:
+        previous_handler = signal.signal(signal.SIGALRM, _raise_timeout)
+
+    results = []
+    try:
+        for item in items:
+            path = item[-1]
+            try:
+                if use_alarm:
+                    signal.setitimer(signal.ITIMER_REAL, timeout)
+                record = extractor(*item)
+            except _FileTimeout:
+                print(f"Metadata extraction timed out after {timeout}s: {path}")
+                record = None
+            except Exception as e:
+                print(f"Metadata extraction failed for {path}: {e}")
+                record = None
+            finally:
+                if use_alarm:
+                    signal.setitimer(signal.ITIMER_REAL, 0)
+            results.append((path, record))
+    finally:
+        if use_alarm:
+            signal.signal(signal.SIGALRM, previous_handler)
+    return results
+
+
+class MetadataPipeline:
+    """
+    Extracts Image, Music and Document metadata in a pool of worker processes.
+
+    EXIF, ID3 and PDF/DOCX parsing is CPU bound Python code that the GIL serialises across threads,
+    so nodes are sent to separate processes in batches of paths. Workers return plain metadata
+    records which are merged back into the nodes with apply_metadata() in the calling process.
+
+    @params
+    processes: int: number of worker processes (default: number of CPUs)
+    batch_size: int: number of files sent to a worker at once
+    timeout: float: seconds allowed per file, a corrupt file only loses its own record
+    extractor: callable: module level function extracting one file in the workers, see extract_batch()
+    """
+
+    def __init__(self, processes: int = None, batch_size: int = DEFAULT_BATCH_SIZE,
+                 timeout: float = DEFAULT_FILE_TIMEOUT, extractor=_extract_one):
+        self.processes = processes or os.cpu_count() or 1
+        self.batch_size = max(1, batch_size)
+        self.timeout = timeout
+        self.extractor = extractor
+        self._executor = None
+        self._lock = threading.Lock()  # guards _executor, cancel() is called from other threads
+        self._cancelled = threading.Event()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+
+    def _pool(self) -> ProcessPoolExecutor:
+        # called with _lock held
+        if self._executor is None:
+            # spawn instead of fork, the GUI process has Qt and scanner threads running
+            self._executor = ProcessPoolExecutor(max_workers=self.processes,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def cancel(self):
+        """
+        Stop extracting, from any thread: queued batches are dropped, the workers are killed and extract() ends
+        without yielding the remaining records.
+        """
+        self._cancelled.set()
+        self._terminate()
+
+    def _terminate(self):
+        """Kill the worker processes and drop the pool, a worker stuck outside Python could never be joined."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is None:
+            return
+        # ProcessPoolExecutor has no public way to stop a task that is already running
+        processes = list((getattr(executor, '_processes', None) or {}).values())
+        executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            process.terminate()
+
+    def extract(self, items: list):
+        """
+        Extract metadata for (node_class, path) items, or the items of the extractor, yielding (path, record) as
+        batches finish.
+        """
+        futures = deque()
+        for start in range(0, len(items), self.batch_size):
+            batch = items[start:start + self.batch_size]
+            futures.append((batch, self._submit(batch)))
+
+        while futures and not self._cancelled.is_set():
+            batch, future = futures.popleft()
+            # the per-file alarm normally fires first, this only catches a worker stuck outside Python
+            batch_timeout = self.timeout * len(batch) + 5 if self.timeout else None
+            try:
+                results = future.result(timeout=batch_timeout)
+            except FutureTimeoutError:
+                print(f"Metadata batch starting at {batch[0][-1]} timed out")
+                results = [(item[-1], None) for item in batch]
+                # the stuck worker is killed with the pool, batches that had not finished are sent to a new one
+                kept = [(other_batch, other if other.done() else None) for other_batch, other in futures]
+                self._terminate()
+                futures = deque((other_batch, other if other is not None else self._submit(other_batch))
+                                for other_batch, other in kept)
+            except Exception as e:
+                if self._cancelled.is_set():
+                    break  # the batch was lost to cancel() killing the workers
+                print(f"Metadata batch starting at {batch[0][-1]} failed: {e}")
+                results = [(item[-1], None) for item in batch]
+            yield from results
+
+    def _submit(self, batch: list) -> Future:
+        with self._lock:
+            if self._cancelled.is_set():
+                # no new pool after cancel(), the batch is given up like the queued ones
+                future = Future()
+                future.cancel()
+                return future
+            return self._pool().submit(extract_batch, batch, self.timeout, self.extractor)
+
+    def run(self, nodes: list, should_stop=None) -> int:
+        """
+        Extract the metadata of the given nodes and merge it into them.
+
+        @params
+        nodes: list: nodes providing load_metadata/metadata_record/apply_metadata
+        should_stop: callable: checked between batches, returning True cancels the batches that are left
+
+        Returns the number of nodes that received a record.
+        """
+        by_path = {node.path: node for node in nodes}
+        items = [(type(node), path) for path, node in by_path.items()]
+        merged = 0
+        for path, record in self.extract(items):
+            if should_stop is not None and should_stop():
+                self.cancel()
+                break
+            if record is not None:
+                by_path[path].apply_metadata(record)
+                merged += 1
+        return merged
+
+
+if __name__ == "__main__":
+    # check that a scanned PDF becomes a Document node and gets its record from the workers
+    import tempfile
+    from PyPDF2 import PdfWriter
+    from python.model.Document import Document
+    from python.model.FileSystemCache import FileSystemCache
+    from python.model.FileSystemScanner import FileSystemScanner
+
+    with tempfile.TemporaryDirectory() as directory:
+        writer = PdfWriter()
+        writer.add_blank_page(width=72, height=72)
+        writer.add_metadata({'/Title': 'Pipeline check', '/Author': 'KLAAS'})
+        with open(os.path.join(directory, 'check.pdf'), 'wb') as pdf_file:
+            writer.write(pdf_file)
+        cache = FileSystemCache()
+        FileSystemScanner(directory, cache).scan()
+        node = cache.get(os.path.join(directory, 'check.pdf'))
+        assert isinstance(node, Document), type(node)
+        with MetadataPipeline(processes=1) as pipeline:
+            assert pipeline.run([node]) == 1
+        assert node.metadata_record()['title'] == 'Pipeline check', node.metadata_record()
+        print(f"{node.path}: {node.metadata_record()}")
@@ -0,0 +1,145 @@
+from __future__ import annotations
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from python.model.FileSystemCache import FileSystemCache
+from python.model.MetadataPipeline import MetadataPipeline
+from python.model.MetadataStore import MetadataStore, METADATA_STORE_FILE
+
+DEFAULT_PREFETCH_WORKERS = 4
+PREFETCH_CHUNK_SIZE = 1000
+# below this many files starting worker processes costs more than it saves
+PROCESS_POOL_THRESHOLD = 500
+
+
+class MetadataPrefetcher:
+    """
+    Loads the lazy metadata of Image, Music, Document and Video nodes in the background once a scan is done.
+
+    Nodes read their metadata on first access anyway, the prefetcher only makes it likely that
+    it is already there when a window asks for it. Work happens on a daemon thread, so start()
+    returns immediately. Large batches go through a MetadataPipeline process pool when processes
+    is set, smaller ones are read on a small thread pool.
+
+    Records are kept in a MetadataStore between runs. Files whose (device, inode, size, mtime) key
+    already has a record are filled in from the store without being opened, newly extracted
+    records are written back once the run finishes.
+
+    @params
+    cache: FileSystemCache: cache whose nodes should have their metadata loaded
+    workers: int: number of threads reading files (default: 4)
+    processes: int: number of worker processes for large trees (default: None, threads only)
+    store_path: str: MetadataStore database, None to always extract (default: cache/metadata.sqlite3)
+    on_done: callable: called without arguments when every node has been processed
+    """
+
+    def __init__(self, cache: FileSystemCache, workers: int = DEFAULT_PREFETCH_WORKERS, processes: int = None,
+                 store_path: str = METADATA_STORE_FILE, on_done=None):
+        self.cache = cache
+        self.workers = workers
+        self.processes = processes
+        self.store_path = store_path
+        self.on_done = on_done
+        self._cancelled = threading.Event()
+        self._pipeline = None  # MetadataPipeline of a running pass, cancelled with the prefetcher
+        self._thread = None
+
+    def start(self):
+        """Start prefetching in the background."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='metadata-prefetch', daemon=True)
+            self._thread.start()
+        return self
+
+    def cancel(self):
+        """Stop after the nodes currently being read, worker processes are stopped right away."""
+        self._cancelled.set()
+        pipeline = self._pipeline
+        if pipeline is not None:
+            pipeline.cancel()
+
+    def join(self, timeout: float = None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def pending_nodes(self) -> list:
+        """Return the nodes that still have metadata to load."""
+        with self.cache.lock:
+            nodes = list(self.cache.values())
+        return [node for node in nodes
+                if hasattr(node, 'load_metadata') and not getattr(node, '_metadata_loaded', True)]
+
+    def _load(self, node):
+        if not self._cancelled.is_set():
+            node.load_metadata()
+
+    def _run(self):
+        nodes = self.pending_nodes()
+        store = MetadataStore(self.store_path) if self.store_path else None
+        try:
+            keys = {}
+            if store is not None:
+                nodes = self._apply_stored(store, nodes, keys)
+
+            if self.processes and len(nodes) >= PROCESS_POOL_THRESHOLD:
+                with MetadataPipeline(processes=self.processes) as pipeline:
+                    # set before checking the flag, cancel() sets the flag before reading it
+                    self._pipeline = pipeline
+                    if not self._cancelled.is_set():
+                        pipeline.run(nodes, should_stop=self._cancelled.is_set)
+                    self._pipeline = None
+            else:
+                self._run_threads(nodes)
+
+            if store is not None:
+                store.store_many([(keys[node], metadata_kind(node), node.metadata_record())
+                                  for node in nodes if node in keys and node._metadata_loaded])
+        finally:
+            if store is not None:
+                store.close()
+        if self.on_done is not None and not self._cancelled.is_set():
+            self.on_done()
+
+    def _apply_stored(self, store: MetadataStore, nodes: list, keys: dict) -> list:
+        """
+        Fill in nodes that have an up to date record in the store.
+
+        Returns the nodes that still need extracting, their file keys are added to keys.
+        """
+        missing = []
+        for start in range(0, len(nodes), PREFETCH_CHUNK_SIZE):
+            by_kind = {}
+            for node in nodes[start:start + PREFETCH_CHUNK_SIZE]:
+                try:
+                    key = node.stat_key()  # captured while scanning, no syscall
+                except OSError:
+                    continue
+                by_kind.setdefault(metadata_kind(node), {})[node] = key
+            for kind, chunk_keys in by_kind.items():
+                records = store.lookup_many(list(chunk_keys.values()), kind)
+                for node, key in chunk_keys.items():
+                    record = records.get(key)
+                    if record is not None:
+                        node.apply_metadata(record)
+                    else:
+                        keys[node] = key
+                        missing.append(node)
+        return missing
+
+    def _run_threads(self, nodes: list):
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='metadata') as executor:
+            # submit in chunks so a million-file tree does not create a million futures at once
+            for start in range(0, len(nodes), PREFETCH_CHUNK_SIZE):
+                if self._cancelled.is_set():
+                    break
+                for _ in executor.map(self._load, nodes[start:start + PREFETCH_CHUNK_SIZE]):
+                    pass
+
+
+def metadata_kind(node) -> str:
+    """Return the kind of metadata a node carries, e.g. 'image' or 'music'."""
+    return type(node).__name__.lower()
+
+
+if __name__ == "__main__":
+    pass
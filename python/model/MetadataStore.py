@@ -0,0 +1,106 @@
+from __future__ import annotations
+import os
+import json
+import sqlite3
+import threading
+
+METADATA_STORE_FILE = 'cache/metadata.sqlite3'
+LOOKUP_CHUNK_SIZE = 900  # stay below SQLite's default limit of 999 bound variables
+
+
+def file_key(stat_result: os.stat_result) -> tuple:
+    """Return the (st_dev, st_ino, st_size, st_mtime_ns) key identifying one version of a file."""
+    return stat_result.st_dev, stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns
+
+
+class MetadataStore:
+    """
+    Persistent side store of extracted metadata, kept in a SQLite table.
+
+    Records are keyed by (st_dev, st_ino) and only returned while the file's size and mtime still
+    match, so a file that was edited, replaced or moved to another inode is parsed again. Lookups
+    are done in bulk, one query per chunk of keys, so a directory batch costs a handful of queries
+    instead of one per file.
+
+    @params
+    path: str: database file (default: cache/metadata.sqlite3)
+    """
+
+    def __init__(self, path: str = METADATA_STORE_FILE):
+        self.path = path
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS metadata (
+                st_dev INTEGER NOT NULL,
+                st_ino INTEGER NOT NULL,
+                st_size INTEGER NOT NULL,
+                st_mtime_ns INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                record TEXT NOT NULL,
+                PRIMARY KEY (st_dev, st_ino)
+            )
+        """)
+        self._connection.commit()
+
+    def lookup_many(self, keys: list, kind: str = None) -> dict:
+        """
+        Look up the records of many files at once.
+
+        @params
+        keys: list[tuple]: (st_dev, st_ino, st_size, st_mtime_ns) keys, see file_key
+        kind: str: only return records extracted for this kind of node (e.g. 'image')
+
+        Returns a dict mapping each key that has an up to date record to the record.
+        """
+        wanted = {(key[0], key[1]): key for key in keys}
+        # the primary key is (st_dev, st_ino), filtering on both lets each chunk search the key's index
+        inodes_by_device = {}
+        for st_dev, st_ino in wanted:
+            inodes_by_device.setdefault(st_dev, []).append(st_ino)
+        found = {}
+        with self._lock:
+            for device, inodes in inodes_by_device.items():
+                inodes.sort()
+                for start in range(0, len(inodes), LOOKUP_CHUNK_SIZE):
+                    chunk = inodes[start:start + LOOKUP_CHUNK_SIZE]
+                    rows = self._connection.execute(
+                        f"SELECT st_dev, st_ino, st_size, st_mtime_ns, kind, record FROM metadata "
+                        f"WHERE st_dev = ? AND st_ino IN ({','.join('?' * len(chunk))})", [device] + chunk)
+                    for st_dev, st_ino, st_size, st_mtime_ns, row_kind, record in rows:
+                        key = wanted.get((st_dev, st_ino))
+                        if key is None or key[2] != st_size or key[3] != st_mtime_ns:
+                            continue
+                        if kind is not None and row_kind != kind:
+                            continue
+                        found[key] = json.loads(record)
+        return found
+
+    def store_many(self, entries: list):
+        """
+        Store records, replacing older versions of the same files.
+
+        @params
+        entries: list[tuple]: (key, kind, record) with key from file_key and record a JSON-able dict
+        """
+        rows = [(key[0], key[1], key[2], key[3], kind, json.dumps(record, default=str))
+                for key, kind, record in entries]
+        if not rows:
+            return
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO metadata (st_dev, st_ino, st_size, st_mtime_ns, kind, record) "
+                "VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self._connection.commit()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+if __name__ == "__main__":
+    pass
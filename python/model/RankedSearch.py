@@ -0,0 +1,77 @@
+from __future__ import annotations
+import heapq
+import numpy as np
+
+# results per page of a ranked search
+PAGE_SIZE = 50
+# bonus of a node modified just now, halving every RECENCY_HALF_LIFE_DAYS
+RECENCY_WEIGHT = 1.0
+RECENCY_HALF_LIFE_DAYS = 30
+# bonus of a node directly below the root of its tree, DEPTH_WEIGHT / depth for deeper nodes
+DEPTH_WEIGHT = 0.5
+NS_PER_DAY = 86400 * 10 ** 9
+
+
+def recency_bonus(mtimes_ns: np.ndarray, now_ns: int) -> np.ndarray:
+    """Return the recency bonus for an array of modification times, 0 where the time is unknown (0)."""
+    age_days = np.maximum(now_ns - mtimes_ns, 0) / NS_PER_DAY
+    bonus = RECENCY_WEIGHT * np.exp2(-age_days / RECENCY_HALF_LIFE_DAYS)
+    bonus[mtimes_ns == 0] = 0.0
+    return bonus
+
+
+def depth_bonus(node) -> float:
+    """Return the depth bonus of a node, larger for nodes closer to the root of their tree."""
+    depth = 0
+    while node.parent is not None:
+        node = node.parent
+        depth += 1
+    return DEPTH_WEIGHT / max(1, depth)
+
+
+def top_k(ids: np.ndarray, scores: np.ndarray, k: int, bonus, max_bonus: float) -> list:
+    """
+    Return the k best (score, node_id) pairs, best first, where score is scores plus bonus(node_id).
+
+    The bonus is computed in Python per node, so it is only computed for candidates that can still make it
+    into the top k: candidates are visited by descending scores, kept in a heap of size k, and the visit stops
+    once the next candidate's score plus max_bonus cannot beat the worst of the heap. Only as many candidates
+    as needed are sorted, the next batch is selected with np.argpartition when the first runs out.
+
+    @params
+    ids: np.ndarray: node ids of the candidates
+    scores: np.ndarray: score of every candidate without the bonus
+    k: int: number of results
+    bonus: callable: returns the bonus of a node id, between 0 and max_bonus
+    max_bonus: float: largest value bonus can return
+    """
+    heap = []  # (score, -node_id), the worst result on top, ties favour smaller ids
+    if k <= 0 or not len(ids):
+        return []
+    visited = np.zeros(len(ids), dtype=bool)
+    batch = min(len(ids), 4 * k + 64)
+    while True:
+        if batch < len(ids):
+            order = np.argpartition(-scores, batch - 1)[:batch]
+        else:
+            order = np.arange(len(ids))
+        order = order[np.argsort(-scores[order], kind='stable')]
+        order = order[~visited[order]]
+        visited[order] = True
+        for index in order.tolist():
+            score = scores[index]
+            if len(heap) == k and score + max_bonus <= heap[0][0]:
+                return [(score, -negated) for score, negated in sorted(heap, reverse=True)]
+            node_id = int(ids[index])
+            entry = (score + bonus(node_id), -node_id)
+            if len(heap) < k:
+                heapq.heappush(heap, entry)
+            elif entry > heap[0]:
+                heapq.heapreplace(heap, entry)
+        if batch >= len(ids):
+            return [(score, -negated) for score, negated in sorted(heap, reverse=True)]
+        batch = min(len(ids), batch * 4)
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,536 @@
+from __future__ import annotations
+import os
+import json
+import sqlite3
+import threading
+
+from python.model.FileSystemCache import FileSystemCache
+from python.model.FileSystemNodeModel import Directory, file_node_class
+from python.model.CachePersister import CachePersister, CHECKPOINT_EVERY_DIRECTORIES, CHECKPOINT_EVERY_SECONDS
+from python.model.ScanRules import ScanRules
+
+TREE_STORE_FILE = 'cache/tree.sqlite3'
+LOOKUP_CHUNK_SIZE = 900  # stay below SQLite's default limit of 999 bound variables
+DEFAULT_LOAD_DEPTH = 2  # levels below the selected directory loaded up front, deeper ones load when opened
+SYNC_CHUNK_SIZE = 256  # directories written per hold of the cache lock, keeps the scanner and watcher going
+
+
+_CHILDREN_SLOT = Directory.children  # slot descriptor, bypasses StoredDirectory.children
+
+
+def prefix_bounds(path: str) -> tuple:
+    """Return the [low, high) range of paths strictly below path, usable with the path index."""
+    prefix = os.path.join(path, '')
+    # the separator followed by the next character up bounds every path that starts with prefix
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def node_type_name(node) -> str:
+    """Return the type stored for a node, directories loaded lazily are still stored as 'Directory'."""
+    return 'Directory' if isinstance(node, Directory) else type(node).__name__
+
+
+class SQLiteTreeStore:
+    """
+    Persistent tree store in a SQLite database, an alternative to pickling the whole cache.
+
+    Nodes are rows (id, parent_id, name, type, size, mtime, ctime, inode, device, path) with
+    indexes on parent_id and path, extracted metadata is kept as JSON in a separate table. A
+    subtree can be loaded on its own, optionally only down to a given depth, paths can be queried
+    by prefix without building nodes, and changes are written per directory instead of rewriting
+    the whole database.
+
+    @params
+    path: str: database file (default: cache/tree.sqlite3)
+    """
+
+    def __init__(self, path: str = TREE_STORE_FILE):
+        self.path = path
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._lock = threading.RLock()
+        self.root = None  # root Directory of the last load_subtree(), see find()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS nodes (
+                id INTEGER PRIMARY KEY,
+                parent_id INTEGER,
+                name TEXT NOT NULL,
+                type TEXT NOT NULL,
+                size INTEGER,
+                mtime_ns INTEGER,
+                ctime_ns INTEGER,
+                inode INTEGER,
+                device INTEGER,
+                path TEXT NOT NULL UNIQUE
+            );
+            CREATE INDEX IF NOT EXISTS nodes_parent ON nodes (parent_id);
+            CREATE TABLE IF NOT EXISTS metadata (
+                node_id INTEGER PRIMARY KEY,
+                record TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS roots (
+                path TEXT PRIMARY KEY,
+                rules TEXT
+            );
+        """)
+        self._connection.commit()
+
+    # writing
+
+    def save_tree(self, root: Directory, rules: ScanRules = None):
+        """Replace everything stored at and below root with the given tree."""
+        with self._lock, self._connection:
+            root_path = root.path
+            self._delete_subtree(root_path)
+            parent_id = self._id_of(os.path.dirname(root_path))
+            self._insert_subtree(root, parent_id, root_path)
+            if rules is not None:
+                self.save_rules(root_path, rules)
+
+    def sync_directories(self, directories: list):
+        """
+        Make the stored rows of each directory and its direct children match the tree.
+
+        New children are inserted with their subtrees, children that are gone are deleted with
+        theirs, changed files are updated and lose their stored metadata.
+        """
+        with self._lock, self._connection:
+            for directory in directories:
+                self._sync_directory(directory)
+
+    def _sync_directory(self, directory: Directory):
+        path = directory.path
+        directory_id = self._id_of(path)
+        if directory_id is None:
+            parent_id = self._id_of(os.path.dirname(path))
+            self._insert_subtree(directory, parent_id, path)
+            return
+        self._connection.execute(
+            "UPDATE nodes SET size = ?, mtime_ns = ?, ctime_ns = ?, inode = ?, device = ? WHERE id = ?",
+            (directory.size, directory.st_mtime_ns, directory.st_ctime_ns, directory.st_ino, directory.st_dev,
+             directory_id))
+
+        stored = {name: (node_id, node_type, size, mtime_ns) for node_id, name, node_type, size, mtime_ns in
+                  self._connection.execute("SELECT id, name, type, size, mtime_ns FROM nodes WHERE parent_id = ?",
+                                           (directory_id,))}
+        for child in directory.children:
+            child_path = os.path.join(path, child.name)
+            row = stored.pop(child.name, None)
+            if row is not None and row[1] != node_type_name(child):
+                self._delete_subtree(child_path)
+                row = None
+            if row is None:
+                self._insert_subtree(child, directory_id, child_path)
+            elif not isinstance(child, Directory) and (row[2], row[3]) != (child.size, child.st_mtime_ns):
+                self._connection.execute(
+                    "UPDATE nodes SET size = ?, mtime_ns = ?, ctime_ns = ?, inode = ?, device = ? WHERE id = ?",
+                    (child.size, child.st_mtime_ns, child.st_ctime_ns, child.st_ino, child.st_dev, row[0]))
+                self._connection.execute("DELETE FROM metadata WHERE node_id = ?", (row[0],))
+        for name in stored:
+            self._delete_subtree(os.path.join(path, name))
+
+    def _insert_subtree(self, root, parent_id, root_path: str):
+        """Insert root and everything below it, parents first so their ids are known."""
+        next_id = self._connection.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM nodes").fetchone()[0]
+        rows, metadata = [], []
+        queue = [(root, parent_id, root_path)]
+        for node, node_parent_id, node_path in queue:
+            node_id = next_id
+            next_id += 1
+            rows.append((node_id, node_parent_id, node.name, node_type_name(node), node.size, node.st_mtime_ns,
+                         node.st_ctime_ns, node.st_ino, node.st_dev, node_path))
+            if getattr(node, '_metadata_loaded', False):
+                metadata.append((node_id, json.dumps(node.metadata_record(), default=str)))
+            queue.extend((child, node_id, os.path.join(node_path, child.name)) for child in node.children)
+        self._connection.executemany(
+            "INSERT INTO nodes (id, parent_id, name, type, size, mtime_ns, ctime_ns, inode, device, path) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        self._connection.executemany("INSERT OR REPLACE INTO metadata (node_id, record) VALUES (?, ?)", metadata)
+
+    def delete_subtree(self, path: str):
+        """Delete the row of path and every row below it."""
+        with self._lock, self._connection:
+            self._delete_subtree(os.path.normpath(path))
+
+    def _delete_subtree(self, path: str):
+        low, high = prefix_bounds(path)
+        condition = "path = ? OR (path >= ? AND path < ?)"
+        self._connection.execute(f"DELETE FROM metadata WHERE node_id IN (SELECT id FROM nodes WHERE {condition})",
+                                 (path, low, high))
+        self._connection.execute(f"DELETE FROM nodes WHERE {condition}", (path, low, high))
+
+    def move(self, old_path: str, new_path: str):
+        """Record a rename or move, rewriting the stored paths of the whole subtree."""
+        old_path, new_path = os.path.normpath(old_path), os.path.normpath(new_path)
+        with self._lock, self._connection:
+            node_id = self._id_of(old_path)
+            if node_id is None:
+                return
+            self._delete_subtree(new_path)
+            low, high = prefix_bounds(old_path)
+            self._connection.execute(
+                "UPDATE nodes SET path = ? || substr(path, ?) WHERE path >= ? AND path < ?",
+                (new_path, len(old_path) + 1, low, high))
+            self._connection.execute("UPDATE nodes SET path = ?, name = ?, parent_id = ? WHERE id = ?",
+                                     (new_path, os.path.basename(new_path), self._id_of(os.path.dirname(new_path)),
+                                      node_id))
+
+    def save_metadata(self, nodes):
+        """Store the metadata of nodes that have it loaded and do not have a stored record yet."""
+        loaded = {node.path: node for node in nodes if getattr(node, '_metadata_loaded', False)}
+        if not loaded:
+            return
+        with self._lock, self._connection:
+            ids = self._ids_of(list(loaded))
+            stored = set()
+            id_list = list(ids.values())
+            for start in range(0, len(id_list), LOOKUP_CHUNK_SIZE):
+                chunk = id_list[start:start + LOOKUP_CHUNK_SIZE]
+                stored.update(row[0] for row in self._connection.execute(
+                    f"SELECT node_id FROM metadata WHERE node_id IN ({','.join('?' * len(chunk))})", chunk))
+            self._connection.executemany(
+                "INSERT INTO metadata (node_id, record) VALUES (?, ?)",
+                [(node_id, json.dumps(loaded[path].metadata_record(), default=str))
+                 for path, node_id in ids.items() if node_id not in stored])
+
+    def save_rules(self, root_path: str, rules: ScanRules):
+        state = rules.__getstate__()
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO roots (path, rules) VALUES (?, ?)",
+                                     (os.path.normpath(root_path), json.dumps(state, default=sorted)))
+
+    # reading
+
+    def load_rules(self, root_path: str):
+        """Return the ScanRules the stored tree at root_path was scanned with, None if unknown."""
+        with self._lock:
+            row = self._connection.execute("SELECT rules FROM roots WHERE path = ?",
+                                           (os.path.normpath(root_path),)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return ScanRules(**json.loads(row[0]))
+
+    def load_subtree(self, path: str, cache: FileSystemCache, max_depth: int = None):
+        """
+        Build the stored tree below path as nodes in cache and return its root Directory.
+
+        Only the requested subtree is read. With max_depth, directories max_depth levels below the
+        root are StoredDirectory nodes whose children are loaded when they are first accessed, and
+        cache.get() loads the directories on the way down to a path that is not loaded yet.
+        Returns None if path is not a stored directory.
+        """
+        path = os.path.normpath(path)
+        # the cache lock is always taken before the store's, StoredDirectory loads while holding it
+        with cache.lock, self._lock:
+            row = self._connection.execute(
+                "SELECT id, name, type, size, mtime_ns, ctime_ns, inode, device FROM nodes WHERE path = ?",
+                (path,)).fetchone()
+            if row is None or row[2] != 'Directory':
+                return None
+            root = Directory(path, cache, row[1], None, populate=False)
+            self._fill(root, row[3:])
+            cache.update(path, root)
+            if row[4] is not None:
+                cache.set_dir_mtime(root, row[4])
+            self._load_levels(cache, {row[0]: root}, max_depth)
+            rules = self.load_rules(path)
+            if rules is not None:
+                cache.scan_rules = rules
+            self.root = root
+            cache.tree_store = self
+        return root
+
+    def load_children(self, directory: Directory, cache: FileSystemCache, max_depth: int = 0):
+        """Load the children of a directory that was loaded without them (and max_depth more levels)."""
+        with cache.lock, self._lock:
+            if type(directory) is StoredDirectory:
+                # rows are found by id, the directory may have been moved since it was loaded
+                directory_id = _CHILDREN_SLOT.__get__(directory).node_id
+                directory.__class__ = Directory
+            else:
+                directory_id = self._id_of(directory.path)
+            _CHILDREN_SLOT.__set__(directory, [])
+            if directory_id is not None:
+                self._load_levels(cache, {directory_id: directory}, max_depth + 1)
+
+    def materialize(self, directory: Directory, cache: FileSystemCache):
+        """
+        Load every directory below directory whose children are still in the store, e.g. before its rows are
+        deleted. The pending directories are read level by level like load_subtree(), not one by one.
+        """
+        with cache.lock, self._lock:
+            level, stack = {}, [directory]
+            while stack:
+                node = stack.pop()
+                if type(node) is StoredDirectory:
+                    level[_CHILDREN_SLOT.__get__(node).node_id] = node
+                    node.__class__ = Directory
+                    _CHILDREN_SLOT.__set__(node, [])
+                else:
+                    stack.extend(child for child in node.children if isinstance(child, Directory))
+            self._load_levels(cache, level, None)
+
+    def find(self, path: str):
+        """Return the node at path below the loaded root, loading directories on the way down, None if not stored."""
+        if self.root is None:
+            return None
+        relative = os.path.relpath(os.path.normpath(path), self.root.path)
+        if relative == os.curdir:
+            return self.root
+        if relative.startswith(os.pardir):
+            return None
+        node = self.root
+        for name in relative.split(os.sep):
+            node = next((child for child in node.children if child.name == name), None)
+            if node is None:
+                return None
+        return node
+
+    def _load_levels(self, cache: FileSystemCache, level: dict, max_depth):
+        # one query per chunk of parent ids and level, children are attached as they are read
+        depth = 0
+        while level and (max_depth is None or depth < max_depth):
+            next_level = {}
+            ids = list(level)
+            metadata_nodes = {}
+            for start in range(0, len(ids), LOOKUP_CHUNK_SIZE):
+                chunk = ids[start:start + LOOKUP_CHUNK_SIZE]
+                rows = self._connection.execute(
+                    "SELECT id, parent_id, name, type, size, mtime_ns, ctime_ns, inode, device FROM nodes "
+                    f"WHERE parent_id IN ({','.join('?' * len(chunk))}) ORDER BY parent_id, name", chunk)
+                for node_id, parent_id, name, node_type, *stat in rows:
+                    parent = level[parent_id]
+                    child_path = os.path.join(parent.path, name)
+                    if node_type == 'Directory':
+                        child = Directory(child_path, cache, name, parent, populate=False)
+                        next_level[node_id] = child
+                    else:
+                        child = file_node_class(name)(child_path, cache, name, parent, size=stat[0])
+                        if hasattr(child, 'apply_metadata'):
+                            metadata_nodes[node_id] = child
+                    self._fill(child, stat)
+                    parent.children.append(child)
+                    cache.update(child_path, child)
+                    if node_type == 'Directory' and stat[1] is not None:
+                        cache.set_dir_mtime(child, stat[1])
+            self._apply_metadata(metadata_nodes)
+            level = next_level
+            depth += 1
+        for node_id, directory in level.items():
+            _CHILDREN_SLOT.__set__(directory, StoredChildren(self, node_id))
+            directory.__class__ = StoredDirectory
+
+    def _apply_metadata(self, nodes: dict):
+        ids = list(nodes)
+        for start in range(0, len(ids), LOOKUP_CHUNK_SIZE):
+            chunk = ids[start:start + LOOKUP_CHUNK_SIZE]
+            for node_id, record in self._connection.execute(
+                    f"SELECT node_id, record FROM metadata WHERE node_id IN ({','.join('?' * len(chunk))})", chunk):
+                nodes[node_id].apply_metadata(json.loads(record))
+
+    @staticmethod
+    def _fill(node, stat: tuple):
+        size, mtime_ns, ctime_ns, inode, device = stat
+        node.size = size
+        node.st_mtime_ns = mtime_ns
+        node.st_ctime_ns = ctime_ns
+        node.st_ino = inode
+        node.st_dev = device
+
+    def query_prefix(self, prefix: str, node_type: str = None, limit: int = None) -> list:
+        """
+        Return (path, type, size, mtime_ns) rows at and below prefix without building nodes.
+
+        @params
+        prefix: str: directory path
+        node_type: str: only return rows of this type, e.g. 'Image' or 'Directory'
+        limit: int: maximum number of rows
+        """
+        prefix = os.path.normpath(prefix)
+        low, high = prefix_bounds(prefix)
+        query = "SELECT path, type, size, mtime_ns FROM nodes WHERE (path = ? OR (path >= ? AND path < ?))"
+        parameters = [prefix, low, high]
+        if node_type is not None:
+            query += " AND type = ?"
+            parameters.append(node_type)
+        query += " ORDER BY path"
+        if limit is not None:
+            query += " LIMIT ?"
+            parameters.append(limit)
+        with self._lock:
+            return self._connection.execute(query, parameters).fetchall()
+
+    def stored_directory_mtimes(self, root_path: str) -> dict:
+        """Return {path: mtime_ns} of the stored directories at and below root_path."""
+        return {path: mtime_ns for path, _, _, mtime_ns in self.query_prefix(root_path, 'Directory')}
+
+    def has_path(self, path: str) -> bool:
+        """Check if a node is stored at path."""
+        with self._lock:
+            return self._id_of(os.path.normpath(path)) is not None
+
+    def _id_of(self, path: str):
+        row = self._connection.execute("SELECT id FROM nodes WHERE path = ?", (path,)).fetchone()
+        return row[0] if row is not None else None
+
+    def _ids_of(self, paths: list) -> dict:
+        ids = {}
+        for start in range(0, len(paths), LOOKUP_CHUNK_SIZE):
+            chunk = paths[start:start + LOOKUP_CHUNK_SIZE]
+            ids.update(self._connection.execute(
+                f"SELECT path, id FROM nodes WHERE path IN ({','.join('?' * len(chunk))})", chunk))
+        return ids
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class StoredChildren:
+    """Placeholder kept in the children slot of a StoredDirectory until its children are loaded."""
+    __slots__ = ('store', 'node_id')
+
+    def __init__(self, store: SQLiteTreeStore, node_id: int):
+        self.store = store
+        self.node_id = node_id
+
+
+class StoredDirectory(Directory):
+    """
+    Directory loaded from a SQLiteTreeStore below the requested depth, its children are still in the store.
+
+    The first access to children loads them with SQLiteTreeStore.load_children() and turns the node into a
+    plain Directory, so a directory that is expanded or navigated into is read from the database then.
+    """
+    __slots__ = ()
+
+    @property
+    def children(self) -> list:
+        if type(self) is StoredDirectory:
+            with self.cache.lock:
+                if type(self) is StoredDirectory:
+                    _CHILDREN_SLOT.__get__(self).store.load_children(self, self.cache)
+        return _CHILDREN_SLOT.__get__(self)
+
+    @children.setter
+    def children(self, value: list):
+        # assigned children replace the stored ones
+        _CHILDREN_SLOT.__set__(self, value)
+        self.__class__ = Directory
+
+    def __reduce_ex__(self, protocol):
+        self.children  # load them, the store connection cannot be pickled
+        return self.__reduce_ex__(protocol)
+
+
+class TreeStorePersister(CachePersister):
+    """
+    CachePersister that writes to a SQLiteTreeStore instead of pickling the whole cache.
+
+    Checkpoints are scheduled like CachePersister's. The first write stores the whole tree, later writes only
+    touch what the cache reported since the previous one: directories listed again by a scan, directories
+    reported through directories_changed() (e.g. by a FileSystemWatcher), moved nodes and nodes whose metadata
+    was loaded. They are written in chunks of SYNC_CHUNK_SIZE, the cache lock is only held for one chunk at a time.
+
+    @params
+    cache: FileSystemCache: cache to persist, the persister attaches itself to it
+    store: SQLiteTreeStore: store to write to
+    root_path: str: directory whose tree is persisted
+    every_directories: int: checkpoint after this many directories (0 disables)
+    every_seconds: float: checkpoint after this many seconds (0 disables)
+    """
+
+    def __init__(self, cache: FileSystemCache, store: SQLiteTreeStore, root_path: str,
+                 every_directories: int = CHECKPOINT_EVERY_DIRECTORIES,
+                 every_seconds: float = CHECKPOINT_EVERY_SECONDS):
+        super().__init__(cache, store.path, every_directories, every_seconds)
+        self.store = store
+        self.root_path = os.path.normpath(root_path)
+        self._changed = set()  # paths of directories whose rows and children's rows are synced
+        self._moves = []  # (old path, new path) of moved nodes, in the order they were moved
+        self._metadata = set()  # nodes whose metadata was loaded
+
+    def directory_done(self, directory=None):
+        if directory is not None:
+            with self._condition:
+                self._changed.add(directory.path)
+        super().directory_done(directory)
+
+    def directories_changed(self, paths):
+        """Mark directories whose children changed in place and request a write."""
+        with self._condition:
+            self._changed.update(paths)
+        self.flush()
+
+    def node_moved(self, old_path: str, new_path: str):
+        with self._condition:
+            self._moves.append((old_path, new_path))
+            self._changed.update((os.path.dirname(old_path), os.path.dirname(new_path)))
+            self._dirty = True
+
+    def metadata_loaded(self, node):
+        with self._condition:
+            self._metadata.add(node)
+
+    def _write(self):
+        with self._condition:
+            changed, self._changed = self._changed, set()
+            moves, self._moves = self._moves, []
+            metadata, self._metadata = self._metadata, set()
+        try:
+            if not self.store.has_path(self.root_path):
+                with self.cache.lock:
+                    root = self.cache.get(self.root_path)
+                    if not isinstance(root, Directory):
+                        return
+                    self.store.save_tree(root, self.cache.scan_rules)
+                    self.store.save_metadata(root.walk())
+                return
+
+            for old_path, new_path in moves:
+                self._apply_move(old_path, new_path)
+            changed = sorted(changed)
+            for start in range(0, len(changed), SYNC_CHUNK_SIZE):
+                with self.cache.lock:
+                    directories = [self.cache.get(path) for path in changed[start:start + SYNC_CHUNK_SIZE]]
+                    # directories removed since they were reported are deleted with their parent's children
+                    self.store.sync_directories([directory for directory in directories
+                                                 if isinstance(directory, Directory) and
+                                                 self.cache.contains_node(directory)])
+            self.store.save_rules(self.root_path, self.cache.scan_rules)
+            metadata = list(metadata)
+            for start in range(0, len(metadata), SYNC_CHUNK_SIZE):
+                with self.cache.lock:
+                    self.store.save_metadata(node for node in metadata[start:start + SYNC_CHUNK_SIZE]
+                                             if self.cache.contains_node(node))
+        except Exception as e:
+            # the next checkpoint will retry
+            print(f"Failed to write tree store checkpoint to {self.path}: {e}")
+            with self._condition:
+                self._dirty = True
+                self._changed |= set(changed)
+                self._moves[:0] = moves
+                self._metadata |= set(metadata)
+
+    def _apply_move(self, old_path: str, new_path: str):
+        with self.cache.lock:
+            if self.store.has_path(os.path.dirname(new_path)):
+                self.store.move(old_path, new_path)
+                return
+            # the new parent is not stored yet, its sync inserts the moved subtree from the nodes
+            node = self.cache.get(new_path)
+            if isinstance(node, Directory):
+                # directories below it that are not loaded yet would lose their children with the old rows
+                self.store.materialize(node, self.cache)
+            self.store.delete_subtree(old_path)
+
+    def close(self):
+        super().close()
+        self.store.close()
+
+
+if __name__ == "__main__":
+    pass
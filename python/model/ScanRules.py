@@ -0,0 +1,221 @@
+from __future__ import annotations
+import os
+import re
+
+# hidden directories (.git, .cache, ...) and Windows system directories ($RECYCLE.BIN, ...)
+DEFAULT_EXCLUDES = ('.*/', '$*/')
+# optional per-tree rules file, read from the root of the scanned directory
+SCAN_RULES_FILE = '.scanignore'
+
+
+def translate_pattern(pattern: str) -> str:
+    """
+    Translate one gitignore-style glob into a regular expression matched against relative paths.
+
+    A pattern without a '/' (other than a trailing one) matches a name at any depth, a pattern with
+    a leading or inner '/' is anchored to the scan root. '*' and '?' do not cross '/', '**' does.
+    """
+    anchored = '/' in pattern
+    pattern = pattern.lstrip('/')
+    regex = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == '*':
+            if pattern.startswith('**', i):
+                i += 2
+                if pattern.startswith('/', i):
+                    # '**/' matches zero or more whole directories
+                    regex.append('(?:.*/)?')
+                    i += 1
+                else:
+                    regex.append('.*')
+                continue
+            regex.append('[^/]*')
+        elif c == '?':
+            regex.append('[^/]')
+        elif c == '[':
+            # a ']' right after '[' or '[!' (or '[^') is part of the class
+            j = i + 1
+            if j < n and pattern[j] in '!^':
+                j += 1
+            if j < n and pattern[j] == ']':
+                j += 1
+            end = pattern.find(']', j)
+            if end == -1:
+                regex.append(re.escape(c))
+            else:
+                body = pattern[i + 1:end]
+                # '[!...]' (or '[^...]') never matches '/', like '*' and '?' it stays within one path level
+                negated = body[:1] in ('!', '^')
+                if negated:
+                    body = body[1:]
+                body = body.replace('\\', '\\\\')
+                if body.startswith(']'):
+                    body = '\\' + body
+                regex.append(('[^/' if negated else '[') + body + ']')
+                i = end
+        else:
+            regex.append(re.escape(c))
+        i += 1
+    prefix = '' if anchored else '(?:.*/)?'
+    return prefix + ''.join(regex)
+
+
+class ScanRules:
+    """
+    Decides which directories and files a scan keeps, compiled once into a few regular expressions.
+
+    Exclude patterns use gitignore syntax: a trailing '/' only matches directories, a leading '!'
+    re-includes what an earlier pattern excluded and the last matching pattern wins. Excluded
+    directories are pruned, they are never listed, so nothing below them costs time or memory.
+    Include patterns, when given, restrict the files that are kept, directories are not affected.
+    Paths are matched relative to the scan root with '/' as separator on every platform.
+
+    @params
+    exclude: list[str]: gitignore-style patterns (default: hidden and '$' directories)
+    include: list[str]: only keep files matching one of these patterns (default: keep all)
+    max_depth: int: deepest directory level that is listed, the root is level 0 (default: unlimited)
+    min_size: int: skip files smaller than this many bytes
+    max_size: int: skip files larger than this many bytes
+    extensions: list[str]: only keep files with these extensions, e.g. ['.jpg', '.pdf']
+    exclude_extensions: list[str]: skip files with these extensions, e.g. ['.vmdk', '.iso']
+    """
+
+    def __init__(self, exclude=DEFAULT_EXCLUDES, include=(), max_depth: int = None, min_size: int = None,
+                 max_size: int = None, extensions=None, exclude_extensions=None):
+        self.exclude = tuple(pattern for pattern in (p.strip() for p in exclude)
+                             if pattern and not pattern.startswith('#'))
+        self.include = tuple(include)
+        self.max_depth = max_depth
+        self.min_size = min_size
+        self.max_size = max_size
+        self.extensions = frozenset(ext.lower() for ext in extensions) if extensions else None
+        self.exclude_extensions = frozenset(ext.lower() for ext in exclude_extensions or ())
+        self._compile()
+
+    def _compile(self):
+        rules = []
+        for pattern in self.exclude:
+            negated = pattern.startswith('!')
+            if negated:
+                pattern = pattern[1:]
+            directory_only = pattern.endswith('/')
+            pattern = pattern.rstrip('/')
+            if pattern:
+                rules.append((translate_pattern(pattern), negated, directory_only))
+
+        # without negations a single alternation per node type answers every query
+        self._has_negations = any(negated for _, negated, _ in rules)
+        if self._has_negations:
+            self._directory_rules = [(re.compile(regex), negated) for regex, negated, _ in reversed(rules)]
+            self._file_rules = [(re.compile(regex), negated) for regex, negated, directory_only in reversed(rules)
+                                if not directory_only]
+        else:
+            self._directory_regex = self._alternation(regex for regex, _, _ in rules)
+            self._file_regex = self._alternation(regex for regex, _, directory_only in rules if not directory_only)
+        self._include_regex = self._alternation(translate_pattern(p.rstrip('/')) for p in self.include)
+        self._filters_files = bool(self.include or self.extensions is not None or self.exclude_extensions
+                                   or self.min_size is not None or self.max_size is not None)
+
+    @staticmethod
+    def _alternation(regexes):
+        regexes = list(regexes)
+        if not regexes:
+            return None
+        return re.compile('|'.join(f'(?:{regex})' for regex in regexes))
+
+    def _excluded(self, rel_path: str, is_dir: bool) -> bool:
+        if self._has_negations:
+            for regex, negated in (self._directory_rules if is_dir else self._file_rules):
+                if regex.fullmatch(rel_path):
+                    return not negated
+            return False
+        regex = self._directory_regex if is_dir else self._file_regex
+        return regex is not None and regex.fullmatch(rel_path) is not None
+
+    def prune_directory(self, rel_path: str, depth: int) -> bool:
+        """
+        Check if a directory should be left out of the scan.
+
+        @params
+        rel_path: str: path relative to the scan root, '/' separated
+        depth: int: level of the directory, children of the root are level 1
+        """
+        if self.max_depth is not None and depth > self.max_depth:
+            return True
+        return self._excluded(rel_path, True)
+
+    def skip_file(self, rel_path: str, name: str, size: int) -> bool:
+        """
+        Check if a file should be left out of the scan.
+
+        @params
+        rel_path: str: path relative to the scan root, '/' separated
+        name: str: file name
+        size: int: file size in bytes, None when unknown
+        """
+        if self._filters_files:
+            extension = os.path.splitext(name)[1].lower()
+            if self.extensions is not None and extension not in self.extensions:
+                return True
+            if extension in self.exclude_extensions:
+                return True
+            if size is not None:
+                if self.min_size is not None and size < self.min_size:
+                    return True
+                if self.max_size is not None and size > self.max_size:
+                    return True
+            if self._include_regex is not None and self._include_regex.fullmatch(rel_path) is None:
+                return True
+        return self._excluded(rel_path, False)
+
+    def key(self) -> tuple:
+        """Return a value that changes whenever the rules would select a different set of nodes."""
+        return (self.exclude, self.include, self.max_depth, self.min_size, self.max_size,
+                tuple(sorted(self.extensions)) if self.extensions is not None else None,
+                tuple(sorted(self.exclude_extensions)))
+
+    def extended(self, patterns) -> ScanRules:
+        """Return a copy of the rules with more exclude patterns appended after the existing ones."""
+        return ScanRules(self.exclude + tuple(patterns), self.include, self.max_depth, self.min_size,
+                         self.max_size, self.extensions, self.exclude_extensions)
+
+    def __getstate__(self):
+        # compiled patterns are rebuilt on load
+        return {'exclude': self.exclude, 'include': self.include, 'max_depth': self.max_depth,
+                'min_size': self.min_size, 'max_size': self.max_size, 'extensions': self.extensions,
+                'exclude_extensions': self.exclude_extensions}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._compile()
+
+    def __eq__(self, other):
+        return isinstance(other, ScanRules) and self.key() == other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+
+def child_rel_path(rel_path: str, name: str) -> str:
+    """Join a scan-root relative path and a child name with '/'."""
+    return f"{rel_path}/{name}" if rel_path else name
+
+
+def load_scan_rules(root: str, rules: ScanRules = None) -> ScanRules:
+    """
+    Return the rules for scanning root: the given rules (default: ScanRules()) extended with the
+    patterns of the root's .scanignore file, if it has one.
+    """
+    rules = rules if rules is not None else ScanRules()
+    try:
+        with open(os.path.join(root, SCAN_RULES_FILE), encoding='utf-8') as rules_file:
+            patterns = [line.rstrip('\n') for line in rules_file]
+    except OSError:
+        return rules
+    return rules.extended(patterns)
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,122 @@
+from __future__ import annotations
+import numpy as np
+from python.model.KeywordIndex import KeywordIndex, PostingList, ID_DTYPE
+
+# length of the name fragments that are indexed
+GRAM = 3
+
+
+def trigrams(text: str) -> set:
+    """Return the distinct three-character substrings of text."""
+    return {text[i:i + GRAM] for i in range(len(text) - GRAM + 1)}
+
+
+class TrigramIndex(KeywordIndex):
+    """
+    Substring index over node names, mapping every three-character substring of a lowercased name to the ids of
+    the nodes whose names contain it.
+
+    A query of three or more characters intersects the posting lists of its trigrams, which narrows the
+    candidates to the names containing all of them, and then verifies the candidates against the names. Shorter
+    queries union the lists of the trigrams containing them. Keywords are parts of the name, so matching whole
+    names also finds every keyword match and substrings crossing the separators between keywords.
+
+    The posting lists and their set operations are the ones of KeywordIndex. The reverse map holds the name a
+    node was indexed under instead of its keywords, so re-adding a node only touches the trigrams that changed.
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('ranked', False)
+        super().__init__(*args, **kwargs)
+        self.node_names: dict = {}  # node_id -> lowercased name the node is indexed under
+        self.short_names: dict = {}  # node_id -> names too short to have a trigram
+
+    @classmethod
+    def build(cls, nodes) -> TrigramIndex:
+        """
+        Build the index for many nodes at once, much faster than adding them one by one.
+
+        @params
+        nodes: iterable: nodes to index, each with a node_id
+        """
+        index = cls()
+        groups = {}
+        for node in nodes:
+            name = node.name.lower()
+            index.node_names[node.node_id] = name
+            if len(name) < GRAM:
+                index.short_names[node.node_id] = name
+            for gram in trigrams(name):
+                ids = groups.get(gram)
+                if ids is None:
+                    groups[gram] = [node.node_id]
+                else:
+                    ids.append(node.node_id)
+        index.postings = {gram: PostingList(ids) for gram, ids in groups.items()}
+        index.posting_count = sum(map(len, groups.values()))
+        index.id_space = max(index.node_names, default=-1) + 1
+        return index
+
+    def add(self, node, keywords=None):
+        """Index a node under the trigrams of its current name, replacing the ones of its previous name."""
+        name = node.name.lower()
+        node_id = node.node_id
+        previous = self.node_names.get(node_id)
+        if previous == name:
+            return
+        grams = trigrams(name)
+        if previous is not None:
+            old_grams = trigrams(previous)
+            self._unlink(node_id, old_grams - grams)
+            grams -= old_grams
+        self._link(node_id, grams)
+        self.node_names[node_id] = name
+        if len(name) < GRAM:
+            self.short_names[node_id] = name
+        else:
+            self.short_names.pop(node_id, None)
+
+    def remove(self, node):
+        """Remove a node from the trigrams of the name it was indexed under."""
+        name = self.node_names.pop(node.node_id, None)
+        if name is not None:
+            self.short_names.pop(node.node_id, None)
+            self._unlink(node.node_id, trigrams(name))
+            self._maybe_compact()
+
+    def keywords_of(self, node) -> tuple:
+        """Return the trigrams a node is indexed under, () if it is not indexed."""
+        return tuple(sorted(trigrams(self.node_names.get(node.node_id, ''))))
+
+    def search(self, term: str) -> np.ndarray:
+        """
+        Return the sorted ids of the nodes whose lowercased names contain term.
+
+        @params
+        term: str: substring to look for, compared case-insensitively
+        """
+        term = term.lower()
+        if not term:
+            return np.empty(0, dtype=ID_DTYPE)
+        if len(term) >= GRAM:
+            candidates = self.match_all(trigrams(term))
+            if len(term) == GRAM:
+                return candidates  # the trigram is the term itself, nothing to verify
+            names = self.node_names
+            return np.fromiter((node_id for node_id in candidates.tolist() if term in names[node_id]),
+                               dtype=ID_DTYPE)
+        matches = self.match_any([gram for gram in self.postings if term in gram])
+        short = [node_id for node_id, name in self.short_names.items() if term in name]
+        if short:
+            matches = np.union1d(matches, np.array(short, dtype=ID_DTYPE))
+        return matches
+
+    def compact(self):
+        """Merge the buffered changes of every posting list and rebuild the maps at their live size."""
+        super().compact()
+        self.node_names = dict(self.node_names)
+        self.short_names = dict(self.short_names)
+
+
+if __name__ == "__main__":
+    pass
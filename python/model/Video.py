@@ -4,17 +4,71 @@ import ffmpeg
 import os
 class Video(File):
     """A class representing a video file. Inherits from File."""
-    def __init__(self, path, cache):
-        super().__init__(path, cache)
+    __slots__ = ('_filetype', '_duration', '_video_codec', '_bitrate', '_frame_rate', '_audio_codec',
+                 '_metadata_loaded')
+
+    def __init__(self, path, cache, name, parent, size=None):
+        super().__init__(path, cache, name, parent, size)
         self._filetype = 'video'
         # Initialize additional attributes
-        self.duration = None
-        self.video_codec = None
-        self.bitrate = None
-        self.frame_rate = None
-        self.audio_codec = None
-        # Load video metadata
-        self._load_metadata() # This will set the above attributes
+        self._duration = None
+        self._video_codec = None
+        self._bitrate = None
+        self._frame_rate = None
+        self._audio_codec = None
+        self._metadata_loaded = False  # probed with ffmpeg on first access
+
+    def load_metadata(self):
+        """Probe the video file if it has not been probed yet."""
+        if not self._metadata_loaded:
+            self._metadata_loaded = True
+            self._load_metadata() # This will set the above attributes
+            self.metadata_updated()
+
+    def metadata_record(self) -> dict:
+        """Return the loaded metadata as a plain dict, as produced by MetadataPipeline workers."""
+        return {'duration': self._duration, 'video_codec': self._video_codec, 'bitrate': self._bitrate,
+                'frame_rate': self._frame_rate, 'audio_codec': self._audio_codec}
+
+    def apply_metadata(self, record: dict):
+        """Set the metadata from a record extracted elsewhere, without probing the file."""
+        self._duration = record.get('duration')
+        self._video_codec = record.get('video_codec')
+        self._bitrate = record.get('bitrate')
+        self._frame_rate = record.get('frame_rate')
+        self._audio_codec = record.get('audio_codec')
+        self._metadata_loaded = True
+        self.metadata_updated()
+
+    @property
+    def duration(self):
+        """Return the duration of the video in seconds."""
+        self.load_metadata()
+        return self._duration
+
+    @property
+    def video_codec(self):
+        """Return the name of the video codec."""
+        self.load_metadata()
+        return self._video_codec
+
+    @property
+    def bitrate(self):
+        """Return the video bitrate in kbps."""
+        self.load_metadata()
+        return self._bitrate
+
+    @property
+    def frame_rate(self):
+        """Return the average frame rate in frames per second."""
+        self.load_metadata()
+        return self._frame_rate
+
+    @property
+    def audio_codec(self):
+        """Return the name of the audio codec."""
+        self.load_metadata()
+        return self._audio_codec
 
     def _load_metadata(self):
         """Load metadata from the video file using ffmpeg-python."""
@@ -25,34 +79,35 @@ class Video(File):
             audio_stream = next((stream for stream in probe['streams'] if stream['codec_type'] == 'audio'), None)
 
             if video_stream:
-                self.duration = float(video_stream.get('duration', 0))
-                self.video_codec = video_stream.get('codec_name', None)
-                self.bitrate = int(video_stream.get('bit_rate', 0)) / 1000  # Convert to kbps
-                self.frame_rate = eval(video_stream['avg_frame_rate'])  # Be cautious with eval()
+                self._duration = float(video_stream.get('duration', 0))
+                self._video_codec = video_stream.get('codec_name', None)
+                self._bitrate = int(video_stream.get('bit_rate', 0)) / 1000  # Convert to kbps
+                # avg_frame_rate is a fraction such as '30000/1001', parsed instead of eval()'d
+                numerator, _, denominator = video_stream['avg_frame_rate'].partition('/')
+                denominator = float(denominator or 1)
+                self._frame_rate = float(numerator) / denominator if denominator else 0.0
 
             if audio_stream:
-                self.audio_codec = audio_stream.get('codec_name', None)
+                self._audio_codec = audio_stream.get('codec_name', None)
 
-        except ffmpeg._run.Error as e:  # Correctly catching exceptions from ffmpeg-python
+        except (ffmpeg._run.Error, OSError) as e:  # ffprobe failed, or is not installed
             print(f"Error loading video metadata for {self.path}: {e}")
 
-    def _show_video_data(self):
+    @staticmethod
+    def _show_video_data(directory_path, cache):
         """Print video metadata to the console."""
         for filename in os.listdir(directory_path):
-            if filename.endswith(('.mp4') or ('.heic') or ('m4a')):  # Filter for MP4 files, adjust as needed
+            if filename.endswith(('.mp4', '.heic', 'm4a')):  # Filter for MP4 files, adjust as needed
                 video_path = os.path.join(directory_path, filename)
-                video = Video(video_path, cache)
+                video = Video(video_path, cache, filename, None)
                 print(f"Analyzing {filename}:")
                 print(f"  Duration: {video.duration} seconds")
                 print(f"  Video Codec: {video.video_codec}")
                 print(f"  Bitrate: {video.bitrate} kbps")
                 print(f"  Frame Rate: {video.frame_rate} fps")
                 print(f"  Audio Codec: {video.audio_codec}")
-                print(f"  Size: {video.size()}")
-
-directory_path = '/Users/danielcagney/Desktop/'
+                print(f"  Size: {video.get_size()}")
 
-cache = FileSystemCache()
-video_file = Video(directory_path, cache)
-video_file._show_video_data()
 
+if __name__ == "__main__":
+    Video._show_video_data(os.path.expanduser('~/Desktop/'), FileSystemCache())
@@ -21,7 +21,7 @@ def delete_empty_directories(dir_node: Directory):
             delete_empty_directories(child)
 
             # check if the child directory is now empty and child has not been deleted
-            if not child.children and child in child.cache.values():
+            if not child.children and child.cache.contains_node(child):
                 child.delete()
 
         # delete desktop.ini files
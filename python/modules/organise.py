@@ -28,7 +28,7 @@ def sort_images(dir_node: Directory):
     @params
     dir_node: Directory: directory node to be sorted
     """
-    if dir_node.path + '/Photos' in dir_node.cache.keys():
+    if dir_node.path + '/Photos' in dir_node.cache:
         image_folder_node = dir_node.cache[dir_node.path + '/Photos']
         organise_by_date(image_folder_node)
 
@@ -40,7 +40,7 @@ def sort_music(dir_node: Directory):
     @params
     dir_node: Directory: directory node to be sorted
     """
-    if dir_node.path + '/Music' in dir_node.cache.keys():
+    if dir_node.path + '/Music' in dir_node.cache:
         music_folder_node = dir_node.cache[dir_node.path + '/Music']
         for file in music_folder_node.children[:]:
             print(file.path, file.extension)
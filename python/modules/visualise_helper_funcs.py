@@ -1,25 +1,10 @@
-import os
-import shutil
-from python.model.FileSystemNodeModel import FileSystemNode
-
 
 def analyze_storage(self):
-    """Analyzes storage usage starting from the given path."""
-    largest_files = []
-    largest_dirs = []
-
-    for dirpath, dirnames, filenames in os.walk(self.path):
-        dir_size = self.get_size()
-        largest_dirs.append((dirpath, dir_size))
-        for f in filenames:
-            fp = os.path.join(dirpath, f)
-            if os.path.isfile(fp) and not os.path.islink(fp):
-                file_size = os.path.getsize(fp)
-                largest_files.append((fp, file_size))
-
-    # Sort and get top 10 largest directories and files
-    largest_dirs.sort(key=lambda x: x[1], reverse=True)
-    largest_files.sort(key=lambda x: x[1], reverse=True)
+    """Analyzes storage usage starting from the given directory node, using the cached tree."""
+    # largest-N over the columnar store, directory sizes include everything below them
+    store = self.cache.columnar(self.path)
+    largest_dirs = [(view.path, view.size) for view in store.largest(10, directories=True)]
+    largest_files = [(view.path, view.size) for view in store.largest(10)]
 
     print("Top 10 largest directories:")
     for d in largest_dirs[:10]:
@@ -1,32 +1,243 @@
-import os
 import threading
 from dotenv import load_dotenv
-from PyQt5.QtWidgets import QWidget, QVBoxLayout, QLabel, QLineEdit, QListWidget, QListWidgetItem, QStackedLayout, QPushButton
-from PyQt5.QtGui import QFont, QIcon, QPixmap
-from PyQt5.QtCore import Qt, QSize
+from PyQt5.QtWidgets import QWidget, QVBoxLayout, QLabel, QLineEdit, QListView, QStackedLayout, QPushButton, QCompleter, QCheckBox, QStyledItemDelegate, QStyle, QApplication
+from PyQt5.QtGui import QFont, QIcon, QPixmap, QFontMetrics, QPalette, QColor
+from PyQt5.QtCore import Qt, QSize, QRect, QTimer, QStringListModel, QThread, pyqtSignal, QAbstractListModel, QModelIndex
 from python.model.FileSystemNodeModel import *
 from python.model.FileSystemCache import FileSystemCache
+from python.model.RankedSearch import PAGE_SIZE
 
 load_dotenv()
 
+# the full search runs once typing pauses for this long, suggestions are shown on every keystroke
+SEARCH_DELAY_MS = 250
+SUGGESTION_COUNT = 10
+# size of the icon and space around the text of a result row
+RESULT_ICON_SIZE = 32
+RESULT_PADDING = 4
+
+# Dictionary mapping file extensions to icon paths
+ICON_PATHS = {
+    'txt': 'ui/images/icons/txt_icon.png',
+    'doc': 'ui/images/icons/word_icon.png',
+    'docx': 'ui/images/icons/docx_icon.png',
+    'xls': 'ui/images/icons/xls_icon.png',
+    'xlsx': 'ui/images/icons/xlxs_icon.png',
+    'ppt': 'ui/images/icons/ppt_icon.png',
+    'pptx': 'ui/images/icons/pptx_icon.png',
+    'jpeg': 'ui/images/icons/jpeg_icon.png',
+    'jpg': 'ui/images/icons/image_icon.png',
+    'gif': 'ui/images/icons/image_icon.png',
+    'png': 'ui/images/icons/png_icon.png',
+    'mp3': 'ui/images/icons/music_icon.png',
+    'mp4': 'ui/images/icons/video_icon.png',
+    'pdf': 'ui/images/icons/pdf_icon.png',
+    'py': 'ui/images/icons/python_icon.png',
+    'html': 'ui/images/icons/html_icon.png',
+    'js': 'ui/images/icons/js_icon.png',
+    'java': 'ui/images/icons/java_icon.png',
+    'json': 'ui/images/icons/json_icon.png',
+    'cpp': 'ui/images/icons/cpp_icon.png',
+    'c': 'ui/images/icons/c_icon.png',
+    'mov': 'ui/images/icons/mov_icon.png',
+    'mkv': 'ui/images/icons/mkv_icon.png',
+    'zip': 'ui/images/icons/zip_icon.png',
+    'rar': 'ui/images/icons/rar_icon.png',
+
+    # ... add more mappings as needed
+}
+
+
+class SearchWorker(QThread):
+    """
+    Runs ranked searches and completions on a background thread, so typing never waits for the cache lock,
+    which is held while an index is built or the scanner writes.
+
+    Only the latest request is kept: a request made while a search runs replaces the one still waiting, and
+    every new query supersedes the earlier ones, whose results are dropped instead of emitted. Loading
+    another page of the current query keeps its generation. Completions wait in their own slot the same way
+    and run before a waiting search, they take a fraction of a millisecond.
+    """
+    resultsReady = pyqtSignal(int, int, list, int)  # generation, offset, page of nodes, total number of matches
+    suggestionsReady = pyqtSignal(str, list)  # word, keywords starting with it
+
+    def __init__(self, cache, parent=None):
+        super().__init__(parent)
+        self.cache = cache
+        self._condition = threading.Condition()
+        self._request = None  # (generation, text, offset, fuzzy) waiting to run
+        self._word = None  # word waiting to be completed
+        self._generation = 0
+        self._stopped = False
+
+    def search(self, text: str, fuzzy: bool) -> int:
+        """Start a new query, superseding the earlier ones, and return its generation."""
+        with self._condition:
+            self._generation += 1
+            self._request = (self._generation, text, 0, fuzzy)
+            self._condition.notify()
+            return self._generation
+
+    def load_page(self, generation: int, text: str, offset: int, fuzzy: bool):
+        """Ask for the page of a query starting at offset, ignored if the query was superseded."""
+        with self._condition:
+            if generation == self._generation:
+                self._request = (generation, text, offset, fuzzy)
+                self._condition.notify()
+
+    def complete(self, word: str):
+        """Ask for the keywords starting with word, replacing the word still waiting."""
+        with self._condition:
+            self._word = word
+            self._condition.notify()
+
+    def cancel(self):
+        """Drop the waiting request and the results of the running one."""
+        with self._condition:
+            self._generation += 1
+            self._request = None
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self.wait()
+
+    def run(self):
+        while True:
+            with self._condition:
+                while self._request is None and self._word is None and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                word, self._word = self._word, None
+                if word is None:
+                    request, self._request = self._request, None
+            if word is not None:
+                self.suggestionsReady.emit(word, self.cache.complete(word, SUGGESTION_COUNT))
+                continue
+            generation, text, offset, fuzzy = request
+            try:
+                page, total = self.cache.ranked_search(text, PAGE_SIZE, offset, fuzzy=fuzzy, substring=not fuzzy)
+            except Exception as e:
+                print(f"Search for {text!r} failed: {e}")
+                continue
+            if generation == self._generation:
+                self.resultsReady.emit(generation, offset, page, total)
+
+
+class SearchResultsModel(QAbstractListModel):
+    """
+    Results of the current search, one row per node, loaded a page at a time.
+
+    Views ask for the next page through fetchMore() when they are scrolled to the end; the model only
+    forwards that as moreRequested, the page arrives later through append_results().
+    """
+    PathRole = Qt.UserRole + 1
+    moreRequested = pyqtSignal()
 
-# Custom widget that includes a label for the filename and a label for the file path
-class FileListItem(QWidget):
-    def __init__(self, filename, filepath, parent=None):
-        super(FileListItem, self).__init__(parent)
-        self.layout = QVBoxLayout(self)  # Use QVBoxLayout for vertical stacking
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.nodes = []
+        self.total = 0
+        self.loading = False  # a page was requested and has not arrived yet
+        self._icons = {}  # icon path -> QIcon, shared by every row with that icon
+
+    def set_results(self, nodes: list, total: int):
+        """Replace the results with the first page of a new search."""
+        self.beginResetModel()
+        self.nodes = list(nodes)
+        self.total = total
+        self.loading = False
+        self.endResetModel()
+
+    def append_results(self, nodes: list):
+        """Add the next page of the current search."""
+        self.loading = False
+        if nodes:
+            self.beginInsertRows(QModelIndex(), len(self.nodes), len(self.nodes) + len(nodes) - 1)
+            self.nodes.extend(nodes)
+            self.endInsertRows()
+
+    def clear(self):
+        self.set_results([], 0)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.nodes)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.loading and len(self.nodes) < self.total
+
+    def fetchMore(self, parent=QModelIndex()):
+        if self.canFetchMore(parent):
+            self.loading = True
+            self.moreRequested.emit()
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self.nodes):
+            return None
+        node = self.nodes[index.row()]
+        if role == Qt.DisplayRole:
+            return node.name
+        if role in (self.PathRole, Qt.ToolTipRole):
+            return node.path
+        if role == Qt.DecorationRole:
+            return self._icon(node)
+        return None
+
+    def _icon(self, node) -> QIcon:
+        # directories and files without an extension get the folder icon, the node type needs no stat call
+        if isinstance(node, Directory) or '.' not in node.name:
+            icon_path = 'ui/images/icons/folder_icon.png'
+        else:
+            icon_path = ICON_PATHS.get(node.extension().lower()[1:], 'ui/images/icons/default_icon.png')
+        icon = self._icons.get(icon_path)
+        if icon is None:
+            icon = self._icons[icon_path] = QIcon(QPixmap(icon_path))
+        return icon
 
-        self.filenameLabel = QLabel(filename)
-        self.filenameLabel.setStyleSheet("font-size: 16px;")  # Larger font size for filenames
-        self.filepathLabel = QLabel(filepath)
-        self.filepathLabel.setStyleSheet(
-            "color: grey; font-size: 12px;")  # Smaller font size and grey color for filepaths
 
-        self.layout.addWidget(self.filenameLabel)
-        self.layout.addWidget(self.filepathLabel)
-        self.layout.setContentsMargins(10, 0, 0, 0)  # Remove margins if needed
+class SearchResultDelegate(QStyledItemDelegate):
+    """Paints a result row: the icon, the file name and below it the path in smaller grey text."""
 
-        self.setLayout(self.layout)
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.nameFont = QFont()
+        self.nameFont.setPixelSize(16)  # Larger font size for filenames
+        self.pathFont = QFont()
+        self.pathFont.setPixelSize(12)  # Smaller font size for filepaths
+        self.nameHeight = QFontMetrics(self.nameFont).height()
+        self.pathHeight = QFontMetrics(self.pathFont).height()
+
+    def sizeHint(self, option, index):
+        height = max(RESULT_ICON_SIZE, self.nameHeight + self.pathHeight) + 2 * RESULT_PADDING
+        return QSize(option.rect.width(), height)
+
+    def paint(self, painter, option, index):
+        self.initStyleOption(option, index)
+        style = option.widget.style() if option.widget is not None else QApplication.style()
+        # selection and hover background only, the text is drawn below
+        style.drawPrimitive(QStyle.PE_PanelItemViewItem, option, painter, option.widget)
+
+        painter.save()
+        rect = option.rect.adjusted(RESULT_PADDING, RESULT_PADDING, -RESULT_PADDING, -RESULT_PADDING)
+        icon = index.data(Qt.DecorationRole)
+        if icon is not None:
+            icon_top = rect.top() + (rect.height() - RESULT_ICON_SIZE) // 2
+            icon.paint(painter, QRect(rect.left(), icon_top, RESULT_ICON_SIZE, RESULT_ICON_SIZE))
+        text_left = rect.left() + RESULT_ICON_SIZE + 10
+        width = rect.right() - text_left
+        selected = option.state & QStyle.State_Selected
+        painter.setFont(self.nameFont)
+        painter.setPen(option.palette.color(QPalette.HighlightedText if selected else QPalette.Text))
+        name = QFontMetrics(self.nameFont).elidedText(index.data(Qt.DisplayRole), Qt.ElideRight, width)
+        painter.drawText(QRect(text_left, rect.top(), width, self.nameHeight), Qt.AlignLeft | Qt.AlignVCenter, name)
+        painter.setFont(self.pathFont)
+        painter.setPen(option.palette.color(QPalette.HighlightedText) if selected else QColor('grey'))
+        path = QFontMetrics(self.pathFont).elidedText(index.data(SearchResultsModel.PathRole), Qt.ElideMiddle, width)
+        painter.drawText(QRect(text_left, rect.top() + self.nameHeight, width, self.pathHeight),
+                         Qt.AlignLeft | Qt.AlignVCenter, path)
+        painter.restore()
 
 
 class SearchBar(QLineEdit):
@@ -54,12 +265,21 @@ class SearchWindow(QWidget):
     def __init__(self, window_index: int, fileSystemModel):
         super().__init__()
         self.fileSystemModel = fileSystemModel
-        self.all_possible_results = [node for node in fileSystemModel.cache.body.values()]
         self._window_index = window_index
+        # build the substring and field indexes while the user starts typing, instead of on the first keystroke
+        threading.Thread(target=fileSystemModel.cache.trigram_index, daemon=True).start()
+        threading.Thread(target=fileSystemModel.cache.field_index, daemon=True).start()
+        # searches run on the worker, results come back to on_results_ready on the GUI thread
+        self.searchWorker = SearchWorker(fileSystemModel.cache, self)
+        self.searchWorker.resultsReady.connect(self.on_results_ready)
+        self.searchWorker.suggestionsReady.connect(self.on_suggestions_ready)
+        self.searchWorker.start()
+        if QApplication.instance() is not None:
+            QApplication.instance().aboutToQuit.connect(self.searchWorker.stop)
+        self.search_generation = 0  # generation of the query whose results are shown
         self.initUI()
 
     def initUI(self):
-        self.all_possible_results = []     # Replace with actual search results
         self.setWindowTitle("Search Example")
         self.setGeometry(100, 100, 800, 600)
 
@@ -68,6 +288,25 @@ class SearchWindow(QWidget):
         self.searchBar = SearchBar(self)
         layout.addWidget(self.searchBar)
 
+        # fuzzy mode matches keywords with typos instead of substrings of file names
+        self.fuzzyCheckBox = QCheckBox("Fuzzy keyword search (tolerates typos)", self)
+        self.fuzzyCheckBox.toggled.connect(lambda _: self.run_search())
+        layout.addWidget(self.fuzzyCheckBox)
+
+        # suggestions complete the last word of the query from the keyword lexicon
+        self.suggestionModel = QStringListModel(self)
+        self.completer = QCompleter(self.suggestionModel, self)
+        self.completer.setCaseSensitivity(Qt.CaseInsensitive)
+        self.completer.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
+        self.completer.activated[str].connect(self.on_suggestion_selected)
+        self.searchBar.setCompleter(self.completer)
+
+        # restarted by every keystroke, runs the search once the user stops typing
+        self.searchTimer = QTimer(self)
+        self.searchTimer.setSingleShot(True)
+        self.searchTimer.setInterval(SEARCH_DELAY_MS)
+        self.searchTimer.timeout.connect(self.run_search)
+
         # Stacked layout allows to switch between different widgets in the same area
         self.stackedLayout = QStackedLayout()
 
@@ -75,9 +314,15 @@ class SearchWindow(QWidget):
         self.placeholderWidget = QLabel("")
         self.placeholderWidget.setAlignment(Qt.AlignCenter)
 
-        # Results list for when there are search results
-        self.resultsList = QListWidget(self)
-        self.resultsList.setIconSize(QSize(32, 32))  # Set the size of the icons
+        # Results list for when there are search results, the delegate only paints the visible rows
+        self.resultsModel = SearchResultsModel(self)
+        self.resultsModel.moreRequested.connect(self.load_more_results)
+        self.resultsList = QListView(self)
+        self.resultsList.setModel(self.resultsModel)
+        self.resultsList.setItemDelegate(SearchResultDelegate(self.resultsList))
+        self.resultsList.setUniformItemSizes(True)  # rows are laid out without asking every row for its size
+        self.resultsList.setSpacing(4)
+        self.search_text = ''
 
         # Add both the placeholder and the results list to the stacked layout
         self.stackedLayout.addWidget(self.placeholderWidget)
@@ -91,78 +336,63 @@ class SearchWindow(QWidget):
         self.setLayout(layout)
 
     def on_search_text_changed(self, text):
-        self.resultsList.clear()
-        self.resultsList.setSpacing(4)
+        self.update_suggestions(text)
+        self.searchTimer.start()
+
+    def update_suggestions(self, text):
+        """Ask the worker for completions of the last word of text, ranked by how many files contain them."""
+        word = text.rpartition(' ')[2]
+        if word:
+            self.searchWorker.complete(word)
+        else:
+            self.suggestionModel.setStringList([])
+
+    def on_suggestions_ready(self, word, keywords):
+        """Offer the completions of word, unless the text has changed since they were asked for."""
+        head, _, current = self.searchBar.text().rpartition(' ')
+        if current != word:
+            return
+        head = head + ' ' if head else ''
+        self.suggestionModel.setStringList([head + keyword for keyword in keywords if keyword != word.lower()])
+
+    def on_suggestion_selected(self, text):
+        # a picked suggestion is searched right away instead of after the pause
+        self.searchTimer.stop()
+        self.run_search(text)
+
+    def run_search(self, text=None):
+        """Start searching for text on the worker, superseding the running search."""
+        if text is None:
+            text = self.searchBar.text()
+        # Convert the search text to lowercase for a case-insensitive search
+        self.search_text = text.lower()
 
         if text:
-            # Convert the search text to lowercase for a case-insensitive search
-            search_text = text.lower()
-
-            # Filter the results based on the search text
-            filtered_results = self.fileSystemModel.search(search_text)
-            print(f"FILTERED RESULTS:\n{filtered_results}")
-            # Show the results list if there is text
-            self.stackedLayout.setCurrentWidget(self.resultsList)
-
-            # Dictionary mapping file extensions to icon paths
-            icon_paths = {
-                'txt': 'ui/images/icons/txt_icon.png',
-                'doc': 'ui/images/icons/word_icon.png',
-                'docx': 'ui/images/icons/docx_icon.png',
-                'xls': 'ui/images/icons/xls_icon.png',
-                'xlsx': 'ui/images/icons/xlxs_icon.png',
-                'ppt': 'ui/images/icons/ppt_icon.png',
-                'pptx': 'ui/images/icons/pptx_icon.png',
-                'jpeg': 'ui/images/icons/jpeg_icon.png',
-                'jpg': 'ui/images/icons/image_icon.png',
-                'gif': 'ui/images/icons/image_icon.png',
-                'png': 'ui/images/icons/png_icon.png',
-                'mp3': 'ui/images/icons/music_icon.png',
-                'mp4': 'ui/images/icons/video_icon.png',
-                'pdf': 'ui/images/icons/pdf_icon.png',
-                'py': 'ui/images/icons/python_icon.png',
-                'html': 'ui/images/icons/html_icon.png',
-                'js': 'ui/images/icons/js_icon.png',
-                'java': 'ui/images/icons/java_icon.png',
-                'json': 'ui/images/icons/json_icon.png',
-                'cpp': 'ui/images/icons/cpp_icon.png',
-                'c': 'ui/images/icons/c_icon.png',
-                'mov': 'ui/images/icons/mov_icon.png',
-                'mkv': 'ui/images/icons/mkv_icon.png',
-                'zip': 'ui/images/icons/zip_icon.png',
-                'rar': 'ui/images/icons/rar_icon.png',
-
-                # ... add more mappings as needed
-            }
-
-            for file_node in filtered_results:
-                # Extract the file name and path
-                file_name = file_node.name
-                filepath = file_node.path
-
-                # Check if it's a folder or if there's no file extension
-                if os.path.isdir(filepath) or '.' not in filepath:
-                    icon_path = 'ui/images/icons/folder_icon.png'
-                else:
-                    # Get the file extension and convert it to lower case
-                    extension = file_node.extension().lower()[1:]
-                    # Get the corresponding icon path or a default one
-                    icon_path = icon_paths.get(extension, 'ui/images/icons/default_icon.png')
-
-                item = QListWidgetItem(QIcon(QPixmap(icon_path)), "")
-                fileItemWidget = FileListItem(file_name, filepath)
-
-                # Set size hint for the item
-                item_size = QSize(fileItemWidget.sizeHint().width(), fileItemWidget.sizeHint().height())
-                item.setSizeHint(item_size)
-
-                self.resultsList.addItem(item)
-                self.resultsList.setItemWidget(item, fileItemWidget)
-
+            # the shown results stay until the first page of the new search arrives
+            self.search_generation = self.searchWorker.search(self.search_text, self.fuzzyCheckBox.isChecked())
         else:
             # Show the placeholder when there is no text
+            self.searchWorker.cancel()
+            self.resultsModel.clear()
             self.stackedLayout.setCurrentWidget(self.placeholderWidget)
 
+    def load_more_results(self):
+        """Ask the worker for the next page of the current search, the view calls this when scrolled to the end."""
+        self.searchWorker.load_page(self.search_generation, self.search_text, self.resultsModel.rowCount(),
+                                    self.fuzzyCheckBox.isChecked())
+
+    def on_results_ready(self, generation, offset, page, total):
+        """Show a page of results from the worker, pages of superseded searches are ignored."""
+        if generation != self.search_generation:
+            return
+        if offset == 0:
+            self.resultsModel.set_results(page, total)
+            self.resultsList.scrollToTop()
+            self.stackedLayout.setCurrentWidget(self.resultsList)
+        elif offset == self.resultsModel.rowCount():
+            self.resultsModel.append_results(page)
+        print(f"FILTERED RESULTS: {self.resultsModel.rowCount()} of {total}")
+
     @property
     def window_index(self):
         return self._window_index
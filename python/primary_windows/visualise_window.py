@@ -2,6 +2,7 @@ import os, webbrowser
 from PyQt5.QtCore import Qt
 from PyQt5.QtGui import QFont
 from collections import defaultdict
+import numpy as np
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QPushButton
 from PyQt5.QtWidgets import QLabel, QListWidget, QMessageBox
 from python.model.FileSystemNodeModel import File, Directory
@@ -112,6 +113,14 @@ class VisualiseWindow(QWidget):
         self.visualize_sizes(labels, parents, values)
 
     def calculate_folder_sizes(self, folder_path):
+        # scanned folders are summed from the columnar store instead of walking the disk
+        store = self.fileSystemModel.cache.columnar(folder_path)
+        if store is not None:
+            file_sizes = defaultdict(int)
+            for extension, size in store.extension_sizes().items():
+                file_sizes[extension or 'No Extension'] += size
+            return file_sizes
+
         file_sizes = defaultdict(int)
         for root, dirs, files in os.walk(folder_path):
             for file in files:
@@ -139,10 +148,12 @@ class VisualiseWindow(QWidget):
     def update_directory_sizes(self, node):
         if isinstance(node, File):
             return node.size
-        total_size = 0
-        for child in node.children:
-            total_size += self.update_directory_sizes(child)
-        node.size = total_size
+        # roll the sizes up with vectorized sums over the columnar store, then write the
+        # totals back to the directory nodes
+        store = node.cache.columnar(node.path)
+        totals = store.subtree_sizes()
+        for row in np.flatnonzero(store.is_directory()):
+            store.nodes[row].size = int(totals[row])
         return node.size
 
     def calculate_directory_structure(self, folder_path):
@@ -4,18 +4,43 @@ from PyQt5.QtCore import Qt, pyqtSignal, QThread
 from PyQt5.QtGui import QPixmap
 from python.model.FileSystemCache import FileSystemCache
 from python.model.FileSystemNodeModel import *
+from python.model.FileSystemScanner import FileSystemScanner, DEFAULT_BATCH_SIZE
+from python.model.CachePersister import CachePersister
+from python.model.MetadataPrefetcher import MetadataPrefetcher
+from python.model.ContentIndexer import ContentIndexer
+from python.model.ScanRules import load_scan_rules
+from python.model.FileSystemWatcher import FileSystemWatcher
+from python.model.SQLiteTreeStore import SQLiteTreeStore, TreeStorePersister, DEFAULT_LOAD_DEPTH
+from python.model.BinarySnapshot import SnapshotPersister
 import os
 
+# directories spot checked before a cached tree is shown, and the share of them allowed to be stale
+WARM_START_SAMPLE_SIZE = 64
+WARM_START_MAX_STALE_FRACTION = 0.5
+# 'pickle' saves the whole cache in one file, 'sqlite' keeps the tree in a database that is
+# loaded per selected directory, a few levels deep with deeper directories read when they are
+# opened, and updated per changed directory, 'snapshot' writes a binary
+# snapshot that is memory mapped and built lazily on load
+CACHE_BACKEND = 'pickle'
+# index the text of .txt, .pdf and .docx files in the background for content: queries
+CONTENT_INDEX = True
+
+
 class SplashWindow(QWidget):
     """
     Splash window for the application. This is the first window that the user sees.
     It allows the user to select a folder to scan and then proceeds to the main window.
     """
     fileSystemModelReady = pyqtSignal(object)
+    fileSystemModelUpdated = pyqtSignal(object)  # the watcher applied changes made on disk to the shown model
+    scanFinished = pyqtSignal(object)  # shown model finished filling in or was revalidated
+    scanProgress = pyqtSignal(int, int, object)  # directories, files, bytes scanned so far
 
     def __init__(self):
         super().__init__()
         self.scanThread = None
+        self.treeStore = None  # SQLiteTreeStore the tree is loaded from and saved to, see CACHE_BACKEND
+        self.modelShown = False
         self.folderSelection = None
         self.setGeometry(100, 100, 1000, 600)
         self.initUI()
@@ -135,17 +160,66 @@ class SplashWindow(QWidget):
         """
         This method is called when the user clicks the scan button.
         """
-        selected_path = self.folderSelection.currentData()  # Get the selected path
-        FSCache = FileSystemCache()
+        selected_path = os.path.normpath(self.folderSelection.currentData())  # Get the selected path
         # attempt to load from cache
-        if not FSCache.load_from_file() or selected_path not in FSCache.body:
+        if CACHE_BACKEND == 'sqlite':
+            self.treeStore = SQLiteTreeStore()
+            FSCache = FileSystemCache()
+            # only the top of the selected tree is read, not everything that was ever scanned
+            if self.treeStore.load_subtree(selected_path, FSCache, max_depth=DEFAULT_LOAD_DEPTH) is None:
+                FSCache = None
+        elif CACHE_BACKEND == 'snapshot':
+            self.treeStore = None
+            FSCache = FileSystemCache.load_snapshot()
+        else:
+            self.treeStore = None
+            FSCache = FileSystemCache.load_from_file()
+        cachedModel = FSCache.get(selected_path) if FSCache is not None else None
+
+        if not isinstance(cachedModel, Directory):
             print('no cache found, scanning')
+            self.start_scan(selected_path, FSCache or FileSystemCache())
+            return
 
-            self.scanThread = ScanThread(selected_path, FSCache)
-            self.scanThread.scanComplete.connect(self.handle_scan_complete)
-            self.scanThread.start()
-        else:
-            fileSystemModel = FSCache[selected_path]
+        stale = FSCache.stale_directories(selected_path, WARM_START_SAMPLE_SIZE)
+        known = FSCache.snapshot.directory_count() - 1 if FSCache.snapshot is not None else len(FSCache.dir_mtimes)
+        checked = min(WARM_START_SAMPLE_SIZE, known) + 1
+        if len(stale) > checked * WARM_START_MAX_STALE_FRACTION:
+            # too much has changed for the snapshot to be worth showing, open once the rescan has
+            # refreshed the top level
+            print(f'cache mostly outdated ({len(stale)}/{checked} stale), rescanning')
+            self.start_scan(selected_path, FSCache)
+            return
+
+        # stale-while-revalidate: show the cached tree now and bring it up to date in the background
+        self.show_model(cachedModel)
+        self.start_scan(selected_path, FSCache)
+
+    def start_scan(self, path, cache):
+        """
+        Scan path in a background thread. The main window opens as soon as the top level of the
+        tree is ready and the rest of the tree fills in while it is shown.
+        """
+        self.scanThread = ScanThread(path, cache, tree_store=self.treeStore)
+        self.scanThread.topLevelReady.connect(self.show_model)
+        self.scanThread.scanProgress.connect(self.scanProgress)
+        self.scanThread.scanComplete.connect(self.handle_scan_complete)
+        self.scanThread.treeChanged.connect(self.fileSystemModelUpdated)
+        self.scanThread.start()
+
+    def stop_scan(self):
+        """
+        Cancel the background work of the scan thread before the application quits.
+        """
+        if self.scanThread is not None:
+            self.scanThread.cancel()
+
+    def show_model(self, fileSystemModel):
+        """
+        Hand the (possibly still filling in) model to the main window, once.
+        """
+        if not self.modelShown:
+            self.modelShown = True
             self.fileSystemModelReady.emit(fileSystemModel)
             self.close()
 
@@ -153,25 +227,107 @@ class SplashWindow(QWidget):
         """
         This method is called when the scan thread completes.
         """
-        if fileSystemModel:
-            self.fileSystemModelReady.emit(fileSystemModel)
-        self.close()
+        if fileSystemModel is None:
+            self.close()
+        elif self.modelShown:
+            self.scanFinished.emit(fileSystemModel)
+        else:
+            self.show_model(fileSystemModel)
 
 
 class ScanThread(QThread):
     """
     This class is a QThread that scans the file system in the background.
+    workers sets the size of the directory-listing pool, None picks it from the filesystem type.
+    With incremental set, directories already in the cache are only re-listed if their mtime changed.
+    Progress is emitted every batch_size nodes while the scan runs.
+    rules filters what is scanned, None uses the default rules plus the path's .scanignore file.
+    Once the scan is done a FileSystemWatcher keeps the tree in sync and treeChanged is emitted
+    after every batch of changes it applied. With CONTENT_INDEX set a ContentIndexer indexes the text of
+    documents after the scan and again after every batch of changes.
+    With a tree_store the tree is persisted to that SQLiteTreeStore instead of the pickle file.
     """
     scanComplete = pyqtSignal(object)
+    topLevelReady = pyqtSignal(object)  # root node, its immediate children exist
+    scanProgress = pyqtSignal(int, int, object)  # directories, files, bytes scanned so far
+    treeChanged = pyqtSignal(object)  # root node, the watcher applied changes made on disk
 
-    def __init__(self, path, cache):
+    def __init__(self, path, cache, workers=None, incremental=True, batch_size=DEFAULT_BATCH_SIZE, rules=None,
+                 tree_store=None):
         super().__init__()
         self.path = path
         self.cache = cache
+        self.workers = workers
+        self.incremental = incremental
+        self.batch_size = batch_size
+        self.rules = rules
+        self.tree_store = tree_store
+        self.prefetcher = None
+        self.content_indexer = None
+        self.watcher = None
+        self.cancelled = False  # set by cancel(), no background pass is started afterwards
 
     def run(self):
         if os.path.isdir(self.path):
-            fileSystemModel = Directory(self.path, self.cache, name=os.path.dirname(self.path), parent=None)
+            # checkpoints are written in the background while scanning, the persister stays
+            # attached afterwards so later changes are saved too
+            persister = self.cache.persister
+            if persister is None:
+                if self.tree_store is not None:
+                    persister = TreeStorePersister(self.cache, self.tree_store, self.path).start()
+                elif CACHE_BACKEND == 'snapshot':
+                    persister = SnapshotPersister(self.cache, self.path).start()
+                else:
+                    persister = CachePersister(self.cache).start()
+            if self.cache.snapshot is not None:
+                # the rescan compares against every cached directory, build the rest of the tree
+                # here instead of on the UI thread
+                self.cache.snapshot.materialize()
+            scanner = FileSystemScanner(self.path, self.cache, name=os.path.dirname(self.path), workers=self.workers,
+                                        incremental=self.incremental,
+                                        on_progress=self.scanProgress.emit,
+                                        on_top_level=self.topLevelReady.emit,
+                                        batch_size=self.batch_size,
+                                        rules=self.rules or load_scan_rules(self.path))
+            fileSystemModel = scanner.scan()
+            persister.flush()
             self.scanComplete.emit(fileSystemModel)  # Emit the model after scanning
+            # read image, music, document and video metadata now that the structure is known, save it once done
+            # assigned before the flag is checked, cancel() sets the flag before reading it
+            self.prefetcher = MetadataPrefetcher(self.cache, processes=os.cpu_count(), on_done=persister.flush)
+            if not self.cancelled:
+                self.prefetcher.start()
+            if CONTENT_INDEX and self.cache.content_index is None:
+                self.content_indexer = ContentIndexer(self.cache, processes=os.cpu_count())
+                if not self.cancelled:
+                    self.content_indexer.start()
+            # from now on changes on disk are applied as they happen instead of by rescanning
+            if self.cache.watcher is None:
+                self.watcher = FileSystemWatcher(fileSystemModel, self.cache,
+                                                 on_change=lambda paths: self.on_tree_changed(fileSystemModel, paths)
+                                                 ).start()
         else:
             self.scanComplete.emit(None)  # Emit None or handle error appropriately
+
+    def cancel(self):
+        """
+        Stop the background metadata and content indexing passes, called when the application quits so exiting
+        does not wait for them.
+        """
+        self.cancelled = True
+        if self.prefetcher is not None:
+            self.prefetcher.cancel()
+        if self.content_indexer is not None:
+            self.content_indexer.cancel()
+
+    def on_tree_changed(self, fileSystemModel, paths):
+        """
+        Called by the watcher with the directories it changed, persists them and notifies the UI.
+        """
+        persister = self.cache.persister
+        if isinstance(persister, TreeStorePersister):
+            # files modified in place leave their directory's mtime alone, name them explicitly
+            persister.directories_changed(paths)
+        if self.content_indexer is not None:
+            self.content_indexer.schedule()
+        self.treeChanged.emit(fileSystemModel)